@@ -7,19 +7,30 @@
 
 import argparse
 import logging
+import os
 import time
 import yaml
 
 from datetime import datetime
 
+from nvme import endurance
+from nvme import events
 from nvme import utils as n_utils
 from nvme import sedutil
 
+from tests import capture
 from tests import erase
+from tests import exporter
 from tests import firmware
 from tests import namespaces
 from tests import opal
 from tests import perf
+from tests import power
+from tests import replay
+from tests import scheduler
+from tests import soak
+from tests import thermal
+from tests import watchdog
 
 # setup common logging handler
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -45,10 +56,15 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument("-r", "--report", required=True,
                         help=("The path for the output report to be put into.  Will be standard text."))
 
+    parser.add_argument("-s", "--soak", action="store_true",
+                        help=("Soak the drive for the hours set in the soak "
+                              "section of the config, rather than running "
+                              "the tests once."))
+
     return parser
 
 
-def write_report(tests, drive, output_path):
+def write_report(tests, drive, output_path, soak_run=None):
     r = open(output_path, "w+")
 
     r.write("NVMe Disk Tester\n")
@@ -66,6 +82,12 @@ def write_report(tests, drive, output_path):
     r.write(f"Tests Failed: {len([t for t in tests if t.result() is False and t.result() is not None])}\n")
     r.write(f"Tests Ignored: {len([t for t in tests if t.result() is None])}\n\n")
 
+    if soak_run is not None:
+        r.write("Soak Results:\n")
+        for line in soak_run.report_lines():
+            r.write(f"  {line}\n")
+        r.write("\n")
+
     for test in tests:
         r.write(
             '--------------------------------------------------------------------------------\n')
@@ -81,10 +103,18 @@ def write_report(tests, drive, output_path):
 
         # Not ignored, finish results
         r.write(f'Test Passed: {test.result()}\n')
+        if test.hung:
+            r.write('Test Hung: True\n')
         r.write(
             '--------------------------------------------------------------------------------\n')
+        if test.endurance is not None:
+            r.write('Endurance Projection:\n')
+            for line in endurance.format_projection(test.endurance):
+                r.write(f'  {line}\n')
+            r.write(
+                '--------------------------------------------------------------------------------\n')
         r.write('Test Logs:\n')
-        r.write(f'{test.report()}')
+        test.write_log(r)
         r.write(
             '--------------------------------------------------------------------------------\n')
 
@@ -101,6 +131,82 @@ def restore_drive(config):
     tree = n_utils.generate_resource_tree()
     n_utils.factory_reset(tree[drive]['sn'].strip())
 
+def endurance_snapshot(config):
+    # Failing to read SMART shouldn't stop the tests
+    try:
+        return endurance.snapshot(config['drive']['name'],
+                                  config['drive'].get('media_log'))
+    except Exception as err:
+        logger.warning(f"  Unable to snapshot SMART data: {err}")
+        return None
+
+
+def project_endurance(test, before, config):
+    after = endurance_snapshot(config)
+    if before is None or after is None:
+        return
+    drive = config['drive']['name']
+    projection = endurance.project(before, after,
+                                   n_utils.get_max_disk_size(drive),
+                                   config['drive'].get('rated_tbw'))
+    # Only report on tests that wrote to the drive
+    if projection['host_bytes'] > 0:
+        test.endurance = projection
+
+
+def run_test(test, config, track_endurance=True, hang_watchdog=None):
+    # Returns False if the test raised an error
+    if hang_watchdog is not None:
+        hang_watchdog.watch(test)
+    events.publish('test_start', test=test.name())
+    try:
+        logger.info(f"Starting test: {test.name()}")
+        logger.info(f"  Description: {test.description()}")
+        before = endurance_snapshot(config) if track_endurance else None
+        test.execute()
+    except Exception as err:
+        logger.error(f"  Failure executing test: {test.name()}: {err}")
+        return False
+    finally:
+        if hang_watchdog is not None:
+            hang_watchdog.release(test)
+        events.publish('test_end', test=test.name(), result=test.result())
+    logger.info(f"  Test finished.  Result: {test.result()}")
+    project_endurance(test, before, config)
+    return True
+
+
+def run_serial(test, config, hang_watchdog=None):
+    if not run_test(test, config, hang_watchdog=hang_watchdog):
+        # cleanup the drive in case of a test failure
+        restore_drive(config)
+    else:
+        time.sleep(1)
+
+
+def run_together(batch, config, hang_watchdog=None):
+    logger.info(f"Running tests together: "
+                f"{', '.join(test.name() for test in batch)}")
+    try:
+        scheduler.provision(config['drive']['name'], batch)
+    except Exception as err:
+        logger.error(f"  Failure laying out namespaces: {err}.  Running the "
+                     "tests one at a time.")
+        restore_drive(config)
+        for test in batch:
+            test.namespace = None
+            run_serial(test, config, hang_watchdog)
+        return
+
+    # Writes from tests sharing the drive can't be told apart, so there is
+    # no endurance projection for them.
+    if not scheduler.run_batch(
+            batch, lambda test: run_test(test, config, track_endurance=False,
+                                         hang_watchdog=hang_watchdog)):
+        restore_drive(config)
+    time.sleep(1)
+
+
 def main():
     parser = init_argparse()
     args = parser.parse_args()
@@ -108,9 +214,16 @@ def main():
     with open(args.config, 'r') as config_file:
         config = yaml.safe_load(config_file)
 
+    # Test logs are spilled to disk next to the report, with fio results and
+    # other large payloads compressed
+    report_path = os.path.abspath(args.report)
+    capture.set_log_dir(os.path.splitext(report_path)[0] + '-logs')
+
     tests = [opal.OpalCapable(config),
              opal.OpalBlockSIDTest(config),
              opal.OpalLockTest(config),
+             opal.OpalPerfOverhead(config),
+             opal.OpalMultiRangeTest(config),
              namespaces.NSLayout(config),
              namespaces.ParallelIO(config),
              perf.SeqRead(config),
@@ -118,33 +231,85 @@ def main():
              perf.SeqMixed(config),
              perf.RandRead(config),
              perf.RandWrite(config),
+             perf.LBAFormatMatrix(config),
+             perf.WriteCache(config),
+             perf.PartitionAlignment(config),
+             perf.WriteCliff(config),
              namespaces.MultiNSPerf(config),
+             namespaces.NoisyNeighbor(config),
+             namespaces.NamespaceScaling(config),
+             replay.TraceReplay(config),
+             thermal.ThermalThrottle(config),
+             power.PowerStateLatency(config),
              erase.SecureEraseDrive(config),
              erase.SecureEraseWithMultiNamespaces(config),
-             firmware.ApplyNew(config)
+             erase.FormatDurationProfile(config),
+             erase.Deallocate(config),
+             firmware.ApplyNew(config),
+             firmware.ActivationDowntime(config),
+             firmware.FirmwareCycling(config)
              ]
 
+    selected = []
     for test in tests:
         if test.name() in config.get('execute', []) or config.get('execute') is None:
-            try:
-                logger.info(f"Starting test: {test.name()}")
-                logger.info(f"  Description: {test.description()}")
-                test.execute()
-            except Exception as err:
-                logger.error(f"  Failure executing test: {test.name()}: {err}")
-                # cleanup the drive in case of a test failure
-                restore_drive(config)
-            else:
-                logger.info(f"  Test finished.  Result: {test.result()}")
-                time.sleep(1)
+            selected.append(test)
         else:
             logger.info(f"Ignoring test: {test.name()}")
 
+    # Tests that don't need the whole drive can share it, on their own
+    # namespaces.  Off unless max_parallel is set.
+    general = config['test_config']['general']
+    max_parallel = min(general.get('max_parallel', 1), general['max_ns'])
+    if max_parallel > 1:
+        batches = scheduler.plan(selected, max_parallel)
+    else:
+        batches = [[test] for test in selected]
+
+    # Fail tests that stop making progress, rather than waiting forever.
+    # Diagnostics are saved next to the report.
+    hang_watchdog = None
+    if general.get('hang_timeout') is not None:
+        hang_watchdog = watchdog.Watchdog(
+            config['drive']['name'], general['hang_timeout'],
+            os.path.dirname(report_path))
+        hang_watchdog.start()
+
+    # Serve live metrics for scraping.  Off unless metrics_port is set.
+    metrics = None
+    if general.get('metrics_port') is not None:
+        metrics = exporter.Exporter(
+            config['drive']['name'], general['metrics_port'],
+            general.get('metrics_address', '127.0.0.1'))
+        metrics.start()
+
+    def run_suite():
+        events.publish('suite', tests=len(selected))
+        for batch in batches:
+            if len(batch) == 1:
+                run_serial(batch[0], config, hang_watchdog)
+            else:
+                run_together(batch, config, hang_watchdog)
+        return selected
+
+    soak_run = None
+    if args.soak:
+        # Cycles the suite, or a mix of workloads, keeping only aggregates
+        soak_run = soak.Soak(config, os.path.dirname(report_path))
+        soak_run.run(run_suite)
+    else:
+        run_suite()
+
+    if hang_watchdog is not None:
+        hang_watchdog.stop()
+    if metrics is not None:
+        metrics.stop()
+
     # cleanup any namespaces on the drive after all the tests are done
     restore_drive(config)
 
     logger.info("All tests complete.  Compiling report.")
-    write_report(tests, config['drive']['name'], args.report)
+    write_report(tests, config['drive']['name'], args.report, soak_run)
     logger.info("Test finished.")
 
 
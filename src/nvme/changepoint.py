@@ -0,0 +1,103 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import numpy as np
+
+
+def split_gains(values):
+    # The drop in squared error from splitting the series in two at each
+    # index 1..n-1, from the cumulative sums.  A large gain is a shift in the
+    # mean.
+    x = np.asarray(values, dtype=float)
+    n = len(x)
+    sums = np.cumsum(x)[:-1]
+    left = np.arange(1, n)
+    right = n - left
+    left_mean = sums / left
+    right_mean = (x.sum() - sums) / right
+    return left * right / n * (left_mean - right_mean) ** 2
+
+
+def noise_variance(values):
+    # Robust estimate of the noise variance, from the median absolute
+    # difference of neighbours, so shifts in the mean don't inflate it
+    x = np.asarray(values, dtype=float)
+    if len(x) < 2:
+        return 0.0
+    sigma = np.median(np.abs(np.diff(x))) / (0.6745 * np.sqrt(2))
+    return float(sigma ** 2)
+
+
+def detect(values, min_size=30, penalty=None):
+    """Finds the indexes where the mean of the series shifts.
+
+    Binary segmentation: each segment is split where the gain is largest,
+    while the gain is above the penalty and both sides have at least
+    min_size values.  The penalty defaults to a BIC style threshold from the
+    noise variance.
+    """
+    x = np.asarray(values, dtype=float)
+    if penalty is None:
+        penalty = 3 * noise_variance(x) * np.log(max(len(x), 2))
+
+    changepoints = []
+    pending = [(0, len(x))]
+    while pending:
+        start, end = pending.pop()
+        if end - start < 2 * min_size:
+            continue
+        gains = split_gains(x[start:end])[min_size - 1:end - start - min_size]
+        best = int(np.argmax(gains))
+        if gains[best] <= penalty:
+            continue
+        split = start + min_size + best
+        changepoints.append(split)
+        pending.extend([(start, split), (split, end)])
+    return sorted(changepoints)
+
+
+def segments(values, changepoints):
+    # The (start, end, mean) of each segment between the changepoints
+    x = np.asarray(values, dtype=float)
+    bounds = [0] + list(changepoints) + [len(x)]
+    return [(start, end, float(x[start:end].mean()))
+            for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def largest_drop(plateaus):
+    """Finds the largest downward change between neighbouring plateaus.
+
+    Takes the (start, end, mean) segments.  Returns the index of the plateau
+    after the drop and the index of the highest plateau before it, or None
+    when the mean never goes down.
+    """
+    drops = [(plateaus[i - 1][2] - plateaus[i][2], i)
+             for i in range(1, len(plateaus))]
+    drop, after = max(drops, default=(0, None))
+    if drop <= 0:
+        return None
+    before = max(range(0, after), key=lambda i: plateaus[i][2])
+    return after, before
+
+
+def spikes(values, factor=10, changepoints=()):
+    # Indexes more than factor times the median of their segment
+    x = np.asarray(values, dtype=float)
+    medians = np.zeros(len(x))
+    bounds = [0] + list(changepoints) + [len(x)]
+    for start, end in zip(bounds, bounds[1:]):
+        if end > start:
+            medians[start:end] = np.median(x[start:end])
+    return np.nonzero(x > factor * medians)[0].tolist()
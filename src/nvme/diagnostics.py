@@ -0,0 +1,93 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import utils
+
+import glob
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CMD_DMESG = '/bin/dmesg'
+
+# The controller may be what is hung, so no single capture may take longer
+CAPTURE_TIMEOUT = 60
+
+KERNEL_LOG_LINES = 200
+
+
+def get_io_completions(drive):
+    # Total reads, writes and discards completed on the drive's namespaces,
+    # from the block layer.  This moves whenever I/O is making progress,
+    # whatever is issuing it.
+    total = 0
+    for path in glob.glob(f'/sys/block/{drive}n*/stat'):
+        with open(path) as stat:
+            fields = stat.read().split()
+        # Fields 0, 4 and 11 are the reads, writes and discards completed
+        total += sum(int(fields[i]) for i in [0, 4, 11] if i < len(fields))
+    return total
+
+
+def get_controller_states():
+    states = {}
+    for path in glob.glob('/sys/class/nvme/*/state'):
+        with open(path) as state:
+            states[path.split('/')[-2]] = state.read().strip()
+    return states
+
+
+def capture(controller, output_dir):
+    """Captures what is needed to diagnose a hung controller.
+
+    Writes the controller states, the kernel log tail, the error log and
+    the telemetry log to the output directory.  Every capture is best effort
+    and time limited.  Returns the paths of the files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+
+    def save(name, text):
+        path = os.path.join(output_dir, name)
+        with open(path, 'w') as output:
+            output.write(text)
+        written.append(path)
+
+    states = get_controller_states()
+    save('controller_state.txt',
+         ''.join(f'{name}: {state}\n'
+                 for name, state in sorted(states.items())))
+
+    rc, out, err = utils.run_cmd([CMD_DMESG], fail_on_err=False,
+                                 timeout=CAPTURE_TIMEOUT)
+    save('dmesg.txt', '\n'.join(out.splitlines()[-KERNEL_LOG_LINES:]) + '\n')
+
+    rc, out, err = utils.run_cmd([utils.CMD_NVME, 'error-log',
+                                  f'/dev/{controller}', '-o', 'json'],
+                                 fail_on_err=False, timeout=CAPTURE_TIMEOUT)
+    save('error_log.json', out if rc == 0 else err)
+
+    telemetry = os.path.join(output_dir, 'telemetry.bin')
+    rc, out, err = utils.run_cmd([utils.CMD_NVME, 'telemetry-log',
+                                  f'/dev/{controller}',
+                                  f'--output-file={telemetry}'],
+                                 fail_on_err=False, timeout=CAPTURE_TIMEOUT)
+    if rc == 0:
+        written.append(telemetry)
+    else:
+        logger.warning(f'Unable to capture the telemetry log of '
+                       f'{controller}: {err}')
+    return written
@@ -0,0 +1,72 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import fw_download
+
+import ctypes
+import fcntl
+
+# Dataset Management I/O command, and the ioctl passing an I/O command
+# through the namespace block device.  The I/O command has the same layout
+# as the admin command.
+OPCODE_DSM = 0x09
+NVME_IOCTL_IO_CMD = 0xc0484e43
+IO_TIMEOUT_MS = 60 * 1000
+
+# Attribute - Deallocate (AD) in CDW11
+ATTRIBUTE_DEALLOCATE = 0x4
+
+# Ranges in a single command
+MAX_RANGES = 256
+
+
+class Range(ctypes.Structure):
+    # A Dataset Management range: context attributes, length in logical
+    # blocks and starting LBA
+    _fields_ = [('cattr', ctypes.c_uint32),
+                ('nlb', ctypes.c_uint32),
+                ('slba', ctypes.c_uint64)]
+
+
+def build_command(namespace, ranges):
+    # Returns the command deallocating the (starting LBA, number of logical
+    # blocks) ranges, and the range buffer it points to.  The buffer must be
+    # kept until the command completes.
+    if not 0 < len(ranges) <= MAX_RANGES:
+        raise ValueError(f"{len(ranges)} ranges, a command takes 1 to "
+                         f"{MAX_RANGES}")
+    buffer = (Range * len(ranges))(*[Range(nlb=blocks, slba=slba)
+                                     for slba, blocks in ranges])
+    cmd = fw_download.AdminCommand(opcode=OPCODE_DSM,
+                                   nsid=int(namespace),
+                                   addr=ctypes.addressof(buffer),
+                                   data_len=ctypes.sizeof(buffer),
+                                   cdw10=len(ranges) - 1,
+                                   cdw11=ATTRIBUTE_DEALLOCATE,
+                                   timeout_ms=IO_TIMEOUT_MS)
+    return cmd, buffer
+
+
+def deallocate(fd, namespace, ranges):
+    # Deallocates up to 256 ranges with a single Dataset Management command
+    # passed through the namespace block device open as fd.  Unlike nvme
+    # dsm, nothing is started per command, so timing the call times the
+    # command.  Returns the NVMe status, or the negated errno when the ioctl
+    # itself fails.
+    cmd, buffer = build_command(namespace, ranges)
+    try:
+        return fcntl.ioctl(fd, NVME_IOCTL_IO_CMD, cmd)
+    except OSError as err:
+        return -err.errno
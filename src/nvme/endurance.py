@@ -0,0 +1,117 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import utils
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# SMART data units are thousands of 512 byte units
+DATA_UNIT_BYTES = 512 * 1000
+
+# OCP SMART / Health Information Extended log.  Physical media units written
+# is the first 16 bytes, in bytes.
+OCP_SMART_LOG_ID = 0xc0
+OCP_SMART_LOG_LEN = 512
+
+
+def get_media_bytes_written(controller, media_log, fail_on_err=True):
+    # Bytes written to the media, from a vendor log.  Only the OCP log is
+    # understood today.
+    if media_log != 'ocp':
+        logger.warning(f'Unknown media log {media_log}')
+        return None
+
+    rc, out, err = utils.run_cmd([utils.CMD_NVME, 'get-log',
+                                  f'/dev/{controller}',
+                                  f'--log-id={OCP_SMART_LOG_ID}',
+                                  f'--log-len={OCP_SMART_LOG_LEN}'],
+                                 fail_on_err=fail_on_err)
+    data = utils.parse_hex_dump(out)
+    if rc != 0 or len(data) < 16:
+        return None
+    return int.from_bytes(data[0:16], 'little')
+
+
+def snapshot(controller, media_log=None):
+    smart = utils.get_smart_data(controller)
+    snap = {'time': time.time(),
+            'data_units_written': int(smart.get('data_units_written', 0)),
+            'host_write_commands': int(smart.get('host_write_commands', 0)),
+            'percent_used': int(smart.get('percent_used', 0)),
+            'media_bytes_written': None}
+    if media_log is not None:
+        snap['media_bytes_written'] = get_media_bytes_written(
+            controller, media_log, fail_on_err=False)
+    return snap
+
+
+def project(before, after, capacity, rated_tbw=None):
+    """Projects the endurance consumption of the workload run between two
+    snapshots, as if it ran all day.
+
+    The capacity is in bytes and the rated TBW in terabytes.
+    """
+    seconds = after['time'] - before['time']
+    host_bytes = (after['data_units_written'] -
+                  before['data_units_written']) * DATA_UNIT_BYTES
+    projection = {
+        'seconds': seconds,
+        'host_bytes': host_bytes,
+        'host_write_commands': (after['host_write_commands'] -
+                                before['host_write_commands']),
+        'percent_used': after['percent_used'] - before['percent_used'],
+        'media_bytes': None,
+        'waf': None,
+        'host_bytes_per_day': 0,
+        'dwpd': 0,
+        'days_to_rated_tbw': None}
+
+    if before['media_bytes_written'] is not None and \
+            after['media_bytes_written'] is not None:
+        projection['media_bytes'] = (after['media_bytes_written'] -
+                                     before['media_bytes_written'])
+        if host_bytes > 0:
+            projection['waf'] = projection['media_bytes'] / host_bytes
+
+    if seconds > 0:
+        per_day = host_bytes / seconds * 86400
+        projection['host_bytes_per_day'] = per_day
+        if capacity:
+            projection['dwpd'] = per_day / capacity
+        if rated_tbw and per_day > 0:
+            projection['days_to_rated_tbw'] = rated_tbw * 1e12 / per_day
+    return projection
+
+
+def format_projection(projection):
+    # Lines for the report
+    lines = [f"Host Bytes Written: {projection['host_bytes']} "
+             f"({projection['host_write_commands']} commands) in "
+             f"{projection['seconds']:.0f} seconds"]
+    if projection['media_bytes'] is not None:
+        lines.append(f"Media Bytes Written: {projection['media_bytes']}")
+    if projection['waf'] is not None:
+        lines.append(f"Write Amplification Factor: {projection['waf']:.2f}")
+    lines.append(f"Projected Drive Writes Per Day: {projection['dwpd']:.2f}")
+    lines.append(f"Projected TB Written Per Day: "
+                 f"{projection['host_bytes_per_day'] / 1e12:.2f}")
+    if projection['days_to_rated_tbw'] is not None:
+        lines.append(f"Projected Years To Rated TBW: "
+                     f"{projection['days_to_rated_tbw'] / 365:.1f}")
+    lines.append(f"Percent Used Change: {projection['percent_used']}")
+    return lines
@@ -0,0 +1,99 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import threading
+import time
+
+# Callbacks for progress heartbeats, called with the source and the
+# time.monotonic() of the heartbeat
+_subscribers = []
+# Callbacks for published events, called with the kind, the time.monotonic()
+# of the event and its fields
+_listeners = []
+_lock = threading.Lock()
+# Operations running that show no progress until they finish (ex. a
+# format), each with the time.monotonic() it stops counting as progress at
+_long_operations = []
+
+# The longest an operation counts as progress for, unless it sets its own
+LONG_OPERATION_LIMIT = 4 * 3600
+
+
+def subscribe(callback):
+    with _lock:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def heartbeat(source):
+    # Reports that something (a command, a test) is making progress.  Called
+    # from any thread, so callbacks must be quick and thread safe.
+    now = time.monotonic()
+    with _lock:
+        subscribers = list(_subscribers)
+    for callback in subscribers:
+        callback(source, now)
+
+
+@contextlib.contextmanager
+def long_operation(max_seconds=None):
+    # Marks an operation that makes no visible progress while it runs, so it
+    # counts as progress (ex. to the hang watchdog) for up to max_seconds.
+    # Past that it is treated as hung like anything else.
+    if max_seconds is None:
+        max_seconds = LONG_OPERATION_LIMIT
+    deadline = [time.monotonic() + max_seconds]
+    with _lock:
+        _long_operations.append(deadline)
+    try:
+        yield
+    finally:
+        with _lock:
+            _long_operations.remove(deadline)
+        heartbeat('long_operation')
+
+
+def in_long_operation():
+    # True while a long operation runs that is within its limit
+    now = time.monotonic()
+    with _lock:
+        return any(deadline > now for deadline, in _long_operations)
+
+
+def listen(callback):
+    with _lock:
+        _listeners.append(callback)
+
+
+def unlisten(callback):
+    with _lock:
+        if callback in _listeners:
+            _listeners.remove(callback)
+
+
+def publish(kind, **fields):
+    # Reports something that happened (ex. a test starting, a command
+    # finishing, fio status).  Like heartbeat, called from any thread.
+    now = time.monotonic()
+    with _lock:
+        listeners = list(_listeners)
+    for callback in listeners:
+        callback(kind, now, fields)
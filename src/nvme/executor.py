@@ -0,0 +1,200 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import events
+
+import asyncio
+import codecs
+import logging
+import os
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds a process group has to exit after SIGTERM, before SIGKILL
+KILL_GRACE = 5
+
+READ_SIZE = 64 * 1024
+
+# Process ids of the commands running, so they can be killed from outside
+# their event loop (ex. by the hang watchdog)
+_running = set()
+# Processes started outside the executor, in a session of their own, which
+# are killed along with the running commands
+_background = set()
+
+
+class CommandTimeout(OSError):
+    """A command ran past its deadline and was killed.
+
+    Holds the return code of the killed process and the output captured
+    before the deadline.
+    """
+
+    def __init__(self, command, timeout, returncode, stdout, stderr):
+        super(CommandTimeout, self).__init__(
+            f'Command "{command}" did not finish within {timeout} seconds')
+        self.command = command
+        self.timeout = timeout
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+async def _read_stream(stream, chunks, on_line):
+    # Reads the stream until EOF, keeping the text (unless chunks is None)
+    # and calling on_line with each complete line as it arrives
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    partial = ''
+    while True:
+        data = await stream.read(READ_SIZE)
+        events.heartbeat('output')
+        text = decoder.decode(data, final=not data)
+        if chunks is not None:
+            chunks.append(text)
+        if on_line is not None:
+            lines = (partial + text).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                on_line(line)
+        if not data:
+            break
+    if on_line is not None and partial:
+        on_line(partial)
+
+
+async def kill_group(process, grace=KILL_GRACE):
+    # Each command leads its own process group, so this also gets anything it
+    # started (ex. the fio job processes, or the children of a shell)
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            break
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+            break
+        except asyncio.TimeoutError:
+            logger.warning(f'Process group {process.pid} ignored {sig.name}')
+    await process.wait()
+
+
+async def run(command, shell=False, timeout=None, on_stdout=None,
+              on_stderr=None, keep_stdout=True):
+    """Runs a command, returning the return code, stdout and stderr.
+
+    The output is captured as it is produced, and each line is passed to the
+    on_stdout and on_stderr callbacks, if given.  Without keep_stdout, the
+    stdout is only passed to on_stdout, and '' is returned for it, so a
+    long running command can't fill memory.  If the command runs past
+    the timeout (in seconds), its process group is killed and
+    CommandTimeout is raised.  Cancelling the coroutine also kills the
+    process group.  A 'command' event is published when it finishes.
+    """
+    start = time.monotonic()
+    if shell:
+        # Like subprocess, a shell command may be given as a list
+        if not isinstance(command, str):
+            command = ' '.join(command)
+        process = await asyncio.create_subprocess_shell(
+            command, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, start_new_session=True)
+    else:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, start_new_session=True)
+    _running.add(process.pid)
+    events.heartbeat('command')
+
+    stdout = []
+    stderr = []
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(_read_stream(process.stdout,
+                                        stdout if keep_stdout else None,
+                                        on_stdout),
+                           _read_stream(process.stderr, stderr, on_stderr),
+                           process.wait()),
+            timeout)
+    except asyncio.TimeoutError:
+        await kill_group(process)
+        events.publish('command', command=command,
+                       seconds=time.monotonic() - start,
+                       returncode=process.returncode)
+        raise CommandTimeout(command, timeout, process.returncode,
+                             ''.join(stdout), ''.join(stderr))
+    except asyncio.CancelledError:
+        await kill_group(process)
+        raise
+    finally:
+        _running.discard(process.pid)
+    events.heartbeat('command')
+    events.publish('command', command=command,
+                   seconds=time.monotonic() - start,
+                   returncode=process.returncode)
+    return process.returncode, ''.join(stdout), ''.join(stderr)
+
+
+def track(process):
+    # Registers a subprocess.Popen started with start_new_session, so
+    # kill_running also kills it
+    for finished in [p for p in list(_background) if p.poll() is not None]:
+        _background.discard(finished)
+    _background.add(process)
+
+
+def kill_running():
+    # Kills every running command's process group, and the tracked
+    # background processes.  Safe from any thread, the commands then finish
+    # with a negative return code.
+    pids = list(_running)
+    for process in list(_background):
+        if process.poll() is None:
+            pids.append(process.pid)
+        else:
+            _background.discard(process)
+    for pid in pids:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+async def run_all(commands, timeout=None, limit=None):
+    """Runs the commands concurrently, at most limit at a time.
+
+    Returns the result of each command in order, either the
+    (rc, stdout, stderr) tuple or the exception it raised.
+    """
+    semaphore = asyncio.Semaphore(limit or len(commands) or 1)
+
+    async def limited(command):
+        async with semaphore:
+            return await run(command, timeout=timeout)
+
+    return await asyncio.gather(*[limited(command) for command in commands],
+                                return_exceptions=True)
+
+
+def call(coroutine):
+    # Runs a coroutine to completion from synchronous code, on a loop of its
+    # own so it can be used from any thread.  Subprocesses started off the
+    # main thread need the thread based child watcher of Python 3.8.
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
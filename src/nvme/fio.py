@@ -0,0 +1,321 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import events
+from nvme import utils
+
+import glob
+import json
+import logging
+
+CMD_FIO = 'fio'
+
+logger = logging.getLogger(__name__)
+
+# Seconds a timed fio run may take beyond its ramp and runtime, before it is
+# treated as hung and killed
+DEADLINE_SLACK = 300
+
+# Seconds between the status documents fio prints while a job runs, each
+# published as a 'fio' event
+STATUS_INTERVAL = 5
+
+# Profiles for comparing performance across drive states: name, rw, bs,
+# iodepth, numjobs, and optionally a list of fio arguments
+SEQ_READ = ('seqread', 'read', '128k', 64, 4)
+SEQ_WRITE = ('seqwrite', 'write', '128k', 64, 4)
+RAND_READ = ('4krandread', 'randread', '4k', 32, 8)
+RAND_WRITE = ('4krandwrite', 'randwrite', '4k', 32, 8)
+PROFILES = [SEQ_READ, SEQ_WRITE, RAND_READ, RAND_WRITE]
+
+
+def build_command(name, filename, rw, bs, iodepth=1, numjobs=1, runtime=None,
+                  ramp=None, ioengine='libaio', size='100%', sync=True,
+                  group_reporting=True, extra_args=None):
+    command = [CMD_FIO, f'--name={name}', f'--rw={rw}', f'--bs={bs}',
+               f'--iodepth={iodepth}', f'--numjobs={numjobs}', '--direct=1',
+               f'--ioengine={ioengine}', f'--filename={filename}',
+               '--output-format=json']
+    if size is not None:
+        command.append(f'--size={size}')
+    if runtime is not None:
+        command.extend([f'--runtime={runtime}', '--time_based'])
+    if ramp is not None:
+        command.append(f'--ramp={ramp}')
+    if sync:
+        command.append('--sync=1')
+    if group_reporting:
+        command.append('--group_reporting')
+    if extra_args:
+        command.extend(extra_args)
+    return command
+
+
+def build_jobs_command(jobs, rw, bs, iodepth=1, numjobs=1, runtime=None,
+                       ramp=None, ioengine='libaio', sync=True,
+                       extra_args=None):
+    # Builds a single fio run of several concurrent jobs.  The common options
+    # come first, as fio treats options before the first --name as global.
+    # Each job is a dict of fio options (ex. name, filename, offset, size),
+    # and is reported separately.
+    command = [CMD_FIO, f'--rw={rw}', f'--bs={bs}', f'--iodepth={iodepth}',
+               f'--numjobs={numjobs}', '--direct=1',
+               f'--ioengine={ioengine}', '--output-format=json']
+    if runtime is not None:
+        command.extend([f'--runtime={runtime}', '--time_based'])
+    if ramp is not None:
+        command.append(f'--ramp={ramp}')
+    if sync:
+        command.append('--sync=1')
+    if extra_args:
+        command.extend(extra_args)
+    for job in jobs:
+        command.append(f'--name={job["name"]}')
+        command.extend([f'--{key}={value}' for key, value in job.items()
+                        if key != 'name'])
+    return command
+
+
+def parse_output(stdout):
+    # fio may print warnings ahead of the JSON document.  With
+    # --status-interval, the status documents come before the final one.
+    decoder = json.JSONDecoder()
+    results = None
+    start = stdout.find('{')
+    while start >= 0:
+        results, end = decoder.raw_decode(stdout, start)
+        start = stdout.find('{', end)
+    return results
+
+
+def publish_status(name, results, final=False):
+    # Publishes the throughput and latency of each direction fio did I/O in,
+    # summed over the jobs.  Status documents are cumulative from the start
+    # of the run.
+    jobs = results.get('jobs', [])
+    summary = {}
+    for ddir in ['read', 'write', 'trim']:
+        if any(job.get(ddir, {}).get('total_ios') for job in jobs):
+            summary[ddir] = summarize_clones(jobs, ddir)
+    events.publish('fio', name=name, summary=summary, final=final)
+
+
+class StatusReader:
+    """Reads the JSON output of a fio run a line at a time.
+
+    Each status document printed with --status-interval is published as it
+    completes, and only the last document, the final results, is kept.  fio
+    pretty prints the JSON, so a document ends with a lone '}'.  Warnings
+    between documents are skipped.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.results = None
+        self._lines = []
+
+    def __call__(self, line):
+        if not self._lines and not line.startswith('{'):
+            return
+        self._lines.append(line)
+        if line != '}':
+            return
+        try:
+            results = json.loads('\n'.join(self._lines))
+        except ValueError:
+            results = None
+        self._lines = []
+        if results is not None:
+            self.results = results
+            publish_status(self.name, results)
+
+
+def _run(name, command, fail_on_err, timeout=None):
+    # The output is read by a StatusReader rather than kept, as a long run
+    # prints many status documents
+    if STATUS_INTERVAL:
+        command = command + [f'--status-interval={STATUS_INTERVAL}']
+    logger.debug(f'Running fio: {" ".join(command)}')
+    reader = StatusReader(name)
+    rc, stdout, stderr = utils.run_cmd(command, fail_on_err=fail_on_err,
+                                       timeout=timeout, on_stdout=reader,
+                                       keep_stdout=False)
+    if rc != 0:
+        return rc, None, stderr
+    if reader.results is not None:
+        publish_status(name, reader.results, final=True)
+    return rc, reader.results, stderr
+
+
+def deadline(runtime=None, ramp=None, **kwargs):
+    # Timeout for a fio run, only known when the run is time based
+    if runtime is None:
+        return None
+    return int(runtime) + int(ramp or 0) + DEADLINE_SLACK
+
+
+def run_job(name, filename, rw, bs, fail_on_err=False, **kwargs):
+    # Returns the return code, the parsed json results (None on failure) and
+    # the stderr of the fio run.
+    command = build_command(name, filename, rw, bs, **kwargs)
+    return _run(name, command, fail_on_err, deadline(**kwargs))
+
+
+def run_profiles(profiles, filename, log, state, min_bs=0, extra_args=None,
+                 **kwargs):
+    """Runs each profile in turn on the file, logging its summary.
+
+    The state (ex. 'before Opal setup') goes in the log lines.  Transfers
+    are at least min_bs bytes, ex. the logical block size.  The fio
+    arguments of a profile come after extra_args, and the other arguments
+    are passed to run_job.
+
+    Returns the summary of each profile by name, with the flush latency
+    under 'flush' for runs that did fsyncs, or None when a run failed.
+    """
+    log.info(f"Measuring performance {state}")
+    results = {}
+    for name, rw, bs, iodepth, numjobs, *profile_args in profiles:
+        if utils.convert_size_to_bytes(bs) < min_bs:
+            bs = min_bs
+        args = (extra_args or []) + (profile_args[0] if profile_args else [])
+        rc, output, err = run_job(name, filename, rw, bs, iodepth=iodepth,
+                                  numjobs=numjobs, extra_args=args, **kwargs)
+        if rc != 0:
+            log.error(f"{name} failed {state}: {err}")
+            return None
+
+        job = output['jobs'][0]
+        results[name] = summarize(job, 'read' if 'read' in rw else 'write')
+        log.info(f"  {name}: {results[name]['iops']:.0f} IOPS, "
+                 f"{results[name]['bw']} KiB/s, p99 "
+                 f"{results[name]['lat_p99']:.1f} us")
+        if job.get('sync', {}).get('total_ios'):
+            flush = summarize_sync(job)
+            results[name]['flush'] = flush
+            log.info(f"  {name} flush latency: p50 {flush['lat_p50']:.0f} "
+                     f"us, p99 {flush['lat_p99']:.0f} us, max "
+                     f"{flush['lat_max']:.0f} us")
+    return results
+
+
+def precondition(filename, size='100%', runtime=None, ioengine='libaio'):
+    """Brings the span of the file to the state of a drive in use.
+
+    A sequential fill maps every block, then with a runtime, 4k random
+    writes run until fio sees the IOPS settle or the runtime (seconds) ends,
+    so garbage collection is running.  Returns the return code and stderr of
+    the run that failed, or 0 and None.
+    """
+    rc, output, err = run_job('fill', filename, 'write', '128k', iodepth=32,
+                              size=size, ioengine=ioengine, sync=False)
+    if rc != 0 or not runtime:
+        return rc, err
+    rc, output, err = run_job(
+        'steadystate', filename, 'randwrite', '4k', iodepth=32, numjobs=4,
+        runtime=runtime, size=size, ioengine=ioengine, sync=False,
+        extra_args=['--steadystate=iops_slope:0.3%', '--ss_dur=300'])
+    return rc, err
+
+
+def run_jobs(jobs, rw, bs, fail_on_err=False, **kwargs):
+    # Same as run_job, for several concurrent jobs
+    command = build_jobs_command(jobs, rw, bs, **kwargs)
+    return _run(f'{rw}-{bs}', command, fail_on_err, deadline(**kwargs))
+
+
+def run_replay(name, iolog_path, iodepth=32, ioengine='libaio',
+               as_fast_as_possible=False, fail_on_err=False):
+    # Replays a fio iolog.  The iolog names the file the I/O goes to.  With
+    # as_fast_as_possible the trace timing is ignored.
+    command = [CMD_FIO, f'--name={name}', f'--read_iolog={iolog_path}',
+               f'--iodepth={iodepth}', '--direct=1',
+               f'--ioengine={ioengine}', '--output-format=json']
+    if as_fast_as_possible:
+        command.append('--replay_no_stall=1')
+    return _run(name, command, fail_on_err)
+
+
+def results_by_job(results):
+    # Maps each job name to the list of its results, from a run without group
+    # reporting.  With numjobs > 1 the clones of a job share its name.
+    by_name = {}
+    for job in results.get('jobs', []):
+        by_name.setdefault(job['jobname'], []).append(job)
+    return by_name
+
+
+def summarize(job, ddir):
+    # Summarizes one direction ('read', 'write' or 'trim') of a fio job.
+    # Bandwidth is in KiB/s, latencies in microseconds.
+    data = job[ddir]
+    clat = data.get('clat_ns', {})
+    percentiles = clat.get('percentile', {})
+    return {'iops': data.get('iops', 0),
+            'bw': data.get('bw', 0),
+            'lat_mean': clat.get('mean', 0) / 1000.0,
+            'lat_max': clat.get('max', 0) / 1000.0,
+            'lat_p50': percentiles.get('50.000000', 0) / 1000.0,
+            'lat_p99': percentiles.get('99.000000', 0) / 1000.0,
+            'lat_p999': percentiles.get('99.900000', 0) / 1000.0}
+
+
+def summarize_sync(job):
+    # Summarizes the fsync latency of a job run with --fsync.  Latencies are
+    # in microseconds.
+    lat = job.get('sync', {}).get('lat_ns', {})
+    percentiles = lat.get('percentile', {})
+    return {'count': job.get('sync', {}).get('total_ios', lat.get('N', 0)),
+            'lat_mean': lat.get('mean', 0) / 1000.0,
+            'lat_max': lat.get('max', 0) / 1000.0,
+            'lat_p50': percentiles.get('50.000000', 0) / 1000.0,
+            'lat_p99': percentiles.get('99.000000', 0) / 1000.0,
+            'lat_p999': percentiles.get('99.900000', 0) / 1000.0}
+
+
+def summarize_clones(jobs, ddir):
+    # Summarizes the clones of a job.  Throughput is summed, the mean latency
+    # is weighted by IOPS and the percentiles are the worst of the clones.
+    summaries = [summarize(job, ddir) for job in jobs]
+    total = {'iops': sum(s['iops'] for s in summaries),
+             'bw': sum(s['bw'] for s in summaries)}
+    total['lat_mean'] = (sum(s['lat_mean'] * s['iops'] for s in summaries) /
+                         total['iops']) if total['iops'] else 0
+    for key in ['lat_max', 'lat_p50', 'lat_p99', 'lat_p999']:
+        total[key] = max(s[key] for s in summaries)
+    return total
+
+
+def read_log_series(prefix, kind='bw', use_max=False):
+    # Reads the per-job logs written with --write_<kind>_log=<prefix> and
+    # --log_avg_msec=1000, and combines the jobs into one value per second.
+    # Jobs are summed, or the max is taken with use_max (ex. for latency).
+    # Each line is: time (ms), value, direction, block size, offset.
+    series = {}
+    for path in glob.glob(f'{prefix}_{kind}.*.log'):
+        with open(path) as log_file:
+            for line in log_file:
+                fields = line.split(',')
+                if len(fields) < 2:
+                    continue
+                second = max(0, int(fields[0]) - 1) // 1000
+                value = int(fields[1])
+                if use_max:
+                    series[second] = max(series.get(second, 0), value)
+                else:
+                    series[second] = series.get(second, 0) + value
+    if not series:
+        return []
+    return [series.get(second, 0) for second in range(0, max(series) + 1)]
@@ -0,0 +1,180 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import events
+from nvme import utils
+
+import ctypes
+import fcntl
+import logging
+import mmap
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# FWUG and the memory page size are reported in units of 4 KiB
+UNIT = 4096
+
+# Used when the drive reports no limit on the transfer size
+DEFAULT_MAX_TRANSFER = 1024 * 1024
+
+# Firmware Image Download admin command, and the ioctl passing an admin
+# command through the controller character device
+OPCODE_FW_DOWNLOAD = 0x11
+NVME_IOCTL_ADMIN_CMD = 0xc0484e41
+ADMIN_TIMEOUT_MS = 60 * 1000
+
+
+class AdminCommand(ctypes.Structure):
+    # struct nvme_admin_cmd from linux/nvme_ioctl.h
+    _fields_ = [('opcode', ctypes.c_uint8),
+                ('flags', ctypes.c_uint8),
+                ('rsvd1', ctypes.c_uint16),
+                ('nsid', ctypes.c_uint32),
+                ('cdw2', ctypes.c_uint32),
+                ('cdw3', ctypes.c_uint32),
+                ('metadata', ctypes.c_uint64),
+                ('addr', ctypes.c_uint64),
+                ('metadata_len', ctypes.c_uint32),
+                ('data_len', ctypes.c_uint32),
+                ('cdw10', ctypes.c_uint32),
+                ('cdw11', ctypes.c_uint32),
+                ('cdw12', ctypes.c_uint32),
+                ('cdw13', ctypes.c_uint32),
+                ('cdw14', ctypes.c_uint32),
+                ('cdw15', ctypes.c_uint32),
+                ('timeout_ms', ctypes.c_uint32),
+                ('result', ctypes.c_uint32)]
+
+
+class DownloadError(OSError):
+    """A firmware chunk failed after all retries.
+
+    The offset is where the download can be resumed from.
+    """
+
+    def __init__(self, message, offset):
+        super(DownloadError, self).__init__(message)
+        self.offset = offset
+
+
+def get_transfer_size(controller, fail_on_err=True):
+    # The largest transfer that fits in MDTS and is a multiple of the firmware
+    # update granularity.  MDTS is a power of two in units of the minimum
+    # memory page size, which is assumed to be 4 KiB.
+    ctrl_data = utils.get_controller_data(controller, fail_on_err=fail_on_err)
+    mdts = int(ctrl_data.get('mdts', 0))
+    fwug = int(ctrl_data.get('fwug', 0))
+    return plan_transfer_size(mdts, fwug)
+
+
+def plan_transfer_size(mdts, fwug):
+    max_transfer = (2 ** mdts) * UNIT if mdts else DEFAULT_MAX_TRANSFER
+
+    # A FWUG of 0 gives no information, 0xff means no restriction
+    if fwug in [0, 0xff]:
+        return min(max_transfer, DEFAULT_MAX_TRANSFER)
+
+    granularity = fwug * UNIT
+    if granularity > max_transfer:
+        raise ValueError(f"Firmware update granularity of {granularity} "
+                         f"bytes is above the max transfer of {max_transfer} "
+                         "bytes")
+    return max_transfer // granularity * granularity
+
+
+def plan_chunks(size, transfer_size, start_offset=0):
+    # Returns the (offset, length) of each download command
+    return [(offset, min(transfer_size, size - offset))
+            for offset in range(start_offset, size, transfer_size)]
+
+
+def submit_chunk(controller, chunk, offset):
+    # Issues a single firmware image download command for the chunk, a
+    # memoryview of the mapped image.  The command is passed through to the
+    # controller with the data read straight from the mapping, rather than
+    # staging each chunk in a file for nvme-cli.  Returns the NVMe status,
+    # or the negated errno when the ioctl itself fails.
+    data = (ctypes.c_char * len(chunk)).from_buffer(chunk)
+    cmd = AdminCommand(opcode=OPCODE_FW_DOWNLOAD,
+                       addr=ctypes.addressof(data),
+                       data_len=len(chunk),
+                       cdw10=len(chunk) // 4 - 1,
+                       cdw11=offset // 4,
+                       timeout_ms=ADMIN_TIMEOUT_MS)
+    try:
+        fd = os.open(f'/dev/{controller}', os.O_RDONLY)
+        try:
+            status = fcntl.ioctl(fd, NVME_IOCTL_ADMIN_CMD, cmd)
+        finally:
+            os.close(fd)
+    except OSError as err:
+        return -err.errno, '', str(err)
+    finally:
+        del data
+    return status, '', f'NVMe status {status:#x}' if status else ''
+
+
+def download(controller, fw_path, transfer_size=None, start_offset=0,
+             retries=3, submit=submit_chunk):
+    """Downloads a firmware image in chunks, retrying each chunk.
+
+    The submit function issues a chunk, and is called with the controller,
+    a memoryview of the chunk and the offset.  The view is only valid for
+    the call.  It returns a (rc, stdout, stderr) tuple.  A DownloadError has
+    the offset to pass as start_offset to resume.
+
+    Returns the bytes sent, seconds taken, throughput (bytes/s), the number
+    of chunks and the number of retries.
+    """
+    if transfer_size is None:
+        transfer_size = get_transfer_size(controller)
+
+    # Mapped copy on write, as the passthrough needs a writable buffer to
+    # take the address of.  Nothing is written to it.
+    with open(fw_path, 'rb') as fw_file, \
+            mmap.mmap(fw_file.fileno(), 0,
+                      access=mmap.ACCESS_COPY) as image, \
+            memoryview(image) as view:
+        chunks = plan_chunks(len(image), transfer_size, start_offset)
+        logger.debug(f'Downloading {fw_path} to {controller} in '
+                     f'{len(chunks)} chunks of {transfer_size} bytes')
+
+        retried = 0
+        sent = 0
+        start = time.monotonic()
+        for offset, length in chunks:
+            for attempt in range(0, retries + 1):
+                with view[offset:offset + length] as chunk:
+                    rc, out, err = submit(controller, chunk, offset)
+                events.heartbeat('command')
+                if rc == 0:
+                    break
+                logger.warning(f'Firmware chunk at offset {offset} failed, '
+                               f'attempt {attempt + 1}: {err}')
+                retried += 1
+            else:
+                raise DownloadError(f'Firmware download to {controller} '
+                                    f'failed at offset {offset}: {err}',
+                                    offset)
+            sent += length
+        seconds = time.monotonic() - start
+
+    return {'bytes': sent,
+            'seconds': seconds,
+            'throughput': sent / seconds if seconds else 0,
+            'chunks': len(chunks),
+            'retries': retried}
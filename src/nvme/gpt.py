@@ -0,0 +1,233 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from dataclasses import dataclass, field
+
+import fcntl
+import logging
+import os
+import stat
+import struct
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Re-read the partition table of a block device (linux/fs.h)
+BLKRRPART = 0x125f
+
+SIGNATURE = b'EFI PART'
+REVISION = 0x00010000
+HEADER_FORMAT = '<8sIIIIQQQQ16sQIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+ENTRY_FORMAT = '<16s16sQQQ72s'
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+# The minimum the spec allows for the entry array, 16 KiB
+MAX_ENTRIES = 128
+
+LINUX_DATA = uuid.UUID('0fc63daf-8483-4772-8e79-3d69d8477de4')
+
+# Partitions start on 1 MiB boundaries unless asked otherwise
+DEFAULT_ALIGNMENT = 1024 * 1024
+
+
+@dataclass
+class Partition:
+    """A GPT partition.  The LBAs are inclusive, in logical blocks."""
+
+    first_lba: int
+    last_lba: int
+    name: str = 'primary'
+    type_guid: uuid.UUID = LINUX_DATA
+    guid: uuid.UUID = field(default_factory=uuid.uuid4)
+    attributes: int = 0
+
+
+def entry_blocks(block_size):
+    return MAX_ENTRIES * ENTRY_SIZE // block_size
+
+
+def usable_range(total_blocks, block_size):
+    # First and last LBA partitions can use, between the primary and backup
+    # tables
+    entries = entry_blocks(block_size)
+    return 2 + entries, total_blocks - 2 - entries
+
+
+def layout(total_blocks, sizes, block_size=512, alignment=DEFAULT_ALIGNMENT,
+           shift=0):
+    """Lays out partitions of the sizes (in bytes), one after the other.
+
+    Each partition starts on the alignment (in bytes), moved by shift bytes,
+    to lay out deliberately misaligned partitions.
+    """
+    if alignment % block_size or shift % block_size:
+        raise ValueError(f"Alignment {alignment} and shift {shift} must be "
+                         f"multiples of the block size {block_size}")
+    if len(sizes) > MAX_ENTRIES:
+        raise ValueError(f"At most {MAX_ENTRIES} partitions are supported")
+
+    first_usable, last_usable = usable_range(total_blocks, block_size)
+    partitions = []
+    lba = first_usable
+    for size in sizes:
+        # Round up to the next aligned (then shifted) byte offset
+        start = -(-(lba * block_size - shift) // alignment) * alignment + shift
+        first = start // block_size
+        last = first + size // block_size - 1
+        if last > last_usable:
+            raise ValueError(f"Partition of {size} bytes at LBA {first} "
+                             f"does not fit, last usable LBA is {last_usable}")
+        partitions.append(Partition(first, last))
+        lba = last + 1
+    return partitions
+
+
+def _protective_mbr(total_blocks, block_size):
+    # A single 0xEE partition covering the disk, so MBR only tools leave it
+    # alone
+    entry = struct.pack('<B3sB3sII', 0, b'\x00\x02\x00', 0xee,
+                        b'\xff\xff\xff', 1, min(total_blocks - 1, 0xffffffff))
+    mbr = bytes(446) + entry + bytes(48) + b'\x55\xaa'
+    return mbr + bytes(block_size - len(mbr))
+
+
+def _entries(partitions):
+    data = bytearray()
+    for partition in partitions:
+        data += struct.pack(ENTRY_FORMAT, partition.type_guid.bytes_le,
+                            partition.guid.bytes_le, partition.first_lba,
+                            partition.last_lba, partition.attributes,
+                            partition.name.encode('utf-16-le')[:72])
+    return bytes(data) + bytes(MAX_ENTRIES * ENTRY_SIZE - len(data))
+
+
+def _header(my_lba, alternate_lba, entries_lba, total_blocks, block_size,
+            disk_guid, entries_crc):
+    first_usable, last_usable = usable_range(total_blocks, block_size)
+    fields = [SIGNATURE, REVISION, HEADER_SIZE, 0, 0, my_lba, alternate_lba,
+              first_usable, last_usable, disk_guid.bytes_le, entries_lba,
+              MAX_ENTRIES, ENTRY_SIZE, entries_crc]
+    header = struct.pack(HEADER_FORMAT, *fields)
+    fields[3] = zlib.crc32(header)
+    header = struct.pack(HEADER_FORMAT, *fields)
+    return header + bytes(block_size - HEADER_SIZE)
+
+
+def build(total_blocks, partitions, block_size=512, disk_guid=None):
+    """Builds the primary and backup tables.
+
+    Returns the bytes at the start of the disk (protective MBR, header and
+    entries), the backup bytes (entries and header) and the LBA the backup
+    goes at.
+    """
+    disk_guid = disk_guid or uuid.uuid4()
+    entries = _entries(partitions)
+    entries_crc = zlib.crc32(entries)
+    last_lba = total_blocks - 1
+    backup_lba = last_lba - entry_blocks(block_size)
+
+    primary = (_protective_mbr(total_blocks, block_size) +
+               _header(1, last_lba, 2, total_blocks, block_size, disk_guid,
+                       entries_crc) +
+               entries)
+    backup = entries + _header(last_lba, 1, backup_lba, total_blocks,
+                               block_size, disk_guid, entries_crc)
+    return primary, backup, backup_lba
+
+
+def _device_blocks(fd, block_size):
+    return os.lseek(fd, 0, os.SEEK_END) // block_size
+
+
+def reread(fd):
+    # Has the kernel pick up the new table.  Only for block devices, not
+    # image files.
+    if stat.S_ISBLK(os.fstat(fd).st_mode):
+        fcntl.ioctl(fd, BLKRRPART)
+
+
+def write(path, partitions, block_size=512):
+    """Writes a GPT with the partitions, then has the kernel re-read it.
+
+    Each copy of the table is a single block aligned write.
+    """
+    fd = os.open(path, os.O_RDWR)
+    try:
+        total_blocks = _device_blocks(fd, block_size)
+        primary, backup, backup_lba = build(total_blocks, partitions,
+                                            block_size)
+        os.pwrite(fd, primary, 0)
+        os.pwrite(fd, backup, backup_lba * block_size)
+        os.fsync(fd)
+        reread(fd)
+    finally:
+        os.close(fd)
+    logger.debug(f'Wrote a GPT with {len(partitions)} partitions to {path}')
+
+
+def clear(path, block_size=512):
+    # Wipes both copies of the table and the protective MBR
+    fd = os.open(path, os.O_RDWR)
+    try:
+        total_blocks = _device_blocks(fd, block_size)
+        size = (2 + entry_blocks(block_size)) * block_size
+        os.pwrite(fd, bytes(size), 0)
+        os.pwrite(fd, bytes(size - block_size),
+                  (total_blocks - 1 - entry_blocks(block_size)) * block_size)
+        os.fsync(fd)
+        reread(fd)
+    finally:
+        os.close(fd)
+    logger.debug(f'Cleared the partition table of {path}')
+
+
+def parse(path, block_size=512):
+    """Reads the partitions from the primary GPT.
+
+    Raises ValueError if there is no valid table.
+    """
+    with open(path, 'rb') as disk:
+        disk.seek(block_size)
+        header = disk.read(HEADER_SIZE)
+        fields = list(struct.unpack(HEADER_FORMAT, header))
+        if fields[0] != SIGNATURE:
+            raise ValueError(f"No GPT found on {path}")
+
+        crc = fields[3]
+        fields[3] = 0
+        if zlib.crc32(struct.pack(HEADER_FORMAT, *fields)) != crc:
+            raise ValueError(f"GPT header CRC mismatch on {path}")
+
+        entries_lba, count, size, entries_crc = fields[10:14]
+        disk.seek(entries_lba * block_size)
+        entries = disk.read(count * size)
+        if zlib.crc32(entries) != entries_crc:
+            raise ValueError(f"GPT entries CRC mismatch on {path}")
+
+    partitions = []
+    for offset in range(0, count * size, size):
+        type_guid, guid, first, last, attributes, name = struct.unpack(
+            ENTRY_FORMAT, entries[offset:offset + ENTRY_SIZE])
+        if type_guid == bytes(16):
+            continue
+        partitions.append(Partition(
+            first, last,
+            name=name.decode('utf-16-le').rstrip('\x00'),
+            type_guid=uuid.UUID(bytes_le=type_guid),
+            guid=uuid.UUID(bytes_le=guid),
+            attributes=attributes))
+    return partitions
@@ -0,0 +1,66 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+class Histogram:
+    """A log-linear (HDR style) histogram of non-negative integer values.
+
+    Values below 2^precision are kept exactly.  Above that, each power of two
+    is split into 2^(precision - 1) buckets, so the relative error stays
+    under 2^(1 - precision) and the memory is fixed however many values are
+    recorded.
+    """
+
+    def __init__(self, precision=6):
+        self.precision = precision
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def _key(self, value):
+        shift = max(0, value.bit_length() - self.precision)
+        return shift, value >> shift
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        key = self._key(value)
+        self.counts[key] = self.counts.get(key, 0) + count
+        self.count += count
+        self.total += value * count
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, pct):
+        # The middle of the bucket holding the percentile, pct is 0 - 100
+        if not self.count:
+            return 0.0
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for shift, base in sorted(self.counts, key=lambda k: k[1] << k[0]):
+            seen += self.counts[(shift, base)]
+            if seen >= rank:
+                low = base << shift
+                return min(self.max, low + ((1 << shift) - 1) / 2.0)
+        return float(self.max)
@@ -0,0 +1,154 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+IOLOG_V2 = 'fio version 2 iolog'
+IOLOG_V3 = 'fio version 3 iolog'
+
+SECTOR = 512
+
+# Traces are converted a line at a time, so traces of any size fit.  Each
+# event is a (time in ns, op, offset in bytes, length in bytes) tuple, with
+# op one of read, write or trim.
+
+# blkparse RWBS flags to ops.  Flushes (no data) and other events are
+# dropped.
+BLKPARSE_OPS = {'R': 'read', 'W': 'write', 'D': 'trim'}
+
+
+def detect_format(path):
+    with open(path) as trace:
+        first = trace.readline().strip()
+    if first in [IOLOG_V2, IOLOG_V3]:
+        return 'iolog'
+    return 'blkparse'
+
+
+def parse_blkparse(lines, action='Q'):
+    # blkparse default output: device, cpu, sequence, time (s), pid, action,
+    # RWBS, sector + sectors [process].  Only the events of the action are
+    # kept, queued (Q) by default, or ex. issued to the driver (D).
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 10 or fields[5] != action or fields[8] != '+' or \
+                fields[9] == '0':
+            continue
+        op = next((BLKPARSE_OPS[flag] for flag in fields[6]
+                   if flag in BLKPARSE_OPS), None)
+        if op is None:
+            continue
+        try:
+            yield (int(float(fields[3]) * 1e9), op,
+                   int(fields[7]) * SECTOR, int(fields[9]) * SECTOR)
+        except ValueError:
+            continue
+
+
+def parse_iolog(lines):
+    # fio iolog v2 (no timestamps, all events at time 0) or v3 (timestamp in
+    # ns first).  File actions (add, open, close) and syncs are dropped.
+    version = None
+    for line in lines:
+        line = line.strip()
+        if version is None:
+            version = 3 if line == IOLOG_V3 else 2
+            continue
+        fields = line.split()
+        if version == 3:
+            if len(fields) != 5:
+                continue
+            timestamp = int(fields[0])
+            fields = fields[1:]
+        else:
+            if len(fields) != 4:
+                continue
+            timestamp = 0
+        if fields[1] in ['read', 'write', 'trim']:
+            yield timestamp, fields[1], int(fields[2]), int(fields[3])
+
+
+def transform(events, ops=None, start=None, end=None, scale=1.0,
+              capacity=None, align=SECTOR):
+    """Filters and compresses a stream of events.
+
+    Keeps the ops listed, and the events between start and end (seconds from
+    the first event).  Divides the times by the scale, so a scale of 2
+    replays twice as fast.  Offsets are aligned down and lengths up to the
+    alignment, and offsets past the capacity wrap around.  Times restart at 0.
+    """
+    first = None
+    for timestamp, op, offset, length in events:
+        if first is None:
+            first = timestamp
+        elapsed = timestamp - first
+        if start is not None and elapsed < start * 1e9:
+            continue
+        if end is not None and elapsed > end * 1e9:
+            break
+        if ops is not None and op not in ops:
+            continue
+
+        offset = offset // align * align
+        length = max(align, -(-length // align) * align)
+        if capacity is not None:
+            if length > capacity:
+                continue
+            offset = offset % capacity
+            if offset + length > capacity:
+                offset = (capacity - length) // align * align
+        yield (int((elapsed - (start or 0) * 1e9) / scale), op, offset,
+               length)
+
+
+def write_iolog(events, output, filename):
+    # Writes a fio iolog v3 replaying the events against the filename.
+    # Returns the number of events, the bytes, the duration (ns) and the
+    # span (the end of the furthest I/O, in bytes).
+    output.write(f'{IOLOG_V3}\n')
+    output.write(f'0 {filename} add\n')
+    output.write(f'0 {filename} open\n')
+    count = 0
+    total = 0
+    last = 0
+    span = 0
+    for timestamp, op, offset, length in events:
+        output.write(f'{timestamp} {filename} {op} {offset} {length}\n')
+        count += 1
+        total += length
+        last = timestamp
+        span = max(span, offset + length)
+    output.write(f'{last} {filename} close\n')
+    return {'events': count, 'bytes': total, 'duration': last, 'span': span}
+
+
+def convert(trace_path, iolog_path, filename, trace_format=None,
+            action='Q', **kwargs):
+    """Converts a blkparse or fio iolog trace into a fio iolog v3.
+
+    The format is detected if not given.  The keyword arguments are passed
+    to transform.  Returns the stats from write_iolog.
+    """
+    trace_format = trace_format or detect_format(trace_path)
+    with open(trace_path) as trace, open(iolog_path, 'w') as output:
+        if trace_format == 'blkparse':
+            events = parse_blkparse(trace, action)
+        else:
+            events = parse_iolog(trace)
+        result = write_iolog(transform(events, **kwargs), output, filename)
+    logger.debug(f'Converted {trace_path} to {iolog_path}: {result}')
+    return result
@@ -0,0 +1,106 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import mmap
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 4096
+
+
+def open_direct(device_path):
+    return os.open(device_path, os.O_RDONLY | os.O_DIRECT)
+
+
+def aligned_buffer(size=BLOCK_SIZE):
+    # O_DIRECT needs an aligned buffer.  Anonymous maps are page aligned.
+    return mmap.mmap(-1, size)
+
+
+def timed_read(fd, buf, offset):
+    # Issues a single read at the offset and returns its latency in seconds
+    start = time.monotonic()
+    os.lseek(fd, offset, os.SEEK_SET)
+    os.readv(fd, [buf])
+    return time.monotonic() - start
+
+
+class IOProbe(threading.Thread):
+    """Issues single reads at a fixed interval, recording each completion.
+
+    Errors (ex. while the controller resets) are recorded and the device is
+    re-opened, so the probe keeps running across resets.
+    """
+
+    def __init__(self, device_path, interval=0.001, span=1024 ** 3):
+        super(IOProbe, self).__init__(daemon=True)
+        self.device_path = device_path
+        self.interval = interval
+        self.span = span
+
+        # Submit time and latency of each successful read, in seconds
+        self.completions = []
+        # Time of each failed read
+        self.errors = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        buf = aligned_buffer()
+        fd = None
+        blocks = self.span // BLOCK_SIZE
+        while not self._stop_event.is_set():
+            submitted = time.monotonic()
+            try:
+                if fd is None:
+                    fd = open_direct(self.device_path)
+                offset = random.randrange(blocks) * BLOCK_SIZE
+                self.completions.append(
+                    (submitted, timed_read(fd, buf, offset)))
+            except OSError:
+                self.errors.append(submitted)
+                if fd is not None:
+                    os.close(fd)
+                    fd = None
+            self._stop_event.wait(self.interval)
+        if fd is not None:
+            os.close(fd)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def latencies(self, start=None, end=None):
+        # Latencies of the reads submitted in the window, in seconds
+        return [lat for submitted, lat in self.completions
+                if (start is None or submitted >= start) and
+                (end is None or submitted < end)]
+
+    def max_gap(self, start=None, end=None):
+        # The longest time between two successful completions that overlaps
+        # the window, in seconds.  This is how long I/O was stalled.
+        done = sorted(submitted + lat for submitted, lat in self.completions)
+        gap = 0.0
+        for previous, current in zip(done, done[1:]):
+            if start is not None and current < start:
+                continue
+            if end is not None and previous >= end:
+                break
+            gap = max(gap, current - previous)
+        return gap
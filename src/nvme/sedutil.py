@@ -13,30 +13,192 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from nvme import events
 from nvme import utils
 
+from dataclasses import dataclass, field
+from typing import Dict
+
 import logging
+import re
 import sys
 
 logger = logging.getLogger(__name__)
 
+CMD_SEDUTIL = '/usr/local/bin/sedutil-cli'
+
 TEST_PWD = 'passw0rd'
 
+# Cache of parsed query results, by drive.  Cleared by any call that changes
+# the Opal state of the drive, and when the controller is reset (which locks
+# ranges with LockOnReset).
+_STATE_CACHE = {}
+
+_FEATURE_HEADER = re.compile(r'^\s*(.+?) function \((0x[0-9A-Fa-f]+)\)')
+_FEATURE_VALUE = re.compile(r'([A-Za-z][A-Za-z ]*?)\s*=\s*(\S+)')
+
+
+@dataclass
+class OpalState:
+    """The state of a drive, as reported by sedutil-cli --query"""
+
+    # Raw key/value pairs, by feature descriptor name (ex. 'Locking')
+    features: Dict[str, Dict[str, str]] = field(default_factory=dict)
+
+    # TPer feature
+    tper: bool = False
+    sync: bool = False
+    streaming: bool = False
+
+    # Locking feature
+    locking_supported: bool = False
+    locking_enabled: bool = False
+    locked: bool = False
+    mbr_enabled: bool = False
+    mbr_done: bool = False
+    media_encrypt: bool = False
+
+    # Geometry feature
+    align: bool = False
+    alignment_granularity: int = 0
+    logical_block_size: int = 0
+    lowest_aligned_lba: int = 0
+
+    # Security subsystem classes reported by the drive
+    opal1: bool = False
+    opal2: bool = False
+    enterprise: bool = False
+    pyrite: bool = False
+    ruby: bool = False
+    base_comid: int = 0
+    locking_admins: int = 0
+    locking_users: int = 0
+    range_crossing: bool = False
+
+    # Single user mode feature
+    single_user_locking_objects: int = 0
+
+    # Block SID feature (only reported by the ChubbyAnt fork)
+    block_sid_supported: bool = False
+    sid_value_state: bool = False
+    sid_blocked: bool = False
+    hardware_reset: bool = False
+
+    @property
+    def is_default_msid(self):
+        # SID Value State is set once the SID differs from the MSID
+        return not self.sid_value_state
+
+
+def _flag(values, key):
+    return values.get(key) == 'Y'
+
+
+def _number(values, key):
+    value = values.get(key, '0')
+    try:
+        return int(value, 0)
+    except ValueError:
+        return 0
+
+
+def parse_query(output):
+    """Parses the output of sedutil-cli --query into an OpalState."""
+    features = {}
+    current = None
+    for line in output.splitlines():
+        header = _FEATURE_HEADER.match(line)
+        if header:
+            current = features.setdefault(header.group(1).strip(), {})
+            continue
+        if line.rstrip().endswith(':') and not line.startswith(' '):
+            # Other sections, such as 'TPer Properties:'
+            current = features.setdefault(line.strip().rstrip(':'), {})
+            continue
+        if current is None:
+            continue
+        for key, value in _FEATURE_VALUE.findall(line):
+            current[key.strip()] = value.rstrip(',.')
+
+    tper = features.get('TPer', {})
+    locking = features.get('Locking', {})
+    geometry = features.get('Geometry', {})
+    single_user = features.get('SingleUser', {})
+    block_sid = features.get('Block SID Authentication', {})
+
+    # The SSC specific values are in whichever SSC feature is reported
+    ssc = {}
+    for name in ['OPAL 2.0', 'OPAL 1.0', 'Enterprise', 'Pyrite 1.0',
+                 'Pyrite 2.0', 'Ruby 1.0']:
+        ssc.update(features.get(name, {}))
+
+    return OpalState(
+        features=features,
+        tper='TPer' in features,
+        sync=_flag(tper, 'SYNC'),
+        streaming=_flag(tper, 'Streaming'),
+        locking_supported=_flag(locking, 'LockingSupported'),
+        locking_enabled=_flag(locking, 'LockingEnabled'),
+        locked=_flag(locking, 'Locked'),
+        mbr_enabled=_flag(locking, 'MBREnabled'),
+        mbr_done=_flag(locking, 'MBRDone'),
+        media_encrypt=_flag(locking, 'MediaEncrypt'),
+        align=_flag(geometry, 'Align'),
+        alignment_granularity=_number(geometry, 'Alignment Granularity'),
+        logical_block_size=_number(geometry, 'Logical Block size'),
+        lowest_aligned_lba=_number(geometry, 'Lowest Aligned LBA'),
+        opal1='OPAL 1.0' in features,
+        opal2='OPAL 2.0' in features,
+        enterprise='Enterprise' in features,
+        pyrite='Pyrite 1.0' in features or 'Pyrite 2.0' in features,
+        ruby='Ruby 1.0' in features,
+        base_comid=_number(ssc, 'Base comID'),
+        locking_admins=_number(ssc, 'Locking Admins'),
+        locking_users=_number(ssc, 'Locking Users'),
+        range_crossing=_flag(ssc, 'Range Crossing'),
+        single_user_locking_objects=_number(single_user, 'Locking Objects'),
+        block_sid_supported='Block SID Authentication' in features,
+        sid_value_state=_flag(block_sid, 'SID Value State'),
+        sid_blocked=_flag(block_sid, 'SID Blocked State'),
+        hardware_reset=_flag(block_sid, 'Hardware Reset'))
+
+
+def get_state(drive, refresh=False):
+    """Returns the OpalState of the drive, querying only if not cached."""
+    if refresh or drive not in _STATE_CACHE:
+        _STATE_CACHE[drive] = parse_query(query_drive(drive))
+    return _STATE_CACHE[drive]
+
+
+def invalidate_state(drive):
+    _STATE_CACHE.pop(drive, None)
+
+
+def _on_event(kind, now, fields):
+    if kind == 'controller_reset':
+        invalidate_state(fields['controller'])
+
+
+events.listen(_on_event)
+
+
+def _run_sedutil(drive, *args):
+    # Runs a state changing sedutil-cli command against the drive
+    invalidate_state(drive)
+    return utils.run_cmd([CMD_SEDUTIL] + list(args) + [f'/dev/{drive}'],
+                         fail_on_err=False)
+
 
 def check_opal_capability(drive):
-    output = query_drive(drive)
-    return 'LockingSupported = Y' in output
+    return get_state(drive).locking_supported
 
 
 def is_locked(drive):
-    output = query_drive(drive)
-    return 'Locked = Y' in output
+    return get_state(drive).locked
 
 
 def initial_setup(drive):
-    rc, stdout, stderr = utils.run_cmd(
-        f"/usr/local/bin/sedutil-cli --initialSetup {TEST_PWD} /dev/{drive}",
-        shell=True, fail_on_err=False)
+    rc, stdout, stderr = _run_sedutil(drive, '--initialSetup', TEST_PWD)
 
     # So this usually fails on the MBR bits for enterprise drives.  Make sure
     # it has at least this line, then query for rest.
@@ -44,52 +206,71 @@ def initial_setup(drive):
         logger.error(f"Initial setup of OPAL drive failed: {drive}")
         return False
 
-    drive_state = query_drive(drive)
-    if not 'LockingEnabled = Y' in drive_state and not 'MediaEncrypt = Y' in drive_state:
+    drive_state = get_state(drive)
+    if not drive_state.locking_enabled and not drive_state.media_encrypt:
         logger.error(f"Locking of drive {drive} not set to enabled")
         return False
 
     # Enable the locking range.
-    rc, stdout, stderr = utils.run_cmd(
-        f"/usr/local/bin/sedutil-cli --enablelockingrange 0 {TEST_PWD} /dev/{drive}",
-        shell=True, fail_on_err=False)
-    if 'LockingRange0 enabled ReadLocking,WriteLocking' not in stdout:
-        logger.error(f"Locking range not enabled for {drive}.")
+    return enable_locking_range(drive, 0)
+
+
+def setup_locking_range(drive, locking_range, start, length):
+    # Start and length are in logical blocks.  Range 0 is the global range and
+    # covers everything not in another range, so it can't be set up.
+    rc, stdout, stderr = _run_sedutil(drive, '--setupLockingRange',
+                                      str(locking_range), str(start),
+                                      str(length), TEST_PWD)
+    if rc != 0:
+        logger.error(f"Unable to set up locking range {locking_range} on "
+                     f"{drive}: {stderr}")
         return False
+    return True
 
+
+def enable_locking_range(drive, locking_range):
+    rc, stdout, stderr = _run_sedutil(drive, '--enablelockingrange',
+                                      str(locking_range), TEST_PWD)
+    if (f'LockingRange{locking_range} enabled ReadLocking,WriteLocking'
+            not in stdout):
+        logger.error(f"Locking range {locking_range} not enabled for "
+                     f"{drive}.")
+        return False
     return True
 
 
-def lock_drive(drive):
-    # Enable the locking range.
-    rc, stdout, stderr = utils.run_cmd(
-        f"/usr/local/bin/sedutil-cli --setLockingRange 0 LK {TEST_PWD} /dev/{drive}",
-        shell=True, fail_on_err=False)
-    if 'LockingRange0 set to LK' not in stdout:
-        logger.error(f"Unable to lock drive {drive}.")
+def lock_drive(drive, locking_range=0):
+    # Lock the locking range.
+    rc, stdout, stderr = _run_sedutil(drive, '--setLockingRange',
+                                      str(locking_range), 'LK', TEST_PWD)
+    if f'LockingRange{locking_range} set to LK' not in stdout:
+        logger.error(f"Unable to lock range {locking_range} of drive "
+                     f"{drive}.")
         return False
     return True
 
 
-def unlock_drive(drive):
-    # Enable the locking range.
-    rc, stdout, stderr = utils.run_cmd(
-        f"/usr/local/bin/sedutil-cli --setLockingRange 0 RW {TEST_PWD} /dev/{drive}",
-        shell=True, fail_on_err=False)
-    if 'LockingRange0 set to RW' not in stdout:
-        logger.error(f"Unable to lock drive {drive}.")
+def unlock_drive(drive, locking_range=0):
+    # Unlock the locking range.
+    rc, stdout, stderr = _run_sedutil(drive, '--setLockingRange',
+                                      str(locking_range), 'RW', TEST_PWD)
+    if f'LockingRange{locking_range} set to RW' not in stdout:
+        logger.error(f"Unable to unlock range {locking_range} of drive "
+                     f"{drive}.")
         return False
     return True
 
 
 def reset_via_psid(drive, psid):
+    if psid is None:
+        raise ValueError(f"A PSID is required to reset drive {drive}.  Set "
+                         "psid in the drive section of the config.")
+
     # Make sure it queries ok
     query_drive(drive)
 
-    cmd = (f"/usr/local/bin/sedutil-cli --yesIreallywanttoERASEALLmydatausingthePSID "
-           f"{psid} /dev/{drive}")
-
-    rc, stdout, stderr = utils.run_cmd(cmd, shell=True, fail_on_err=False)
+    rc, stdout, stderr = _run_sedutil(
+        drive, '--yesIreallywanttoERASEALLmydatausingthePSID', psid)
     if rc != 0:
         logger.error("Unable to reset drive with PSID - nothing can continue")
         logger.error(stderr)
@@ -100,8 +281,7 @@ def reset_via_psid(drive, psid):
 
 def query_drive(drive):
     rc, stdout, stderr = utils.run_cmd(
-        f"/usr/local/bin/sedutil-cli --query /dev/{drive}",
-        shell=True, fail_on_err=False)
+        [CMD_SEDUTIL, '--query', f'/dev/{drive}'], fail_on_err=False)
 
     if rc != 0:
         logger.error("Failure with sedutil-cli.  Verify install / drive")
@@ -112,15 +292,13 @@ def query_drive(drive):
 
 
 def check_chubbyant_fork(drive):
-    output = query_drive(drive)
-    return 'Block SID Authentication' in output
+    return get_state(drive).block_sid_supported
 
 
 def is_default_msid(drive):
-    output = query_drive(drive)
-    return 'SID Value State = N' in output
+    return get_state(drive).is_default_msid
 
 
 def is_sid_blocked(drive):
-    output = query_drive(drive)
-    return 'SID Blocked State = Y' and 'SID Value State = N' in output
+    drive_state = get_state(drive)
+    return drive_state.sid_blocked and drive_state.is_default_msid
@@ -0,0 +1,107 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+def mean(values):
+    values = list(values)
+    if not values:
+        return 0.0
+    return float(sum(values)) / len(values)
+
+
+def percentile(values, pct):
+    # Nearest rank percentile, pct is 0 - 100
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[min(len(values) - 1, max(0, rank))]
+
+
+def jain_fairness(values):
+    # Jain's fairness index.  1.0 when all values are equal, down to 1/n when
+    # one value has everything.
+    values = [float(v) for v in values]
+    squares = sum(v * v for v in values)
+    if not values or squares == 0:
+        return 1.0
+    return sum(values) ** 2 / (len(values) * squares)
+
+
+def moving_mean(values, window):
+    # Trailing moving mean, the first values average what is available
+    values = [float(v) for v in values]
+    means = []
+    total = 0.0
+    for i, value in enumerate(values):
+        total += value
+        if i >= window:
+            total -= values[i - window]
+        means.append(total / min(i + 1, window))
+    return means
+
+
+def settle_time(values, target, window=10):
+    # The first index after which the trailing moving mean never drops below
+    # the target.  None if it never gets there.
+    means = moving_mean(values, window)
+    settled = None
+    for i in range(len(means) - 1, -1, -1):
+        if means[i] < target:
+            break
+        settled = i
+    return settled
+
+
+def pearson(xs, ys):
+    # Pearson correlation coefficient of two equal length series
+    xs = [float(x) for x in xs]
+    ys = [float(y) for y in ys]
+    if len(xs) != len(ys) or len(xs) < 2:
+        return 0.0
+    x_mean = mean(xs)
+    y_mean = mean(ys)
+    sxy = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+    sxx = sum((x - x_mean) ** 2 for x in xs)
+    syy = sum((y - y_mean) ** 2 for y in ys)
+    if sxx == 0 or syy == 0:
+        return 0.0
+    return sxy / (sxx * syy) ** 0.5
+
+
+def fit_linear(xs, ys):
+    # Least squares fit of y = slope * x + intercept.  Returns the slope,
+    # intercept and the coefficient of determination (r^2).
+    xs = [float(x) for x in xs]
+    ys = [float(y) for y in ys]
+    if len(xs) != len(ys) or len(xs) == 0:
+        raise ValueError("Need matching, non-empty samples to fit a model")
+
+    x_mean = mean(xs)
+    y_mean = mean(ys)
+    sxx = sum((x - x_mean) ** 2 for x in xs)
+    sxy = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+
+    if sxx == 0:
+        # Only one distinct capacity.  Best we can do is a flat line.
+        return 0.0, y_mean, 0.0
+
+    slope = sxy / sxx
+    intercept = y_mean - slope * x_mean
+
+    ss_tot = sum((y - y_mean) ** 2 for y in ys)
+    ss_res = sum((y - (slope * x + intercept)) ** 2 for x, y in zip(xs, ys))
+    r2 = 1.0 - ss_res / ss_tot if ss_tot else 1.0
+    return slope, intercept, r2
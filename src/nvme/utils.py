@@ -13,42 +13,88 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from nvme import events
+from nvme import executor
+from nvme import gpt
+
 import logging
 import json
+import os
+import re
 import subprocess
+import tempfile
 import time
 
-
 CMD_LS = '/bin/ls'
 CMD_NVME = '/usr/sbin/nvme'
 CMD_PARTED = '/sbin/parted'
 CMD_CAT = '/bin/cat'
 
+# Sanitize actions (SANACT) for the Sanitize admin command
+SANITIZE_ACTIONS = {'block': 2, 'overwrite': 3, 'crypto': 4}
+
+# Sanitize capabilities (SANICAP) bit for each action in Identify Controller
+SANITIZE_CAPABILITIES = {'crypto': 0x1, 'block': 0x2, 'overwrite': 0x4}
+
+# Sanitize status (SSTAT bits 2:0) from the sanitize log
+SANITIZE_NEVER = 0
+SANITIZE_COMPLETED = 1
+SANITIZE_IN_PROGRESS = 2
+SANITIZE_FAILED = 3
+SANITIZE_COMPLETED_NO_DEALLOC = 4
+
 logger = logging.getLogger(__name__)
 
+_HEX_DUMP_LINE = re.compile(r'^\s*[0-9a-fA-F]+:\s+((?:[0-9a-fA-F]{2}\s)+)')
+
 
 def run_background_cmd(command, shell=False):
+    # Runs in a session of its own, so the hang watchdog can kill it and
+    # anything it started
     process = subprocess.Popen(command, stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE, shell=shell,
-                               universal_newlines=True, errors='replace')
+                               universal_newlines=True, errors='replace',
+                               start_new_session=True)
+    executor.track(process)
+    return process
 
 
 def run_cmd(command, shell=False, expected_rc=0, fail_on_err=True,
-            warn_on_err=True):
-    process = subprocess.Popen(command, stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE, shell=shell,
-                               universal_newlines=True, errors='replace')
-    stdout, stderr = process.communicate()
+            warn_on_err=True, timeout=None, on_stdout=None,
+            keep_stdout=True):
+    # A command running past the timeout (in seconds) is killed, and fails
+    # like any other error.  on_stdout is called with each line of output as
+    # it arrives, and without keep_stdout only it gets the output.
+    try:
+        rc, stdout, stderr = executor.call(
+            executor.run(command, shell=shell, timeout=timeout,
+                         on_stdout=on_stdout, keep_stdout=keep_stdout))
+    except executor.CommandTimeout as err:
+        if fail_on_err:
+            raise
+        elif warn_on_err:
+            logger.debug(str(err))
+        return err.returncode, err.stdout.strip(), err.stderr.strip()
     stdout = stdout.strip()
     stderr = stderr.strip()
 
-    if process.returncode != expected_rc:
+    if rc != expected_rc:
         error_string = f'Command "{command}" failed with error "{stderr}"'
         if fail_on_err:
             raise OSError(error_string)
         elif warn_on_err:
             logger.debug(error_string)
-    return process.returncode, stdout, stderr
+    return rc, stdout, stderr
+
+
+def parse_hex_dump(output):
+    # Parses the hex dump nvme-cli prints for a data buffer into bytes
+    data = bytearray()
+    for line in output.splitlines():
+        match = _HEX_DUMP_LINE.match(line + ' ')
+        if match:
+            data.extend(bytes.fromhex(match.group(1)))
+    return bytes(data)
 
 
 def get_partitions_for_namespace(device_path):
@@ -96,19 +142,40 @@ def get_max_namespaces(device, fail_on_err=True):
                                          fail_on_err=fail_on_err))
 
 
-def create_namespace(device, size_in_bytes, block_size=4096, controller=None,
-                     fail_on_err=True):
+def __issue_create_namespace(device, size_in_bytes, block_size, flbas,
+                             dps=0, fail_on_err=True):
+    # If flbas is provided, the LBA format index is used in place of the
+    # block size.  The block_size should still match the data size of that
+    # format, as it is used to determine the block count.  dps is the end to
+    # end data protection setting (ex. the PI type), 0 for none.  Returns
+    # None if the drive rejected the namespace.
     block_count = int(size_in_bytes / block_size)
 
     logger.debug(f'Creating Namespace on device {device} with {size_in_bytes} '
                  f'bytes and block size {block_size}')
+    if flbas is None:
+        format_args = ['-b', str(block_size)]
+    else:
+        format_args = ['-f', str(flbas)]
+    if dps:
+        format_args.extend(['-d', str(dps)])
     rc, out, err = run_cmd([CMD_NVME, 'create-ns',
                             f'/dev/{device}', '-s', str(block_count), '-c',
-                            str(block_count), '-b', str(block_size)],
+                            str(block_count)] + format_args,
                            fail_on_err=fail_on_err)
     logger.debug(f'Create namespace completed, rc={rc}: {out}')
+    if rc != 0:
+        return None
     pos = out.rfind(':') + 1
-    namespace = out[pos:]
+    return out[pos:]
+
+
+def create_namespace(device, size_in_bytes, block_size=4096, controller=None,
+                     flbas=None, dps=0, fail_on_err=True):
+    namespace = __issue_create_namespace(device, size_in_bytes, block_size,
+                                         flbas, dps, fail_on_err=fail_on_err)
+    if namespace is None:
+        return None
     time.sleep(2)
 
     namespace_rescan(device, fail_on_err=fail_on_err)
@@ -120,15 +187,33 @@ def create_namespace(device, size_in_bytes, block_size=4096, controller=None,
 
     namespace_rescan(device, fail_on_err=fail_on_err)
     time.sleep(2)
+    return namespace
 
 
 def bulk_create_namespace(device, size, block_size, quantity,
-                          fail_on_err=True):
-    # accelerate by determining controller once
+                          fail_on_err=True, timeout=60):
+    # accelerate by determining controller once, then creating and attaching
+    # all of the namespaces before a single rescan.  Returns the namespaces.
     controller = get_controller(device, fail_on_err=fail_on_err)
-    for x in range(0, quantity):
-        create_namespace(device, size, block_size, controller=controller,
+    namespaces = [__issue_create_namespace(device, size, block_size, None,
+                                           fail_on_err=fail_on_err)
+                  for x in range(0, quantity)]
+    for namespace in namespaces:
+        attach_namespace(device, namespace, controller=controller,
                          fail_on_err=fail_on_err)
+    namespace_rescan(device, fail_on_err=fail_on_err)
+
+    # Wait for the block devices, rather than a fixed sleep per namespace
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if all(os.path.exists(f'/dev/{device}n{namespace}')
+               for namespace in namespaces):
+            break
+        time.sleep(0.1)
+    else:
+        logger.warning(f'Not all namespaces on device {device} appeared '
+                       f'within {timeout} seconds')
+    return namespaces
 
 
 def namespace_rescan(device, fail_on_err=True):
@@ -153,31 +238,104 @@ def attach_namespace(device, namespace, controller=None, fail_on_err=True):
     return rc
 
 
-def format_namespace(device, namespace, ses=2, test=False):
+def _long_operation_limit(timeout_ms=None):
+    # Seconds a format may run, beyond the nvme-cli timeout (ms) if set
+    if timeout_ms is None:
+        return events.LONG_OPERATION_LIMIT
+    return max(events.LONG_OPERATION_LIMIT, int(timeout_ms) / 1000 + 60)
+
+
+def format_namespace(device, namespace, ses=2, test=False, lbaf=None,
+                     timeout=None):
     # SECURITY WARNING: Do not set test=True for production environments
     # This option is only provided to assist with drive qualification/testing
     logger.debug(f'Formatting Namespace {namespace} on device {device} '
                  f'with secure erase setting {ses}')
-    rc, out, err = run_cmd([CMD_NVME, 'format',
-                            '/dev/' + device,
-                            '-n', str(namespace),
-                            '-s', str(ses)],
-                           fail_on_err=(not test))
+    command = [CMD_NVME, 'format',
+               '/dev/' + device,
+               '-n', str(namespace),
+               '-s', str(ses)]
+    if lbaf is not None:
+        command.extend(['-l', str(lbaf)])
+    if timeout is not None:
+        command.extend(['-t', str(timeout)])
+    # A format prints nothing until it is done, which may take hours.  It is
+    # killed if it runs past the limit.
+    limit = _long_operation_limit(timeout)
+    with events.long_operation(limit):
+        rc, out, err = run_cmd(command, fail_on_err=(not test),
+                               timeout=limit)
     logger.debug(f'Format completed, rc={rc}: {out}')
     return rc, out, err
 
 
 def secure_erase_drive(device):
-    rc, out, err = run_cmd([CMD_NVME, 'format',
-                            '/dev/' + device,
-                            '-n', '0xffffffff',
-                            '-s', '1',
-                            '-l', '0'],
-                           fail_on_err=False)
+    limit = _long_operation_limit()
+    with events.long_operation(limit):
+        rc, out, err = run_cmd([CMD_NVME, 'format',
+                                '/dev/' + device,
+                                '-n', '0xffffffff',
+                                '-s', '1',
+                                '-l', '0'],
+                               fail_on_err=False, timeout=limit)
     logger.debug(f'Format completed, rc={rc}: {out}')
     return rc, out, err
 
 
+def deallocate(device, namespace, ranges, fail_on_err=True):
+    # Dataset Management deallocate (TRIM) of up to 256 ranges, each a
+    # (starting LBA, number of logical blocks) pair
+    logger.debug(f'Deallocating {len(ranges)} ranges on device {device} '
+                 f'namespace {namespace}')
+    rc, out, err = run_cmd([CMD_NVME, 'dsm', f'/dev/{device}',
+                            '-n', str(namespace), '--ad',
+                            '--slbs=' + ','.join(str(r[0]) for r in ranges),
+                            '--blocks=' + ','.join(str(r[1]) for r in ranges)],
+                           fail_on_err=fail_on_err)
+    logger.debug(f'Deallocate completed, rc={rc}: {out}')
+    return rc, out, err
+
+
+def sanitize_drive(device, action, fail_on_err=True):
+    # Sanitize applies to the whole NVM subsystem, not just a namespace.  The
+    # command returns once started, progress is in the sanitize log.
+    sanact = SANITIZE_ACTIONS[action]
+    logger.debug(f'Starting {action} sanitize on device {device}')
+    command = [CMD_NVME, 'sanitize', '/dev/' + device, f'--sanact={sanact}']
+    if action == 'overwrite':
+        # An overwrite pass count of 0 means 16 passes.  Only do one.
+        command.append('--owpass=1')
+    rc, out, err = run_cmd(command, fail_on_err=fail_on_err)
+    logger.debug(f'Sanitize started, rc={rc}: {out}')
+    return rc, out, err
+
+
+def get_sanitize_log(device, fail_on_err=True):
+    rc, out, err = run_cmd([CMD_NVME, 'sanitize-log', '/dev/' + device,
+                            '-o', 'json'],
+                           fail_on_err=fail_on_err)
+    if rc != 0:
+        return {}
+    log = json.loads(out)
+
+    # Some nvme-cli levels key the log by the device name
+    return log.get(device, log)
+
+
+def get_sanitize_status(device, fail_on_err=True):
+    # Returns the status (SSTAT bits 2:0) and the progress as a fraction
+    log = get_sanitize_log(device, fail_on_err=fail_on_err)
+    sstat = log.get('sstat', SANITIZE_NEVER)
+    if isinstance(sstat, dict):
+        # Reported as a string such as "(2) Sanitize in Progress."
+        match = re.search(r'\((\d+)\)', str(sstat.get('status', '')))
+        status = int(match.group(1)) if match else SANITIZE_NEVER
+    else:
+        status = int(sstat) & 0x7
+    progress = int(log.get('sprog', 65535)) / 65536.0
+    return status, progress
+
+
 def detach_namespace(device, namespace, controller=-1, fail_on_err=True):
     if controller < 0:
         controller = get_controller(device, fail_on_err=fail_on_err)
@@ -197,8 +355,11 @@ def detach_namespace(device, namespace, controller=-1, fail_on_err=True):
     return rc
 
 
-def delete_namespace(device, namespace, timeout=120000, fail_on_err=True):
-    format_namespace(device, namespace, 2)
+def delete_namespace(device, namespace, timeout=120000, fail_on_err=True,
+                     ses=2):
+    # The namespace is formatted with the secure erase setting first.  Drives
+    # without cryptographic erase need a ses of 0 or 1.
+    format_namespace(device, namespace, ses)
     time.sleep(1)
 
     detach_namespace(device, namespace, fail_on_err=fail_on_err)
@@ -230,10 +391,18 @@ def reset_drive(controller, fail_on_err=True):
         ns_device_path = ns.get("DevicePath")
         namespace_id = ns.get("NameSpace")
 
-        partitions = get_partitions_for_namespace(ns_device_path)
-        for partition in partitions:
-            delete_partition(ns_device_path, partition,
-                             fail_on_err=fail_on_err)
+        # Wipe the whole partition table at once, rather than a parted call
+        # per partition
+        if get_partitions_for_namespace(ns_device_path):
+            block_size = get_namespace_block_size(device, namespace_id,
+                                                  fail_on_err=fail_on_err)
+            try:
+                gpt.clear(ns_device_path, block_size)
+            except OSError as err:
+                if fail_on_err:
+                    raise
+                logger.debug(f'Clearing the partition table of '
+                             f'{ns_device_path} failed: {err}')
         delete_namespace(device, namespace_id, fail_on_err=fail_on_err)
     return True
 
@@ -248,18 +417,23 @@ def create_partition(device, namespace, start, end, fail_on_err=True):
 
 
 def bulk_create_partition(device, namespace, partition_size, quantity,
-                          fail_on_err=True):
-    logger.debug(
-        f'Creating disk label on device {device} namespace {namespace}')
-    rc, out, err = run_cmd([CMD_PARTED, f'/dev/{device}n{namespace}',
-                            '--script', 'mklabel', 'gpt'],
-                           fail_on_err=fail_on_err)
-    logger.debug(f'Create disk label completed, rc={rc}: {out}')
-    for x in range(0, quantity):
-        start = f'{x * partition_size}GB'
-        end = f'{(x+1) * partition_size}GB'
-        create_partition(device, namespace, start,
-                         end, fail_on_err=fail_on_err)
+                          fail_on_err=True, alignment=gpt.DEFAULT_ALIGNMENT,
+                          shift=0):
+    # Writes the whole GPT in one go, and has the kernel re-read it once.
+    # The partition size is in GB, and partitions are aligned to 1 MiB
+    # unless asked otherwise.  Returns the partitions.
+    logger.debug(f'Creating {quantity} partitions on device {device} '
+                 f'namespace {namespace}')
+    ns_device_path = f'/dev/{device}n{namespace}'
+    block_size = get_namespace_block_size(device, namespace,
+                                          fail_on_err=fail_on_err)
+    total_blocks = get_block_device_size(f'{device}n{namespace}') // block_size
+    partitions = gpt.layout(total_blocks,
+                            [partition_size * 1000 ** 3] * quantity,
+                            block_size, alignment=alignment, shift=shift)
+    gpt.write(ns_device_path, partitions, block_size)
+    logger.debug(f'Create partitions completed on {ns_device_path}')
+    return partitions
 
 
 def delete_partition(ns_device_path, partition, fail_on_err=True):
@@ -328,6 +502,54 @@ def get_controller_data(controller, fail_on_err=True):
     return json.loads(stdout)
 
 
+def get_namespace_data(device, namespace, fail_on_err=True):
+    rc, stdout, stderr = run_cmd(
+        [CMD_NVME, 'id-ns', f'/dev/{device}', '-n', str(namespace),
+         '--o', 'json'],
+        fail_on_err=fail_on_err)
+    if rc != 0:
+        return {}
+    return json.loads(stdout)
+
+
+def get_namespace_block_size(device, namespace, fail_on_err=True):
+    # The data size of the LBA format the namespace is formatted with
+    ns_data = get_namespace_data(device, namespace, fail_on_err=fail_on_err)
+    lbaf = ns_data['lbafs'][ns_data['flbas'] & 0xf]
+    return 2 ** lbaf['ds']
+
+
+def get_lba_formats(device, namespace, fail_on_err=True):
+    # Returns the supported LBA formats from Identify Namespace.  Each has
+    # the format index, data size (bytes), metadata size (bytes) and the
+    # relative performance (0 is best).
+    ns_data = get_namespace_data(device, namespace, fail_on_err=fail_on_err)
+    formats = []
+    for index, lbaf in enumerate(ns_data.get('lbafs', [])):
+        if index > ns_data.get('nlbaf', 0):
+            break
+        formats.append({'index': index,
+                        'data_size': 2 ** lbaf['ds'],
+                        'metadata_size': lbaf['ms'],
+                        'relative_performance': lbaf['rp']})
+    return formats
+
+
+def get_pi_types(device, namespace, fail_on_err=True):
+    # Returns the protection information types (1 to 3) the namespace
+    # supports, from the DPC field of Identify Namespace
+    ns_data = get_namespace_data(device, namespace, fail_on_err=fail_on_err)
+    dpc = int(ns_data.get('dpc', 0))
+    return [pi_type for pi_type in [1, 2, 3] if dpc & (1 << (pi_type - 1))]
+
+
+def get_pi_type(device, namespace, fail_on_err=True):
+    # The protection information type the namespace is formatted with, 0 when
+    # it has none
+    ns_data = get_namespace_data(device, namespace, fail_on_err=fail_on_err)
+    return int(ns_data.get('dps', 0)) & 0x7
+
+
 def get_controller_data_human_format(controller, fail_on_err=True):
     rc, stdout, stderr = run_cmd(
         [CMD_NVME, 'id-ctrl', '-H', f'/dev/{controller}'],
@@ -356,11 +578,121 @@ def get_controller_firmware(controller, fail_on_err=True):
     return run_cmd([CMD_CAT, path], fail_on_err=fail_on_err)[1]
 
 
+def get_feature(controller, feature_id, data_len=0, fail_on_err=True):
+    # Returns the current value of the feature, and its data buffer if the
+    # feature has one.
+    command = [CMD_NVME, 'get-feature', f'/dev/{controller}',
+               f'--feature-id={feature_id}', '--sel=0']
+    if data_len:
+        command.append(f'--data-len={data_len}')
+    rc, out, err = run_cmd(command, fail_on_err=fail_on_err)
+    match = re.search(r'[Cc]urrent value:\s*(0x[0-9a-fA-F]+)', out)
+    if rc != 0 or not match:
+        return None, b''
+    return int(match.group(1), 16), parse_hex_dump(out)
+
+
+def set_feature(controller, feature_id, value, data=None, fail_on_err=True):
+    command = [CMD_NVME, 'set-feature', f'/dev/{controller}',
+               f'--feature-id={feature_id}', f'--value={value}']
+    if not data:
+        return run_cmd(command, fail_on_err=fail_on_err)
+
+    with tempfile.NamedTemporaryFile(prefix='feature') as data_file:
+        data_file.write(data)
+        data_file.flush()
+        return run_cmd(command + [f'--data={data_file.name}',
+                                  f'--data-len={len(data)}'],
+                       fail_on_err=fail_on_err)
+
+
+def get_controller_state(controller, fail_on_err=False):
+    # The controller state (ex. live, resetting, connecting)
+    path = f'/sys/class/nvme/{controller}/state'
+    return run_cmd([CMD_CAT, path], fail_on_err=fail_on_err,
+                   warn_on_err=False)[1]
+
+
+def wait_for_controller(controller, timeout=60, namespace=1):
+    # Waits for the controller to be live and the namespace block device to
+    # be back.  Returns the seconds waited, or None if it never came back.
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if get_controller_state(controller) == 'live' and \
+                os.path.exists(f'/dev/{controller}n{namespace}'):
+            return time.monotonic() - start
+        time.sleep(0.1)
+    return None
+
+
+def reset_controller(controller, fail_on_err=False, timeout=None):
+    logger.debug(f'Resetting controller {controller}')
+    rc, out, err = run_cmd([CMD_NVME, 'reset', f'/dev/{controller}'],
+                           fail_on_err=fail_on_err, timeout=timeout)
+    logger.debug(f'Reset completed, rc={rc}: {out}')
+    events.publish('controller_reset', controller=controller)
+    return rc, out, err
+
+
+def firmware_commit(controller, slot, action, fail_on_err=False):
+    # Actions: 0 - replace only, 1 - replace and activate on reset,
+    # 2 - activate the slot on reset, 3 - replace and activate now
+    logger.debug(f'Committing firmware slot {slot} on {controller} with '
+                 f'action {action}')
+    rc, out, err = run_cmd([CMD_NVME, 'fw-activate', f'/dev/{controller}',
+                            '-a', str(action), '-s', str(slot)],
+                           fail_on_err=fail_on_err)
+    logger.debug(f'Firmware commit completed, rc={rc}: {out}')
+    if action == 3:
+        # Activated without a reset, the controller restarts all the same
+        events.publish('controller_reset', controller=controller)
+    return rc, out, err
+
+
+def get_firmware_log(controller, fail_on_err=True):
+    rc, out, err = run_cmd([CMD_NVME, 'fw-log', f'/dev/{controller}',
+                            '-o', 'json'],
+                           fail_on_err=fail_on_err)
+    if rc != 0:
+        return {}
+    log = json.loads(out)
+
+    # Some nvme-cli levels key the log by the device name
+    return log.get(controller, log)
+
+
+def get_writable_firmware_slots(controller, fail_on_err=True):
+    # FRMW bits 3:1 are the number of slots, bit 0 is set if slot 1 is read
+    # only.
+    frmw = int(get_controller_data(controller,
+                                   fail_on_err=fail_on_err).get('frmw', 0))
+    slots = (frmw >> 1) & 0x7
+    first = 2 if frmw & 0x1 else 1
+    return list(range(first, slots + 1))
+
+
 def get_controller_model(controller, fail_on_err=True):
     path = f'/sys/class/nvme/{controller}/model'
     return run_cmd([CMD_CAT, path], fail_on_err=fail_on_err)[1]
 
 
+def get_block_device_size(block_device, fail_on_err=True):
+    # Size in bytes of a block device (ex. nvme0n1).  The kernel reports a
+    # size of 0 for namespaces in a format it is unable to use.
+    path = f'/sys/block/{block_device}/size'
+    rc, out, err = run_cmd([CMD_CAT, path], fail_on_err=fail_on_err)
+    if rc != 0 or not out:
+        return 0
+    return int(out) * 512
+
+
+def get_block_device_write_cache(block_device, fail_on_err=True):
+    # How the kernel treats the device cache, 'write back' or 'write through'.
+    # With write through, the kernel does not send flushes on fsync.
+    path = f'/sys/block/{block_device}/queue/write_cache'
+    return run_cmd([CMD_CAT, path], fail_on_err=fail_on_err)[1]
+
+
 def __find_namespaces_for_serial(namespaces, serial):
     resp = []
     for namespace in namespaces:
@@ -372,7 +704,9 @@ def __find_namespaces_for_serial(namespaces, serial):
 def get_smart_data(device, fail_on_err=True):
     rc, out, err = run_cmd([f'{CMD_NVME} smart-log /dev/{device} -o json'],
                            shell=True, fail_on_err=fail_on_err)
-    return json.loads(out)
+    smart = json.loads(out)
+    events.publish('smart', device=device, smart=smart)
+    return smart
 
 
 def generate_resource_tree(fail_on_err=True):
@@ -412,6 +746,15 @@ def convert_TiB_to_bytes(tb):
     return int(tb * 1024 * 1024 * 1024 * 1024)
 
 
+def convert_size_to_bytes(size):
+    # Converts an fio style size (ex. 4k, 128k, 1m) to bytes
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+    size = str(size).strip().lower()
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
 def convert_bytes_to_GB(byte_count):
     value = float(byte_count) / (1000.0 * 1000.0 * 1000.0)
     return "{:.2f}".format(value)
@@ -0,0 +1,119 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from collections import deque
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+# Lines of each test's log kept in memory.  The full log is on disk.
+RING_SIZE = 1000
+
+ARTIFACT_LINE = re.compile(r'Artifact [^:]+: (\S+\.json\.gz)$')
+
+_log_dir = None
+
+
+def set_log_dir(path):
+    global _log_dir
+    os.makedirs(path, exist_ok=True)
+    _log_dir = path
+
+
+def get_log_dir():
+    # A temporary directory, unless one was set
+    global _log_dir
+    if _log_dir is None:
+        _log_dir = tempfile.mkdtemp(prefix='nvme-qual-logs')
+    return _log_dir
+
+
+class LogCapture(logging.Handler):
+    """Captures a test's log with bounded memory.
+
+    The newest lines are kept in a ring, and every line is spilled to a file
+    for the test.  Large payloads (ex. fio results) are written as separate
+    compressed artifacts, referenced from the log.
+    """
+
+    def __init__(self, test_name, ring_size=RING_SIZE):
+        super(LogCapture, self).__init__()
+        self.test_name = test_name
+        self.ring = deque(maxlen=ring_size)
+        self._file = None
+        self._artifacts = []
+
+    def path(self):
+        return os.path.join(get_log_dir(), f'{self.test_name}.log')
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+            self.ring.append(line)
+            if self._file is None:
+                self._file = open(self.path(), 'w', buffering=1)
+            self._file.write(line + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def add_artifact(self, name, payload):
+        # Writes the payload as compressed JSON, returning its path
+        path = os.path.join(
+            get_log_dir(),
+            f'{self.test_name}-{len(self._artifacts) + 1:03d}-{name}.json.gz')
+        with gzip.open(path, 'wt') as artifact:
+            json.dump(payload, artifact, indent=2)
+        self._artifacts.append(path)
+        return path
+
+    def tail(self):
+        return ''.join(f'{line}\n' for line in self.ring)
+
+    def write_to(self, output):
+        # Streams the full log into the output, with each artifact expanded
+        # after the line referencing it
+        if self._file is not None:
+            self._file.flush()
+        if not os.path.exists(self.path()):
+            return
+        with open(self.path()) as log:
+            for line in log:
+                output.write(line)
+                match = ARTIFACT_LINE.search(line.rstrip('\n'))
+                if match and os.path.exists(match.group(1)):
+                    with gzip.open(match.group(1), 'rt') as artifact:
+                        shutil.copyfileobj(artifact, output)
+                    output.write('\n')
+
+    def reset(self):
+        # Drops the log and its artifacts
+        self.ring.clear()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for path in [self.path()] + self._artifacts:
+            if os.path.exists(path):
+                os.remove(path)
+        self._artifacts = []
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super(LogCapture, self).close()
@@ -14,10 +14,25 @@
 #    under the License.
 
 
+from nvme import dsm
+from nvme import fio
+from nvme import probe
+from nvme import stats
 from nvme import utils as n_utils
 from tests import run
 
 import json
+import os
+import random
+import tempfile
+import time
+
+# What reads of deallocated blocks return, from DLFEAT bits 2:0 in Identify
+# Namespace
+DEALLOCATED_READ = {0: 'not reported', 1: 'all zeros', 2: 'all ones'}
+
+# Max blocks in a single Dataset Management range
+MAX_RANGE_BLOCKS = 0xffffffff
 
 
 class SecureEraseWithMultiNamespaces(run.Run):
@@ -176,3 +191,406 @@ class SecureEraseDrive(run.Run):
 
         self.logger.info("Secure erase successfully completed")
         self.success = True
+
+
+class FormatDurationProfile(run.Run):
+
+    def __init__(self, config):
+        super(FormatDurationProfile, self).__init__()
+
+        test_config = config['test_config'].get('format_duration_profile', {})
+        self.drive = config['drive']['name']
+        ns_sizes = test_config.get('ns_sizes', [10, 50, 100])
+        self.ns_sizes = [size * 1024 ** 3 for size in ns_sizes]
+        self.ses_modes = test_config.get('ses', [0, 1, 2])
+        self.sanitize_actions = test_config.get(
+            'sanitize', ['block', 'crypto', 'overwrite'])
+        self.format_timeout = test_config.get('format_timeout')
+        self.sanitize_timeout = test_config.get('sanitize_timeout', 86400)
+
+    def name(self):
+        return "format_duration_profile"
+
+    def description(self):
+        return ("Times format for each LBA format and secure erase setting "
+                "across namespace sizes, and times each sanitize action.  "
+                "Fits a model of duration against capacity.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        ctrl_data = n_utils.get_controller_data(self.drive)
+        capacity = int(ctrl_data.get('tnvmcap', 0))
+
+        # FNA bit 2 indicates cryptographic erase is supported
+        crypto_erase = bool(int(ctrl_data.get('fna', 0)) & 0x4)
+        ses_modes = list(self.ses_modes)
+        if 2 in ses_modes and not crypto_erase:
+            self.logger.info("Drive does not support cryptographic erase.  "
+                             "Skipping secure erase setting 2.")
+            ses_modes.remove(2)
+        # Each namespace is erased on delete, without crypto erase when the
+        # drive can't do it, whichever settings are profiled
+        cleanup_ses = 2 if crypto_erase else 1
+
+        # Duration samples keyed by (lba format index, ses)
+        samples = {}
+        lba_formats = None
+        failures = 0
+
+        for size in self.ns_sizes:
+            namespace = n_utils.create_namespace(self.drive, size)
+            if lba_formats is None:
+                lba_formats = n_utils.get_lba_formats(self.drive, namespace)
+                for lbaf in lba_formats:
+                    self.logger.info(
+                        f"LBA format {lbaf['index']}: data size "
+                        f"{lbaf['data_size']}, metadata size "
+                        f"{lbaf['metadata_size']}, relative performance "
+                        f"{lbaf['relative_performance']}")
+
+            for lbaf in lba_formats:
+                # The namespace size is fixed in blocks, so the capacity
+                # follows the data size of the LBA format.
+                ns_bytes = (size // 4096) * lbaf['data_size']
+                ns_gb = n_utils.convert_bytes_to_GB(ns_bytes)
+                for ses in ses_modes:
+                    start = time.monotonic()
+                    rc, out, err = n_utils.format_namespace(
+                        self.drive, namespace, ses, test=True,
+                        lbaf=lbaf['index'], timeout=self.format_timeout)
+                    duration = time.monotonic() - start
+                    if rc != 0:
+                        self.logger.error(
+                            f"Format of {ns_gb} GB namespace with LBA format "
+                            f"{lbaf['index']} and ses {ses} failed: {err}")
+                        failures += 1
+                        continue
+
+                    self.logger.info(
+                        f"Format of {ns_gb} GB namespace with LBA format "
+                        f"{lbaf['index']} and ses {ses} took "
+                        f"{duration:.3f} seconds")
+                    samples.setdefault((lbaf['index'], ses), []).append(
+                        (ns_bytes, duration))
+
+            n_utils.delete_namespace(self.drive, namespace, ses=cleanup_ses)
+
+        # Fit duration = slope * capacity + intercept for each combination
+        worst_prediction = 0
+        for (lbaf, ses), points in sorted(samples.items()):
+            slope, intercept, r2 = stats.fit_linear(
+                [p[0] for p in points], [p[1] for p in points])
+            prediction = slope * capacity + intercept
+            worst_prediction = max(worst_prediction, prediction)
+            self.logger.info(
+                f"LBA format {lbaf}, ses {ses}: duration = "
+                f"{slope * 1e12:.3f} s/TB * capacity + {intercept:.3f} s "
+                f"(r^2 {r2:.3f}).  Predicted full drive "
+                f"({n_utils.convert_bytes_to_GB(capacity)} GB) format: "
+                f"{prediction:.1f} seconds")
+
+        if samples:
+            self.logger.info(
+                f"Suggested delete_namespace timeout for a full drive "
+                f"namespace: {int(worst_prediction * 2 * 1000)} ms")
+
+        # Sanitize runs across the whole drive, fill it with one namespace
+        namespace = n_utils.create_namespace(
+            self.drive, n_utils.get_unused_disk_size(self.drive))
+        sanicap = int(ctrl_data.get('sanicap', 0))
+        for action in self.sanitize_actions:
+            if not sanicap & n_utils.SANITIZE_CAPABILITIES[action]:
+                self.logger.info(f"Drive does not support {action} sanitize.  "
+                                 "Skipping.")
+                continue
+
+            if not self._sanitize(action):
+                failures += 1
+        # Leave the drive without the namespace created for sanitize
+        n_utils.delete_namespace(self.drive, namespace, fail_on_err=False,
+                                 ses=cleanup_ses)
+
+        if failures:
+            self.logger.error(f"{failures} format or sanitize operations "
+                              "failed.")
+            return
+
+        self.logger.info("Format and sanitize profiling completed.")
+        self.success = True
+
+    def _sanitize(self, action):
+        start = time.monotonic()
+        rc, out, err = n_utils.sanitize_drive(self.drive, action,
+                                              fail_on_err=False)
+        if rc != 0:
+            self.logger.error(f"Unable to start {action} sanitize: {err}")
+            return False
+
+        status = n_utils.SANITIZE_IN_PROGRESS
+        last_progress = -1
+        while time.monotonic() - start < self.sanitize_timeout:
+            status, progress = n_utils.get_sanitize_status(
+                self.drive, fail_on_err=False)
+            if status != n_utils.SANITIZE_IN_PROGRESS:
+                break
+            # Only log every 10% of progress to keep the report small
+            if int(progress * 10) != last_progress:
+                last_progress = int(progress * 10)
+                self.logger.info(f"  {action} sanitize {progress:.0%} "
+                                 "complete")
+            time.sleep(1)
+        duration = time.monotonic() - start
+
+        if status == n_utils.SANITIZE_IN_PROGRESS:
+            self.logger.error(f"{action} sanitize did not complete within "
+                              f"{self.sanitize_timeout} seconds.")
+            return False
+        if status not in (n_utils.SANITIZE_COMPLETED,
+                          n_utils.SANITIZE_COMPLETED_NO_DEALLOC):
+            self.logger.error(f"{action} sanitize failed with status "
+                              f"{status}.")
+            return False
+
+        self.logger.info(f"{action} sanitize took {duration:.1f} seconds")
+        return True
+
+
+class Deallocate(run.Run):
+
+    def __init__(self, config):
+        super(Deallocate, self).__init__()
+
+        test_config = config['test_config'].get('deallocate', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        # Deallocate throughput is measured over this span, in GB
+        self.span = test_config.get('span', 16) * 1000 ** 3
+        self.range_sizes = test_config.get('range_sizes',
+                                           ['4k', '64k', '1m', '16m'])
+        self.batches = test_config.get('batches', [1, 16, 64, 256])
+        self.batch_range_size = test_config.get(
+            'batch_range_size', 1024 * 1024)
+        self.commands = test_config.get('commands', 100)
+        self.duration = test_config.get('runtime', 30)
+        self.samples = test_config.get('samples', 1024)
+        self.recovery_runtime = test_config.get('recovery_runtime', 600)
+        # Fail if random writes after a full trim take longer than this to
+        # reach 90% of the IOPS seen after a format.  None only reports.
+        self.max_recovery = test_config.get('max_recovery')
+
+    def name(self):
+        return "deallocate"
+
+    def description(self):
+        return ("Measures deallocate (TRIM) throughput and latency by range "
+                "size and ranges per command, checks what deallocated blocks "
+                "read back as, and compares random write recovery after a "
+                "full trim with after a format.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        # Create a single namespace
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+        self.block_size = n_utils.get_namespace_block_size(self.drive, 1)
+        self.device = f'/dev/{self.drive}n1'
+
+        ns_data = n_utils.get_namespace_data(self.drive, 1)
+        dlfeat = int(ns_data.get('dlfeat', 0))
+        self.logger.info(
+            f"DLFEAT {dlfeat:#x}: deallocated blocks read as "
+            f"{DEALLOCATED_READ.get(dlfeat & 0x7, 'reserved')}, deallocate "
+            f"in Write Zeroes {'' if dlfeat & 0x8 else 'not '}supported")
+
+        if not self._range_sizes():
+            return
+        if not self._batches():
+            return
+        if not self._read_back(dlfeat & 0x7):
+            return
+
+        trimmed = self._recovery('full trim', self._trim_drive)
+        formatted = self._recovery('format', self._format_drive)
+        if trimmed is None or formatted is None:
+            return
+
+        target = 0.9 * stats.mean(formatted[5:])
+        settled = stats.settle_time(trimmed, target)
+        self.logger.info(
+            f"Random write IOPS in the first minute: "
+            f"{stats.mean(trimmed[:60]):.0f} after a full trim, "
+            f"{stats.mean(formatted[:60]):.0f} after a format")
+        if settled is None:
+            self.logger.info(f"Random writes after a full trim never reached "
+                             f"90% of the {target / 0.9:.0f} IOPS after a "
+                             "format.")
+        else:
+            self.logger.info(f"Random writes after a full trim reached 90% "
+                             f"of the IOPS after a format in {settled} "
+                             "seconds.")
+        if self.max_recovery is not None and \
+                (settled is None or settled > self.max_recovery):
+            self.logger.error(f"Recovery after a full trim is above the "
+                              f"limit of {self.max_recovery} seconds.  DRIVE "
+                              "FAILED.")
+            return
+
+        self.logger.info("Test passed!")
+        self.success = True
+
+    def _fill(self, size):
+        # Maps the blocks, so there is something to deallocate
+        rc, output, err = fio.run_job('fill', self.device, 'write', '128k',
+                                      iodepth=64, size=size,
+                                      ioengine=self.ioengine)
+        if rc != 0:
+            self.logger.error(f"Failed to fill the namespace: {err}")
+            return False
+        return True
+
+    def _range_sizes(self):
+        for range_size in self.range_sizes:
+            if not self._fill(str(self.span)):
+                return False
+            # Trims are only issued by the synchronous engines
+            rc, output, err = fio.run_job(
+                f'trim{range_size}', self.device, 'randtrim', range_size,
+                runtime=self.duration, size=str(self.span), ioengine='psync',
+                sync=False)
+            if rc != 0:
+                self.logger.error(f"{range_size} deallocate failed: {err}")
+                return False
+            result = fio.summarize(output['jobs'][0], 'trim')
+            self.logger.info(
+                f"  {range_size} ranges: {result['iops']:.0f} ranges/s, "
+                f"{result['bw']} KiB/s, latency mean "
+                f"{result['lat_mean']:.0f} us, p99 {result['lat_p99']:.0f} "
+                f"us, max {result['lat_max']:.0f} us")
+        return True
+
+    def _batches(self):
+        # Several ranges per Dataset Management command.  The commands are
+        # passed through the block device rather than issued with nvme-cli,
+        # whose start up would be most of the latency.
+        if not self._fill(str(self.span)):
+            return False
+        blocks = self.batch_range_size // self.block_size
+        span_ranges = self.span // self.batch_range_size
+        fd = os.open(self.device, os.O_RDONLY)
+        try:
+            for count in self.batches:
+                if not self._batch(fd, count, blocks, span_ranges):
+                    return False
+        finally:
+            os.close(fd)
+        return True
+
+    def _batch(self, fd, count, blocks, span_ranges):
+        latencies = []
+        for i in range(0, self.commands):
+            ranges = [(random.randrange(span_ranges) * blocks, blocks)
+                      for x in range(0, count)]
+            start = time.monotonic()
+            status = dsm.deallocate(fd, 1, ranges)
+            latencies.append(time.monotonic() - start)
+            if status != 0:
+                self.logger.error(f"Deallocate of {count} ranges failed "
+                                  f"with status {status:#x}")
+                return False
+        seconds = sum(latencies)
+        trimmed_bytes = count * self.commands * self.batch_range_size
+        self.logger.info(
+            f"  {count} ranges per command: "
+            f"{count * self.commands / seconds:.0f} ranges/s, "
+            f"{trimmed_bytes / seconds / 1e9:.2f} GB/s, latency mean "
+            f"{stats.mean(latencies) * 1e6:.0f} us, "
+            f"p99 {stats.percentile(latencies, 99) * 1e6:.0f} us")
+        return True
+
+    def _read_back(self, read_value):
+        # Deallocates a written region and samples what its blocks read as
+        size = min(self.span, 1000 ** 3)
+        if not self._fill(str(size)):
+            return False
+        blocks = size // self.block_size
+        n_utils.deallocate(self.drive, 1, [(0, blocks)])
+
+        counts = {'zeros': 0, 'ones': 0, 'data': 0}
+        fd = probe.open_direct(self.device)
+        buf = probe.aligned_buffer(self.block_size)
+        try:
+            for i in range(0, self.samples):
+                probe.timed_read(fd, buf, random.randrange(blocks) *
+                                 self.block_size)
+                # mmap has no count, compare a copy
+                data = buf[:]
+                if data == bytes(len(data)):
+                    counts['zeros'] += 1
+                elif data == b'\xff' * len(data):
+                    counts['ones'] += 1
+                else:
+                    counts['data'] += 1
+        finally:
+            os.close(fd)
+        self.logger.info(f"Deallocated blocks read back: {counts['zeros']} "
+                         f"zeros, {counts['ones']} ones, {counts['data']} "
+                         "other data")
+
+        expected = {1: 'zeros', 2: 'ones'}.get(read_value)
+        if expected is not None and counts[expected] != self.samples:
+            self.logger.error(f"DLFEAT reports deallocated blocks read as "
+                              f"{expected}, but "
+                              f"{self.samples - counts[expected]} of "
+                              f"{self.samples} did not.  DRIVE FAILED.")
+            return False
+        return True
+
+    def _trim_drive(self):
+        blocks = n_utils.get_block_device_size(f'{self.drive}n1') // \
+            self.block_size
+        ranges = [(slba, min(MAX_RANGE_BLOCKS, blocks - slba))
+                  for slba in range(0, blocks, MAX_RANGE_BLOCKS)]
+        return n_utils.deallocate(self.drive, 1, ranges,
+                                  fail_on_err=False)[0] == 0
+
+    def _format_drive(self):
+        return n_utils.format_namespace(self.drive, 1, ses=0)[0] == 0
+
+    def _recovery(self, state, prepare):
+        # Fills the drive, prepares it, then records the per second random
+        # write IOPS
+        self.logger.info(f"Measuring random write recovery after a {state}")
+        if not self._fill('100%'):
+            return None
+        start = time.monotonic()
+        if not prepare():
+            self.logger.error(f"The {state} failed.")
+            return None
+        self.logger.info(f"  The {state} took "
+                         f"{time.monotonic() - start:.1f} seconds")
+
+        with tempfile.TemporaryDirectory(prefix='deallocate') as log_dir:
+            prefix = os.path.join(log_dir, 'recovery')
+            rc, output, err = fio.run_job(
+                'recovery', self.device, 'randwrite', '4k', iodepth=32,
+                numjobs=4, runtime=self.recovery_runtime,
+                ioengine=self.ioengine, group_reporting=False,
+                extra_args=[f'--write_iops_log={prefix}',
+                            '--log_avg_msec=1000'])
+            if rc != 0:
+                self.logger.error(f"Random writes after a {state} failed: "
+                                  f"{err}")
+                return None
+            return fio.read_log_series(prefix, 'iops')
@@ -0,0 +1,256 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import events
+from nvme import utils as n_utils
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import logging
+import os
+import shlex
+import threading
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'nvme_qual'
+
+CONTENT_TYPE_TEXT = 'text/plain; version=0.0.4; charset=utf-8'
+CONTENT_TYPE_OPENMETRICS = \
+    'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Admin command latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300]
+
+# fio summary keys published as latency percentiles, in microseconds.
+# quantile is reserved for summaries in OpenMetrics.
+FIO_PERCENTILES = {'lat_p50': '50', 'lat_p99': '99', 'lat_p999': '99.9'}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"'
+                          for key, value in labels) + '}'
+
+
+def _nvme_subcommand(command):
+    # The nvme-cli subcommand (ex. smart-log) of a command, or None when it
+    # isn't an nvme-cli command.  Shell commands are a string, or a list
+    # holding one string.
+    if isinstance(command, str):
+        command = [command]
+    args = []
+    for arg in command:
+        args.extend(shlex.split(arg) if ' ' in arg else [arg])
+    if len(args) < 2 or \
+            os.path.basename(args[0]) != os.path.basename(n_utils.CMD_NVME):
+        return None
+    return args[1]
+
+
+class Exporter(threading.Thread):
+    """Serves the progress of the qualification as Prometheus metrics.
+
+    The metrics are kept up to date from the event stream: tests starting
+    and finishing, fio status, SMART data and commands finishing.  Nothing
+    is polled, as commands issued here would count as progress to the hang
+    watchdog, so the temperature is from the latest SMART read by the tests.
+    Scrapes asking for OpenMetrics get it, others get the Prometheus text
+    format.
+    """
+
+    def __init__(self, drive, port, address='127.0.0.1'):
+        super(Exporter, self).__init__(daemon=True)
+        self.drive = drive
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.running = []
+        self.selected = 0
+        self.completed = 0
+        self.results = {'passed': 0, 'failed': 0, 'skipped': 0}
+        # Latest fio summary of each run and direction
+        self.fio = {}
+        self.temperature = None
+        # Per nvme-cli subcommand: bucket counts, count, sum and failures
+        self.admin = {}
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                openmetrics = 'application/openmetrics-text' in \
+                    self.headers.get('Accept', '')
+                body = exporter.render(openmetrics).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE_OPENMETRICS
+                                 if openmetrics else CONTENT_TYPE_TEXT)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        # Listen from the start, so no event published after start() is
+        # missed
+        events.listen(self._on_event)
+
+    def run(self):
+        server_thread = threading.Thread(target=self.server.serve_forever,
+                                         daemon=True)
+        server_thread.start()
+        logger.info("Serving metrics on "
+                    f"http://{self.server.server_address[0]}:"
+                    f"{self.server.server_address[1]}/metrics")
+        self._stop_event.wait()
+        events.unlisten(self._on_event)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def _on_event(self, kind, now, fields):
+        with self._lock:
+            if kind == 'suite':
+                self.selected = fields['tests']
+                self.completed = 0
+            elif kind == 'test_start':
+                self.running.append(fields['test'])
+            elif kind == 'test_end':
+                if fields['test'] in self.running:
+                    self.running.remove(fields['test'])
+                self.completed += 1
+                result = fields['result']
+                self.results['skipped' if result is None else
+                             'passed' if result else 'failed'] += 1
+            elif kind == 'fio':
+                for ddir, summary in fields['summary'].items():
+                    self.fio[(fields['name'], ddir)] = summary
+            elif kind == 'smart':
+                if fields['device'] == self.drive and \
+                        'temperature' in fields['smart']:
+                    self.temperature = int(fields['smart']['temperature'])
+            elif kind == 'command':
+                self._record_command(fields)
+
+    def _record_command(self, fields):
+        subcommand = _nvme_subcommand(fields['command'])
+        if subcommand is None:
+            return
+        if subcommand not in self.admin:
+            self.admin[subcommand] = {'buckets': [0] * len(LATENCY_BUCKETS),
+                                      'count': 0, 'sum': 0.0, 'failures': 0}
+        admin = self.admin[subcommand]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if fields['seconds'] <= bound:
+                admin['buckets'][i] += 1
+        admin['count'] += 1
+        admin['sum'] += fields['seconds']
+        if fields['returncode'] != 0:
+            admin['failures'] += 1
+
+    def _families(self):
+        # Each family is (name, type, help, samples), a sample being (suffix,
+        # labels, value)
+        drive = [('drive', self.drive)]
+        families = [
+            ('tests_selected', 'gauge', 'Tests selected to run',
+             [('', drive, self.selected)]),
+            ('tests_completed', 'gauge',
+             'Tests finished in this run of the suite',
+             [('', drive, self.completed)]),
+            ('test_running', 'gauge', 'Tests running now',
+             [('', drive + [('test', test)], 1) for test in self.running]),
+            ('test_results', 'counter', 'Tests finished, by result',
+             [('_total', drive + [('result', result)], count)
+              for result, count in sorted(self.results.items())])]
+
+        fio = sorted(self.fio.items())
+        families.extend([
+            ('fio_iops', 'gauge', 'IOPS of the latest fio runs',
+             [('', drive + [('job', name), ('rw', ddir)], summary['iops'])
+              for (name, ddir), summary in fio]),
+            ('fio_bandwidth_bytes', 'gauge',
+             'Bandwidth of the latest fio runs, in bytes per second',
+             [('', drive + [('job', name), ('rw', ddir)],
+               summary['bw'] * 1024) for (name, ddir), summary in fio]),
+            ('fio_latency_seconds', 'gauge',
+             'Completion latency of the latest fio runs',
+             [('', drive + [('job', name), ('rw', ddir),
+                            ('percentile', percentile)], summary[key] / 1e6)
+              for (name, ddir), summary in fio
+              for key, percentile in sorted(FIO_PERCENTILES.items())]),
+            ('fio_latency_mean_seconds', 'gauge',
+             'Mean completion latency of the latest fio runs',
+             [('', drive + [('job', name), ('rw', ddir)],
+               summary['lat_mean'] / 1e6) for (name, ddir), summary in fio])])
+
+        if self.temperature is not None:
+            families.append(
+                ('temperature_celsius', 'gauge',
+                 'Composite temperature from the SMART log',
+                 [('', drive, self.temperature - 273)]))
+
+        histogram = []
+        failures = []
+        for subcommand, admin in sorted(self.admin.items()):
+            labels = drive + [('command', subcommand)]
+            for bound, count in zip(LATENCY_BUCKETS, admin['buckets']):
+                histogram.append(
+                    ('_bucket', labels + [('le', str(float(bound)))], count))
+            histogram.extend([
+                ('_bucket', labels + [('le', '+Inf')], admin['count']),
+                ('_count', labels, admin['count']),
+                ('_sum', labels, admin['sum'])])
+            failures.append(('_total', labels, admin['failures']))
+        families.extend([
+            ('admin_command_seconds', 'histogram',
+             'Latency of nvme-cli commands', histogram),
+            ('admin_command_failures', 'counter',
+             'nvme-cli commands that failed', failures)])
+        return families
+
+    def render(self, openmetrics=False):
+        with self._lock:
+            families = self._families()
+        lines = []
+        for name, kind, help_text, samples in families:
+            name = f'{PREFIX}_{name}'
+            # The Prometheus text format names counters with their _total
+            # suffix, OpenMetrics without it
+            family = name if openmetrics or kind != 'counter' \
+                else f'{name}_total'
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+            for suffix, labels, value in samples:
+                lines.append(f'{name}{suffix}{_labels(labels)} {value}')
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
@@ -14,13 +14,57 @@
 #    under the License.
 
 
+from nvme import fio
+from nvme import fw_download
+from nvme import probe
+from nvme import stats
 from nvme import utils as n_utils
 from tests import run
 
+import itertools
 import os
 import time
 
 
+# Times a failed download is resumed from the chunk that failed, and the
+# pause before resuming
+RESUMES = 2
+RESUME_DELAY = 10
+
+
+def download_firmware(logger, drive, fw_path):
+    # Downloads the image in chunks sized for the drive, logging the result.
+    # A chunk failing all its retries is resumed from after a pause, rather
+    # than starting over.
+    offset = 0
+    for resume in range(0, RESUMES + 1):
+        try:
+            result = fw_download.download(drive, fw_path,
+                                          start_offset=offset)
+            break
+        except fw_download.DownloadError as err:
+            if resume == RESUMES:
+                logger.error(f"Unable to load firmware on drive {drive}.  "
+                             f"Failing test.  Error is: {err}")
+                return False
+            logger.warning(f"{err}.  Resuming from offset {err.offset} in "
+                           f"{RESUME_DELAY} seconds.")
+            offset = err.offset
+            time.sleep(RESUME_DELAY)
+        except (OSError, ValueError) as err:
+            logger.error(f"Unable to load firmware on drive {drive}.  Failing "
+                         f"test.  Error is: {err}")
+            return False
+
+    logger.info(f"Firmware download completed successfully, resumed "
+                f"{resume} times.  {result['bytes']} bytes in "
+                f"{result['chunks']} chunks from offset {offset}, "
+                f"{result['seconds']:.2f} seconds "
+                f"({result['throughput'] / 1024 / 1024:.2f} MiB/s), "
+                f"{result['retries']} retries.")
+    return True
+
+
 class ApplyNew(run.Run):
 
     def __init__(self, config):
@@ -53,16 +97,8 @@ class ApplyNew(run.Run):
             return
 
         # Step 1: Download the firmware
-        cmd = f'nvme fw-download /dev/{self.drive} --fw={self.fw_path}'
-        self.logger.info(f"Firmware download command: {cmd}")
-        rc, std_out, std_err = n_utils.run_cmd(
-            cmd, shell=True, fail_on_err=False)
-        if rc != 0:
-            self.logger.error(
-                f"Unable to load firmware on drive {self.drive}.  Failing test.  Error is: {std_err}")
+        if not download_firmware(self.logger, self.drive, self.fw_path):
             return
-        else:
-            self.logger.info(f"Firmware download completed successfully.  Response: \n{std_out}")
 
 
         # # Step 2: dry-run activate the firmware
@@ -123,3 +159,290 @@ class ApplyNew(run.Run):
         if not self.success:
             self.logger.error("Device not found after >60 seconds after FW update.  Failed test.")
             return
+
+
+class ActivationDowntime(run.Run):
+
+    def __init__(self, config):
+        super(ActivationDowntime, self).__init__()
+
+        test_config = config['test_config'].get('fw_activation', {})
+        self.drive = config['drive']['name']
+        self.fw_path = test_config.get('fw_file')
+        self.expected_version = test_config.get('expected_version')
+        self.slot = test_config.get('slot', 2)
+        self.actions = test_config.get('actions', [1, 2, 3])
+        # Seconds of I/O measured before and after each activation
+        self.settle = test_config.get('settle', 10)
+        # Max allowed I/O gap in ms.  None only reports.
+        self.max_gap_ms = test_config.get('max_gap_ms')
+
+    def name(self):
+        return "fw_activation"
+
+    def description(self):
+        return ("Measures how long I/O stalls while firmware is downloaded, "
+                "committed and activated, for each commit action.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        if not self.fw_path or not os.path.exists(self.fw_path):
+            self.logger.error(f'Firmware not available at path {self.fw_path}')
+            return
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        # Create a single namespace
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+
+        # FRMW bit 4 indicates activation without a reset is supported
+        frmw = int(n_utils.get_controller_data(self.drive).get('frmw', 0))
+
+        passed = True
+        for action in self.actions:
+            if action == 3 and not frmw & 0x10:
+                self.logger.info("Drive does not support activation without "
+                                 "reset.  Skipping commit action 3.")
+                continue
+            if not self._activate(action):
+                passed = False
+
+        if passed:
+            self.logger.info("Firmware activated with each commit action.")
+            self.success = True
+
+    def _activate(self, action):
+        self.logger.info(f"Measuring activation with commit action {action}")
+        io_probe = probe.IOProbe(f'/dev/{self.drive}n1')
+        io_probe.start()
+        time.sleep(self.settle)
+        update_start = time.monotonic()
+
+        # Action 2 activates the image already in the slot
+        if action != 2:
+            if not download_firmware(self.logger, self.drive, self.fw_path):
+                io_probe.stop()
+                return False
+        download_end = time.monotonic()
+
+        rc, std_out, std_err = n_utils.firmware_commit(self.drive, self.slot,
+                                                       action)
+        commit_end = time.monotonic()
+
+        # Action 3 may still report that a reset is required to activate
+        needs_reset = action in [1, 2] or \
+            'reset' in f'{std_out}{std_err}'.lower()
+        if rc != 0 and not needs_reset:
+            io_probe.stop()
+            self.logger.error(f"Unable to commit firmware on drive "
+                              f"{self.drive}.  Error is: {std_err}")
+            return False
+
+        if needs_reset:
+            n_utils.reset_controller(self.drive)
+        if n_utils.wait_for_controller(self.drive) is None:
+            io_probe.stop()
+            self.logger.error("Device not found after >60 seconds after FW "
+                              "update.")
+            return False
+        update_end = time.monotonic()
+
+        time.sleep(self.settle)
+        io_probe.stop()
+
+        gap_ms = io_probe.max_gap(update_start, update_end) * 1000
+        errors = len([t for t in io_probe.errors
+                      if update_start <= t < update_end])
+        self.logger.info(
+            f"  Download {download_end - update_start:.3f} s, commit "
+            f"{commit_end - download_end:.3f} s, activation "
+            f"{update_end - commit_end:.3f} s")
+        self.logger.info(f"  Longest I/O gap: {gap_ms:.0f} ms, {errors} "
+                         "failed reads")
+        for phase, start, end in [('before', None, update_start),
+                                  ('during', update_start, update_end),
+                                  ('after', update_end, None)]:
+            latencies = io_probe.latencies(start, end)
+            self.logger.info(
+                f"  Latency {phase}: {len(latencies)} reads, p50 "
+                f"{stats.percentile(latencies, 50) * 1e6:.0f} us, p99 "
+                f"{stats.percentile(latencies, 99) * 1e6:.0f} us, p99.9 "
+                f"{stats.percentile(latencies, 99.9) * 1e6:.0f} us, max "
+                f"{max(latencies, default=0) * 1e6:.0f} us")
+
+        dev_fw = n_utils.get_controller_firmware(self.drive)
+        if self.expected_version is not None and \
+                dev_fw != str(self.expected_version):
+            self.logger.error(f"Firmware found was {dev_fw}.  The expected fw "
+                              f"is {self.expected_version}.")
+            return False
+
+        if self.max_gap_ms is not None and gap_ms > self.max_gap_ms:
+            self.logger.error(f"I/O stalled for {gap_ms:.0f} ms, above the "
+                              f"limit of {self.max_gap_ms} ms.")
+            return False
+        return True
+
+
+class FirmwareCycling(run.Run):
+
+    # Short profiles run after each activation
+    PROFILES = [fio.SEQ_READ, fio.RAND_READ, fio.RAND_WRITE]
+
+    def __init__(self, config):
+        super(FirmwareCycling, self).__init__()
+
+        test_config = config['test_config'].get('fw_cycling', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.images = test_config.get('images', [])
+        self.duration = test_config.get('runtime', 30)
+        # Size of the region written before, and verified after, each
+        # activation.  The perf profiles run past it.
+        self.verify_size = test_config.get('verify_size', 10) * 1024 ** 3
+        # Max allowed drop against the first run of the same firmware, in
+        # percent
+        self.max_degradation = test_config.get('max_degradation', 10)
+
+    def name(self):
+        return "fw_cycling"
+
+    def description(self):
+        return ("Upgrades and downgrades between each pair of firmware images "
+                "across the writable slots.  Checks data integrity and "
+                "performance after each activation.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        if len(self.images) < 2:
+            self.logger.error("At least two firmware images are required.")
+            return
+        for image in self.images:
+            if not os.path.exists(image['fw_file']):
+                self.logger.error(
+                    f"Firmware not available at path {image['fw_file']}")
+                return
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        # Create a single namespace
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+
+        slots = n_utils.get_writable_firmware_slots(self.drive)
+        if not slots:
+            self.logger.error(f"Drive {self.drive} has no writable firmware "
+                              "slots.")
+            return
+        self.logger.info(f"Writable firmware slots: {slots}")
+        self.logger.info(f"Firmware slot log: "
+                         f"{n_utils.get_firmware_log(self.drive)}")
+
+        # Every ordered pair of images is an upgrade or a downgrade
+        sequence = []
+        for source, target in itertools.permutations(self.images, 2):
+            if not sequence or sequence[-1] is not source:
+                sequence.append(source)
+            sequence.append(target)
+
+        rc, output, err = self._verify_job(write=True)
+        if rc != 0:
+            self.logger.error(f"Unable to write the verify region: {err}")
+            return
+
+        # Results of each activation, by firmware version
+        matrix = {}
+        passed = True
+        for step, image in enumerate(sequence):
+            slot = slots[step % len(slots)]
+            version = str(image['version'])
+            self.logger.info(f"Step {step + 1} of {len(sequence)}: "
+                             f"activating {version} in slot {slot}")
+            if not self._activate(image['fw_file'], slot, version):
+                return
+
+            rc, output, err = self._verify_job(write=False)
+            if rc != 0:
+                self.logger.error(f"Data verification failed after "
+                                  f"activating {version}: {err}")
+                passed = False
+
+            results = self._run_profiles(version)
+            if results is None:
+                return
+            baseline = matrix.setdefault(version, [results])[0]
+            if results is not baseline:
+                matrix[version].append(results)
+                for name in results:
+                    change = (1 - results[name]['iops'] /
+                              baseline[name]['iops']) * 100 \
+                        if baseline[name]['iops'] else 0
+                    if change > self.max_degradation:
+                        self.logger.error(
+                            f"{name} on {version} is {change:.1f}% below the "
+                            f"first run of that firmware.")
+                        passed = False
+
+        self.logger.info("Performance by firmware (mean IOPS, worst p99 us):")
+        for version, runs in matrix.items():
+            row = []
+            for name, *profile in self.PROFILES:
+                iops = stats.mean([r[name]['iops'] for r in runs])
+                p99 = max([r[name]['lat_p99'] for r in runs])
+                row.append(f"{name} {iops:.0f} / {p99:.0f}")
+            self.logger.info(f"  {version} ({len(runs)} runs): "
+                             f"{', '.join(row)}")
+
+        if passed:
+            self.logger.info("Firmware cycling completed successfully.")
+            self.success = True
+
+    def _activate(self, fw_file, slot, version):
+        if not download_firmware(self.logger, self.drive, fw_file):
+            return False
+
+        rc, std_out, std_err = n_utils.firmware_commit(self.drive, slot, 1)
+        if rc != 0:
+            self.logger.error(f"Unable to commit firmware on drive "
+                              f"{self.drive}.  Error is: {std_err}")
+            return False
+
+        n_utils.reset_controller(self.drive)
+        if n_utils.wait_for_controller(self.drive) is None:
+            self.logger.error("Device not found after >60 seconds after FW "
+                              "update.")
+            return False
+
+        dev_fw = n_utils.get_controller_firmware(self.drive)
+        if dev_fw != version:
+            self.logger.error(f"Firmware found was {dev_fw}.  The expected fw "
+                              f"is {version}.")
+            return False
+        return True
+
+    def _verify_job(self, write):
+        # Writes a checksummed pattern, or reads it back and verifies it
+        extra_args = ['--verify=crc32c']
+        if write:
+            extra_args.append('--do_verify=0')
+        else:
+            extra_args.append('--verify_only')
+        return fio.run_job('verify', f'/dev/{self.drive}n1', 'write', '128k',
+                           iodepth=32, ioengine=self.ioengine,
+                           size=self.verify_size, sync=False,
+                           extra_args=extra_args)
+
+    def _run_profiles(self, version):
+        # Runs past the verified data, so it is left intact
+        return fio.run_profiles(
+            self.PROFILES, f'/dev/{self.drive}n1', self.logger,
+            f"on {version}", extra_args=[f'--offset={self.verify_size}'],
+            runtime=self.duration, ioengine=self.ioengine)
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from nvme import fio
+from nvme import stats
 from nvme import utils as n_utils
 from tests import run
 
@@ -143,7 +145,7 @@ class MultiNSPerf(run.Run):
         rc, std_out, std_err = \
             n_utils.run_cmd(f'fio --name=seqmixed --iodepth=64 --rw=rw --bs=128k --runtime={self.duration} '
                             f'--ramp={self.ramp} --group_reporting --numjobs=32 --sync=1 --direct=1 --size=100% '
-                            f'--ioengine={self.ioengine} --filename=/dev/{self.drive}n1 --output-format=json', shell=True)
+                            f'--ioengine={self.ioengine} --filename={drive_string} --output-format=json', shell=True)
 
         results = json.loads(std_out)
         read_bw = results['jobs'][0]['read']['bw']
@@ -257,3 +259,218 @@ class ParallelIO(run.Run):
                     self.drive, namespace.get("NameSpace"))
         self.logger.info("Completed Parallel I/O & Namespace Creation test")
         self.success = True
+
+
+class NoisyNeighbor(run.Run):
+
+    def __init__(self, config):
+        super(NoisyNeighbor, self).__init__()
+
+        test_config = config['test_config'].get('noisy_neighbor', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.num_namespaces = test_config.get('ns', 4)
+        self.namespace_size = test_config.get('ns_size', 20) * 1024 ** 3
+        self.duration = test_config.get('runtime', 60)
+        self.ramp = test_config.get('ramptime', 10)
+        # Max allowed multiple of the victim p99 latency when alone
+        self.max_latency_increase = test_config.get(
+            'max_latency_increase', 2.0)
+        # Min Jain's fairness index across the aggressor namespaces
+        self.min_fairness = test_config.get('min_fairness', 0.9)
+
+    def name(self):
+        return "noisy_neighbor"
+
+    def description(self):
+        return ("Runs a latency sensitive random read on one namespace while "
+                "sequential writers run on the others.  Checks the victim "
+                "latency and the fairness across namespaces.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        if self.num_namespaces < 2:
+            self.logger.error("At least 2 namespaces are required.")
+            return
+
+        # Make sure the drive supports at least the number of NS's expected
+        drive_namespaces = n_utils.get_max_namespaces(self.drive)
+        if drive_namespaces < self.num_namespaces:
+            self.logger.error(f"Drive {self.drive} supports {drive_namespaces} namespaces. "
+                              f"At least {self.num_namespaces} required.")
+            return
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        n_utils.bulk_create_namespace(
+            self.drive, self.namespace_size, 4096, self.num_namespaces)
+
+        victim = {'name': 'victim', 'filename': f'/dev/{self.drive}n1',
+                  'rw': 'randread', 'bs': '4k', 'iodepth': 1}
+        aggressors = [{'name': f'ns{x}', 'filename': f'/dev/{self.drive}n{x}',
+                       'rw': 'write', 'bs': '128k', 'iodepth': 64}
+                      for x in range(2, self.num_namespaces + 1)]
+
+        # The victim alone
+        rc, results, err = fio.run_jobs(
+            [victim], 'randread', '4k', runtime=self.duration, ramp=self.ramp,
+            ioengine=self.ioengine, sync=False)
+        if rc != 0:
+            self.logger.error(f"Victim workload failed: {err}")
+            return
+        alone = fio.summarize(results['jobs'][0], 'read')
+        self.logger.info(f"Victim alone: {alone['iops']:.0f} IOPS, p99 "
+                         f"{alone['lat_p99']:.0f} us, p99.9 "
+                         f"{alone['lat_p999']:.0f} us")
+
+        # The victim with the aggressors on every other namespace
+        rc, results, err = fio.run_jobs(
+            [victim] + aggressors, 'randread', '4k', runtime=self.duration,
+            ramp=self.ramp, ioengine=self.ioengine, sync=False)
+        if rc != 0:
+            self.logger.error(f"Noisy neighbor workload failed: {err}")
+            return
+
+        by_job = fio.results_by_job(results)
+        contended = fio.summarize_clones(by_job['victim'], 'read')
+        increase = contended['lat_p99'] / alone['lat_p99'] \
+            if alone['lat_p99'] else 0
+        self.logger.info(
+            f"Victim with neighbors: {contended['iops']:.0f} IOPS, p99 "
+            f"{contended['lat_p99']:.0f} us ({increase:.2f}x), p99.9 "
+            f"{contended['lat_p999']:.0f} us")
+
+        bandwidth = []
+        for aggressor in aggressors:
+            summary = fio.summarize_clones(by_job[aggressor['name']], 'write')
+            bandwidth.append(summary['bw'])
+            self.logger.info(
+                f"  {aggressor['filename']}: {summary['bw']} KiB/s, p99 "
+                f"{summary['lat_p99']:.0f} us")
+        fairness = stats.jain_fairness(bandwidth)
+        self.logger.info(f"Jain's fairness index across the writers: "
+                         f"{fairness:.3f}")
+
+        passed = True
+        if increase > self.max_latency_increase:
+            self.logger.error(
+                f"Victim p99 latency grew {increase:.2f}x with noisy "
+                f"neighbors, above the limit of {self.max_latency_increase}x."
+                "  DRIVE FAILED.")
+            passed = False
+        if fairness < self.min_fairness:
+            self.logger.error(
+                f"Fairness index {fairness:.3f} is below the limit of "
+                f"{self.min_fairness}.  DRIVE FAILED.")
+            passed = False
+
+        if passed:
+            self.logger.info("Namespaces are isolated from noisy neighbors.")
+            self.success = True
+
+
+class NamespaceScaling(run.Run):
+
+    # Profiles run for each namespace count: name, rw, bs, iodepth
+    PROFILES = [('4krandread', 'randread', '4k', 32),
+                ('seqread', 'read', '128k', 64)]
+
+    def __init__(self, config):
+        super(NamespaceScaling, self).__init__()
+
+        test_config = config['test_config'].get('ns_scaling', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        max_ns = config['test_config']['general']['max_ns']
+        self.series = test_config.get(
+            'series', [2 ** x for x in range(0, max_ns.bit_length())
+                       if 2 ** x < max_ns] + [max_ns])
+        self.namespace_size = test_config.get('ns_size', 20) * 1024 ** 3
+        self.total_jobs = test_config.get('jobs', 32)
+        self.duration = test_config.get('runtime', 60)
+        self.ramp = test_config.get('ramptime', 10)
+        # A drop of more than this fraction from the best result so far marks
+        # where namespace overhead starts to cost performance
+        self.knee_tolerance = test_config.get('knee_tolerance', 0.1)
+
+    def name(self):
+        return "ns_scaling"
+
+    def description(self):
+        return ("Runs concurrent I/O across a growing number of namespaces, "
+                "and reports how the aggregate performance scales.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        # Make sure the drive supports at least the number of NS's expected
+        drive_namespaces = n_utils.get_max_namespaces(self.drive)
+        if drive_namespaces < max(self.series):
+            self.logger.error(f"Drive {self.drive} supports {drive_namespaces} namespaces. "
+                              f"At least {max(self.series)} required.")
+            return
+
+        # Aggregate results by namespace count
+        curve = {}
+        for count in self.series:
+            self.logger.info(f"  Resetting drive {self.drive}")
+            tree = n_utils.generate_resource_tree()
+            n_utils.reset_drive(tree[self.drive])
+
+            start = time.monotonic()
+            namespaces = n_utils.bulk_create_namespace(
+                self.drive, self.namespace_size, 4096, count)
+            self.logger.info(f"Provisioned {count} namespaces in "
+                             f"{time.monotonic() - start:.1f} seconds")
+
+            # Split the jobs evenly across the namespaces
+            numjobs = max(1, self.total_jobs // count)
+            jobs = [{'name': f'ns{namespace}',
+                     'filename': f'/dev/{self.drive}n{namespace}',
+                     'numjobs': numjobs} for namespace in namespaces]
+
+            curve[count] = {}
+            for name, rw, bs, iodepth in self.PROFILES:
+                rc, results, err = fio.run_jobs(
+                    jobs, rw, bs, iodepth=iodepth, runtime=self.duration,
+                    ramp=self.ramp, ioengine=self.ioengine)
+                if rc != 0:
+                    self.logger.error(f"{name} failed across {count} "
+                                      f"namespaces: {err}")
+                    return
+                curve[count][name] = fio.summarize_clones(
+                    results['jobs'], 'read')
+                self.logger.info(
+                    f"  {count} namespaces, {name}: "
+                    f"{curve[count][name]['iops']:.0f} IOPS, "
+                    f"{curve[count][name]['bw']} KiB/s, p99 "
+                    f"{curve[count][name]['lat_p99']:.0f} us")
+
+        for name, rw, bs, iodepth in self.PROFILES:
+            key = 'iops' if rw == 'randread' else 'bw'
+            unit = 'IOPS' if key == 'iops' else 'KiB/s'
+            peak = max(curve[count][name][key] for count in curve)
+            self.logger.info(f"{name} aggregate {unit} by namespace count:")
+            best = 0
+            knee = None
+            for count in self.series:
+                value = curve[count][name][key]
+                bar = '#' * int(50 * value / peak) if peak else ''
+                self.logger.info(
+                    f"  {count:>4} | {bar:<50} {value:.0f} {unit}, p99 "
+                    f"{curve[count][name]['lat_p99']:.0f} us")
+                if knee is None and value < best * (1 - self.knee_tolerance):
+                    knee = count
+                best = max(best, value)
+            if knee is not None:
+                self.logger.info(f"  {name} drops from {knee} namespaces.")
+
+        self.logger.info("Namespace scaling curve measured.")
+        self.success = True
@@ -13,10 +13,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from nvme import fio
 from nvme import sedutil
+from nvme import stats
 from nvme import utils as n_utils
 from tests import run
 
+import errno
+import os
+import time
+
+# The errors fio reports for I/O to a locked range
+LOCKED_IO_ERRORS = [os.strerror(e) for e in
+                    (errno.EIO, errno.EACCES, errno.EPERM)]
+
 
 class OpalCapable(run.Run):
 
@@ -28,6 +38,9 @@ class OpalCapable(run.Run):
     def name(self):
         return "opal_capable"
 
+    def footprint(self):
+        return run.FOOTPRINT_ADMIN
+
     def description(self):
         return ("Verifies that the drive is capable of Opal")
 
@@ -60,26 +73,29 @@ class OpalBlockSIDTest(run.Run):
         # Start in a failed state, work to success
         self.success = False
 
+        # A single query covers all of the checks below
+        drive_state = sedutil.get_state(self.drive, refresh=True)
+
         # Just validate that it's OPAL enabled
-        if not sedutil.check_opal_capability(self.drive):
+        if not drive_state.locking_supported:
             self.logger.error(f"Drive {self.drive} is not capable of OPAL.")
             return
 
         # Check for the chubbyant fork of sedutil-cli, if not installed, fail
-        if not sedutil.check_chubbyant_fork(self.drive):
+        if not drive_state.block_sid_supported:
             self.logger.error(f"Installed version of sedutil-cli does not support"
                 f" BlockSID authentication function. Please install the chubbyant"
                 f" fork of sedutil-cli at https://github.com/ChubbyAnt/sedutil.")
             return
 
         # Check if the drive ownership is already set
-        if not sedutil.is_default_msid(self.drive):
+        if not drive_state.is_default_msid:
             self.logger.error(f"Drive {self.drive} has already been setup, the test"
                 f" does not apply.")
             return
 
         # Check if the drive has BlockSID set, if so, it needs a PSID revert
-        if sedutil.is_sid_blocked(self.drive):
+        if drive_state.sid_blocked:
             self.logger.error(f"Drive {self.drive} has BlockSID set and needs a "
                 f"PSID revert for ownership.")
             return
@@ -179,3 +195,325 @@ class OpalLockTest(run.Run):
 
         self.logger.info("Test passed!")
         self.success = True
+
+
+class OpalPerfOverhead(run.Run):
+
+    # The profiles measured in each Opal state
+    PROFILES = fio.PROFILES
+
+    # The short profile measured after each lock/unlock cycle
+    CYCLE_PROFILES = [fio.RAND_READ]
+
+    def __init__(self, config):
+        super(OpalPerfOverhead, self).__init__()
+
+        test_config = config['test_config'].get('opal_perf_overhead', {})
+        self.drive = config['drive']['name']
+        self.psid = config['drive']['psid']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.duration = test_config.get('runtime', 60)
+        self.ramp = test_config.get('ramptime', 10)
+        self.cycles = test_config.get('cycles', 20)
+        self.cycle_runtime = test_config.get('cycle_runtime', 5)
+        # Maximum allowed loss of IOPS, in percent.  None only reports.
+        self.max_overhead = test_config.get('max_overhead')
+        self.timings = {}
+
+    def name(self):
+        return "opal_perf_overhead"
+
+    def description(self):
+        return ("Measures I/O performance before Opal setup, with the locking "
+                "range enabled and unlocked, after each of many lock/unlock "
+                "cycles and after all of them.  Times each sedutil-cli "
+                "operation.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+        self.timings = {}
+
+        # Just validate that it's OPAL enabled
+        if not sedutil.check_opal_capability(self.drive):
+            self.logger.error(f"Drive {self.drive} is not capable of OPAL.")
+            return
+
+        # Start with a PSID reset, just in case it's in a weird state
+        self._timed('revert', sedutil.reset_via_psid, self.drive, self.psid)
+
+        # Format it.
+        tree = n_utils.generate_resource_tree()
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+
+        baseline = self._run_profiles("before Opal setup")
+        if baseline is None:
+            return
+        cycle_baseline = self._run_profiles(
+            "before Opal setup, short", self.CYCLE_PROFILES,
+            self.cycle_runtime, 0)
+        if cycle_baseline is None:
+            return
+
+        if not self._timed('initial_setup', sedutil.initial_setup,
+                           self.drive):
+            self.logger.error(
+                f"Drive {self.drive} is not able to set up OPAL.")
+            sedutil.reset_via_psid(self.drive, self.psid)
+            return
+
+        unlocked = self._run_profiles("locking range enabled, unlocked")
+        if unlocked is None:
+            sedutil.reset_via_psid(self.drive, self.psid)
+            return
+
+        self.logger.info(f"Running {self.cycles} lock/unlock cycles")
+        cycle_results = []
+        for i in range(0, self.cycles):
+            if not self._timed('lock', sedutil.lock_drive, self.drive):
+                self.logger.error(f"Lock failed on cycle {i}.")
+                sedutil.reset_via_psid(self.drive, self.psid)
+                return
+            if not self._timed('unlock', sedutil.unlock_drive, self.drive):
+                self.logger.error(f"Unlock failed on cycle {i}.")
+                sedutil.reset_via_psid(self.drive, self.psid)
+                return
+            # Measure between cycles, as the overhead may build up or come
+            # and go while cycling
+            results = self._run_profiles(
+                f"after lock/unlock cycle {i}", self.CYCLE_PROFILES,
+                self.cycle_runtime, 0)
+            if results is None:
+                sedutil.reset_via_psid(self.drive, self.psid)
+                return
+            cycle_results.append(results)
+
+        cycled = self._run_profiles(f"after {self.cycles} lock/unlock cycles")
+
+        # Now PSID revert again
+        self._timed('revert', sedutil.reset_via_psid, self.drive, self.psid)
+
+        for operation, durations in self.timings.items():
+            self.logger.info(
+                f"sedutil-cli {operation}: {len(durations)} calls, mean "
+                f"{stats.mean(durations) * 1000:.1f} ms, min "
+                f"{min(durations) * 1000:.1f} ms, max "
+                f"{max(durations) * 1000:.1f} ms")
+
+        if cycled is None:
+            return
+
+        compared = [("Unlocked", baseline, unlocked),
+                    ("Cycled", baseline, cycled)]
+        if cycle_results:
+            # The worst of the measurements between cycles
+            worst = {name: min([results[name] for results in cycle_results],
+                               key=lambda summary: summary['iops'])
+                     for name in cycle_baseline}
+            compared.append(("Worst cycle", cycle_baseline, worst))
+            for name in cycle_baseline:
+                iops = [results[name]['iops'] for results in cycle_results]
+                self.logger.info(
+                    f"Between cycles {name}: mean {stats.mean(iops):.0f} "
+                    f"IOPS, min {min(iops):.0f} IOPS, max {max(iops):.0f} "
+                    f"IOPS")
+
+        over_limit = False
+        for state, base_results, results in compared:
+            for name in base_results:
+                base = base_results[name]
+                overhead = (1 - results[name]['iops'] / base['iops']) * 100 \
+                    if base['iops'] else 0
+                self.logger.info(
+                    f"{state} {name}: {overhead:+.1f}% IOPS overhead, p99 "
+                    f"{base['lat_p99']:.1f} -> {results[name]['lat_p99']:.1f} "
+                    f"us")
+                if self.max_overhead is not None and \
+                        overhead > self.max_overhead:
+                    self.logger.error(
+                        f"{state} {name} overhead of {overhead:.1f}% is "
+                        f"above the limit of {self.max_overhead}%.")
+                    over_limit = True
+
+        if over_limit:
+            return
+
+        self.logger.info("Test passed!")
+        self.success = True
+
+    def _timed(self, operation, func, *args):
+        start = time.monotonic()
+        resp = func(*args)
+        self.timings.setdefault(operation, []).append(
+            time.monotonic() - start)
+        return resp
+
+    def _run_profiles(self, state, profiles=None, runtime=None, ramp=None):
+        # Runs the profiles, PROFILES for the full duration by default
+        return fio.run_profiles(
+            profiles or self.PROFILES, f'/dev/{self.drive}n1', self.logger,
+            state, runtime=self.duration if runtime is None else runtime,
+            ramp=self.ramp if ramp is None else ramp, ioengine=self.ioengine)
+
+
+class OpalMultiRangeTest(run.Run):
+
+    def __init__(self, config):
+        super(OpalMultiRangeTest, self).__init__()
+
+        test_config = config['test_config'].get('opal_multi_range', {})
+        self.drive = config['drive']['name']
+        self.psid = config['drive']['psid']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.ranges = test_config.get('ranges', 3)
+        self.duration = test_config.get('runtime', 30)
+        # Max allowed drop in bandwidth of the unlocked ranges, in percent
+        self.max_degradation = test_config.get('max_degradation', 20)
+
+    def name(self):
+        return "opal_multi_range"
+
+    def description(self):
+        return ("Sets up several Opal locking ranges, and locks each in turn "
+                "while I/O runs to the others.  I/O to the locked range must "
+                "fail, and the others must keep their performance.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        drive_state = sedutil.get_state(self.drive, refresh=True)
+        if not drive_state.locking_supported:
+            self.logger.error(f"Drive {self.drive} is not capable of OPAL.")
+            return
+
+        # The global range is one of the locking objects
+        if drive_state.single_user_locking_objects and \
+                self.ranges >= drive_state.single_user_locking_objects:
+            self.logger.error(
+                f"Drive {self.drive} supports "
+                f"{drive_state.single_user_locking_objects - 1} locking "
+                f"ranges.  {self.ranges} requested.")
+            return
+
+        # Start with a PSID reset, just in case it's in a weird state
+        sedutil.reset_via_psid(self.drive, self.psid)
+
+        # Format it.
+        tree = n_utils.generate_resource_tree()
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+
+        if not sedutil.initial_setup(self.drive):
+            self.logger.error(
+                f"Drive {self.drive} is not able to set up OPAL.")
+            sedutil.reset_via_psid(self.drive, self.psid)
+            return
+
+        if self._run_ranges():
+            self.logger.info("Test passed!")
+            self.success = True
+
+        # Now PSID revert
+        sedutil.reset_via_psid(self.drive, self.psid)
+
+    def _run_ranges(self):
+        # Split the namespace into equal extents, on the alignment granularity
+        # reported by the drive.
+        drive_state = sedutil.get_state(self.drive)
+        block_size = n_utils.get_namespace_block_size(self.drive, 1)
+        blocks = n_utils.get_namespace_data(self.drive, 1)['nsze']
+        granularity = max(1, drive_state.alignment_granularity)
+        extent = (blocks // self.ranges) // granularity * granularity
+
+        extents = {}
+        for locking_range in range(1, self.ranges + 1):
+            start = drive_state.lowest_aligned_lba + \
+                (locking_range - 1) * extent
+            if not sedutil.setup_locking_range(self.drive, locking_range,
+                                               start, extent) or \
+                    not sedutil.enable_locking_range(self.drive,
+                                                     locking_range):
+                return False
+            extents[locking_range] = {'name': f'range{locking_range}',
+                                      'filename': f'/dev/{self.drive}n1',
+                                      'offset': start * block_size,
+                                      'size': extent * block_size}
+            self.logger.info(f"Locking range {locking_range}: LBA {start} "
+                             f"for {extent} blocks")
+
+        # Lock each range in turn, while I/O runs to the others
+        passed = True
+        for locked_range in extents:
+            # Baseline with the same jobs, with every range unlocked, so the
+            # other ranges don't gain the locked range's share of bandwidth
+            jobs = [job for locking_range, job in extents.items()
+                    if locking_range != locked_range]
+            rc, results, err = fio.run_jobs(
+                jobs, 'randrw', '4k', iodepth=16, runtime=self.duration,
+                ioengine=self.ioengine)
+            if rc != 0:
+                self.logger.error(f"I/O failed with all ranges unlocked: "
+                                  f"{err}")
+                return False
+            baseline = self._range_bandwidth(results)
+            for name, bw in baseline.items():
+                self.logger.info(f"Unlocked baseline {name}: {bw} KiB/s")
+
+            if not sedutil.lock_drive(self.drive, locked_range):
+                return False
+
+            process = n_utils.run_background_cmd(fio.build_jobs_command(
+                jobs, 'randrw', '4k', iodepth=16, runtime=self.duration,
+                ioengine=self.ioengine))
+
+            locked = extents[locked_range]
+            rc, output, err = fio.run_job(
+                'lockedprobe', locked['filename'], 'randrw', '4k',
+                runtime=5, ioengine=self.ioengine, size=locked['size'],
+                extra_args=[f'--offset={locked["offset"]}'])
+            if rc == 0:
+                self.logger.error(f"I/O to locked range {locked_range} "
+                                  "passed.  It must be rejected.")
+                passed = False
+            elif not any(error in err for error in LOCKED_IO_ERRORS):
+                self.logger.error(f"I/O to locked range {locked_range} "
+                                  f"failed, but not with an I/O or "
+                                  f"permission error: {err}")
+                passed = False
+            else:
+                self.logger.info(f"I/O to locked range {locked_range} "
+                                 "rejected as expected.")
+
+            stdout, stderr = process.communicate()
+            if process.returncode != 0:
+                self.logger.error(f"I/O to unlocked ranges failed while range "
+                                  f"{locked_range} was locked: {stderr}")
+                passed = False
+            else:
+                for name, bw in self._range_bandwidth(
+                        fio.parse_output(stdout)).items():
+                    change = (1 - bw / baseline[name]) * 100 \
+                        if baseline[name] else 0
+                    self.logger.info(
+                        f"  {name}: {bw} KiB/s with range {locked_range} "
+                        f"locked ({change:+.1f}% degradation)")
+                    if change > self.max_degradation:
+                        self.logger.error(
+                            f"{name} lost {change:.1f}% of its bandwidth "
+                            f"while range {locked_range} was locked.")
+                        passed = False
+
+            if not sedutil.unlock_drive(self.drive, locked_range):
+                return False
+
+        return passed
+
+    def _range_bandwidth(self, results):
+        bandwidth = {}
+        for name, jobs in fio.results_by_job(results).items():
+            read = fio.summarize_clones(jobs, 'read')
+            write = fio.summarize_clones(jobs, 'write')
+            bandwidth[name] = read['bw'] + write['bw']
+        return bandwidth
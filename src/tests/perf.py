@@ -14,10 +14,15 @@
 #    under the License.
 
 
+from nvme import changepoint
+from nvme import fio
 from nvme import utils as n_utils
 from tests import run
 
 import json
+import os
+import tempfile
+import time
 
 
 class RandRead(run.Run):
@@ -36,6 +41,9 @@ class RandRead(run.Run):
     def name(self):
         return "perf_rand_read"
 
+    def footprint(self):
+        return run.FOOTPRINT_READ_ONLY
+
     def description(self):
         return ("Executes a random small block (4k) read test")
 
@@ -43,16 +51,20 @@ class RandRead(run.Run):
         # Start in a failed state, work to success
         self.success = False
 
-        self.logger.info(f"  Resetting drive {self.drive}")
-        tree = n_utils.generate_resource_tree()
-        n_utils.reset_drive(tree[self.drive])
+        # Use the namespace assigned when sharing the drive with other tests
+        device = self.namespace
+        if device is None:
+            self.logger.info(f"  Resetting drive {self.drive}")
+            tree = n_utils.generate_resource_tree()
+            n_utils.reset_drive(tree[self.drive])
 
-        # Create a single namespace
-        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+            # Create a single namespace
+            n_utils.factory_reset(tree[self.drive]['sn'].strip())
+            device = f'{self.drive}n1'
 
         cmd = (f'fio --name=4krandread --iodepth=4 --rw=randread --bs=4k --runtime={self.duration} '
                f'--ramp={self.ramp} --group_reporting --numjobs=32 --sync=1 --direct=1 --size=100% '
-               f'--ioengine={self.ioengine} --filename=/dev/{self.drive}n1 --output-format=json')
+               f'--ioengine={self.ioengine} --filename=/dev/{device} --output-format=json')
         self.logger.info(f"Command: {cmd}")
         rc, std_out, std_err = n_utils.run_cmd(cmd, shell=True)
 
@@ -63,10 +75,14 @@ class RandRead(run.Run):
             self.logger.info("I/O command completed.  Comparing data.")
 
         results = json.loads(std_out)
-        self.logger.info(f"Raw Test Results: {json.dumps(results, indent=2)}")
+        self.log_artifact('fio', results)
 
         test_iops = results['jobs'][0]['read']['iops']
-        if test_iops < self.min_iops:
+        # The threshold is for the whole drive, a shared drive only reports
+        if self.namespace is not None:
+            self.logger.info(f"Got {test_iops} sharing the drive, the "
+                             f"{self.min_iops} threshold is not checked.")
+        elif test_iops < self.min_iops:
             self.logger.error(
                 f"Drive must hit at least {self.min_iops}.  Drive only gets to {test_iops}.  DRIVE FAILED.")
             return
@@ -119,7 +135,7 @@ class RandWrite(run.Run):
             self.logger.info("I/O command completed.  Comparing data.")
 
         results = json.loads(std_out)
-        self.logger.info(f"Raw Test Results: {json.dumps(results, indent=2)}")
+        self.log_artifact('fio', results)
 
         test_iops = results['jobs'][0]['write']['iops']
         if test_iops < self.min_iops:
@@ -178,7 +194,7 @@ class SeqMixed(run.Run):
             self.logger.info("I/O command completed.  Comparing data.")
 
         results = json.loads(std_out)
-        self.logger.info(f"Raw Test Results: {json.dumps(results, indent=2)}")
+        self.log_artifact('fio', results)
 
         read_bw = results['jobs'][0]['read']['bw']
         write_bw = results['jobs'][0]['write']['bw']
@@ -221,6 +237,9 @@ class SeqRead(run.Run):
     def name(self):
         return "perf_seq_read"
 
+    def footprint(self):
+        return run.FOOTPRINT_READ_ONLY
+
     def description(self):
         return "Executes a sequential large block (256k) read only test"
 
@@ -228,16 +247,20 @@ class SeqRead(run.Run):
         # Start in a failed state, work to success
         self.success = False
 
-        self.logger.info(f"  Resetting drive {self.drive}")
-        tree = n_utils.generate_resource_tree()
-        n_utils.reset_drive(tree[self.drive])
+        # Use the namespace assigned when sharing the drive with other tests
+        device = self.namespace
+        if device is None:
+            self.logger.info(f"  Resetting drive {self.drive}")
+            tree = n_utils.generate_resource_tree()
+            n_utils.reset_drive(tree[self.drive])
 
-        # Create a single namespace
-        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+            # Create a single namespace
+            n_utils.factory_reset(tree[self.drive]['sn'].strip())
+            device = f'{self.drive}n1'
 
         cmd = (f'fio --name=seqread --iodepth=64 --rw=read --bs=128k --runtime={self.duration} '
                f'--ramp={self.ramp} --group_reporting --numjobs=32 --sync=1 --direct=1 --size=100% '
-               f'--ioengine={self.ioengine} --filename=/dev/{self.drive}n1 --output-format=json')
+               f'--ioengine={self.ioengine} --filename=/dev/{device} --output-format=json')
         self.logger.info(f"Command: {cmd}")
         rc, std_out, std_err = n_utils.run_cmd(cmd, shell=True)
 
@@ -248,10 +271,14 @@ class SeqRead(run.Run):
             self.logger.info("I/O command completed.  Comparing data.")
 
         results = json.loads(std_out)
-        self.logger.info(f"Raw Test Results: {json.dumps(results, indent=2)}")
+        self.log_artifact('fio', results)
 
         test_bw = results['jobs'][0]['read']['bw']
-        if test_bw < self.min_bw:
+        # The threshold is for the whole drive, a shared drive only reports
+        if self.namespace is not None:
+            self.logger.info(f"Got {test_bw} sharing the drive, the "
+                             f"{self.min_bw} threshold is not checked.")
+        elif test_bw < self.min_bw:
             self.logger.error(
                 f"Drive must hit at least {self.min_bw}.  Drive only gets to {test_bw}.  DRIVE FAILED.")
             return
@@ -304,7 +331,7 @@ class SeqWrite(run.Run):
             self.logger.info("I/O command completed.  Comparing data.")
 
         results = json.loads(std_out)
-        self.logger.info(f"Raw Test Results: {json.dumps(results, indent=2)}")
+        self.log_artifact('fio', results)
 
         test_bw = results['jobs'][0]['write']['bw']
         if test_bw < self.min_bw:
@@ -317,3 +344,531 @@ class SeqWrite(run.Run):
         # Consider a success
         self.logger.info("Drive passed bandwidth requirements.")
         self.success = True
+
+
+class LBAFormatMatrix(run.Run):
+
+    # The reduced profiles run for each LBA format
+    PROFILES = fio.PROFILES
+
+    def __init__(self, config):
+        super(LBAFormatMatrix, self).__init__()
+
+        test_config = config['test_config'].get('lba_format_matrix', {})
+        self.drive = config['drive']['name']
+        self.ramp = test_config.get('ramptime', 10)
+        self.duration = test_config.get('runtime', 60)
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.namespace_size = test_config.get('ns_size', 100) * 1024 ** 3
+
+    def name(self):
+        return "lba_format_matrix"
+
+    def description(self):
+        return ("Runs a reduced performance profile on a namespace in each "
+                "supported LBA format and protection information type, and "
+                "compares the results.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        # The supported formats and protection information types are the
+        # same for every namespace
+        namespace = n_utils.create_namespace(self.drive, self.namespace_size)
+        lba_formats = n_utils.get_lba_formats(self.drive, namespace)
+        pi_types = n_utils.get_pi_types(self.drive, namespace)
+        if not lba_formats:
+            self.logger.error("Unable to read the LBA formats of the drive.")
+            return
+        self.logger.info(f"Supported PI types: {pi_types or 'none'}")
+
+        # Each format without PI, and with each PI type when it has the 8
+        # bytes of metadata PI needs
+        combinations = [(lbaf, pi_type) for lbaf in lba_formats
+                        for pi_type in [0] + (
+                            pi_types if lbaf['metadata_size'] >= 8 else [])]
+
+        results = {}
+        rejected = []
+        unusable = []
+        failed = False
+        for lbaf, pi_type in combinations:
+            label = (f"LBAF {lbaf['index']} ({lbaf['data_size']}+"
+                     f"{lbaf['metadata_size']})")
+            if pi_type:
+                label += f" PI type {pi_type}"
+            self.logger.info(f"Testing {label}, relative performance "
+                             f"{lbaf['relative_performance']}")
+
+            tree = n_utils.generate_resource_tree()
+            n_utils.reset_drive(tree[self.drive])
+            namespace = n_utils.create_namespace(
+                self.drive, self.namespace_size,
+                block_size=lbaf['data_size'], flbas=lbaf['index'],
+                dps=pi_type, fail_on_err=False)
+
+            # The drive advertises the format and PI type, so it should
+            # accept them
+            if namespace is None:
+                self.logger.error(f"The drive rejected a namespace in "
+                                  f"{label}.")
+                rejected.append(label)
+                failed = True
+                continue
+
+            if pi_type and n_utils.get_pi_type(
+                    self.drive, namespace, fail_on_err=False) != pi_type:
+                self.logger.error(f"{label} was not applied to the "
+                                  "namespace.")
+                failed = True
+                continue
+
+            # Metadata formats may not be usable by the kernel block layer
+            block_device = f'{self.drive}n{namespace}'
+            if n_utils.get_block_device_size(block_device,
+                                             fail_on_err=False) == 0:
+                self.logger.info(f"{label} is not usable as a block device "
+                                 "on this host.  Skipping.")
+                unusable.append(label)
+                continue
+
+            # Transfers can't be smaller than the logical block
+            summaries = fio.run_profiles(
+                self.PROFILES, f'/dev/{block_device}', self.logger,
+                f"on {label}", min_bs=lbaf['data_size'],
+                runtime=self.duration, ramp=self.ramp, ioengine=self.ioengine)
+            if summaries is None:
+                failed = True
+                continue
+            results[label] = summaries
+
+        if rejected:
+            self.logger.info(f"Rejected by the drive: {', '.join(rejected)}")
+        if unusable:
+            self.logger.info(f"Not usable by the block layer: "
+                             f"{', '.join(unusable)}")
+        if not results:
+            self.logger.error("No LBA format could be tested.")
+            return
+
+        # Compare each format against the best for every workload
+        for name, *profile in self.PROFILES:
+            ranked = sorted([(r[name]['iops'], label)
+                             for label, r in results.items() if name in r],
+                            reverse=True)
+            if not ranked:
+                continue
+            best_iops, best_label = ranked[0]
+            self.logger.info(f"{name}: best format is {best_label}")
+            for iops, label in ranked:
+                summary = results[label][name]
+                change = (iops / best_iops - 1) * 100 if best_iops else 0
+                self.logger.info(
+                    f"  {label}: {change:+.1f}% IOPS, p99 "
+                    f"{summary['lat_p99']:.1f} us, p99.9 "
+                    f"{summary['lat_p999']:.1f} us")
+
+        if failed:
+            self.logger.error("At least one advertised LBA format was "
+                              "rejected, or failed I/O.")
+            return
+
+        self.logger.info("All usable LBA formats tested.")
+        self.success = True
+
+
+class WriteCache(run.Run):
+
+    FEATURE_VOLATILE_WRITE_CACHE = 0x06
+
+    # Write profiles run with the cache on and off: name, rw, bs, iodepth,
+    # numjobs, fio arguments
+    PROFILES = [('4krandwrite_qd1', 'randwrite', '4k', 1, 1),
+                ('4krandwrite', 'randwrite', '4k', 32, 4),
+                ('seqwrite', 'write', '128k', 32, 4),
+                ('4krandwrite_fsync', 'randwrite', '4k', 1, 1, ['--fsync=1'])]
+
+    def __init__(self, config):
+        super(WriteCache, self).__init__()
+
+        test_config = config['test_config'].get('write_cache', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.ramp = test_config.get('ramptime', 10)
+        self.duration = test_config.get('runtime', 60)
+
+    def name(self):
+        return "write_cache"
+
+    def description(self):
+        return ("Measures write performance and flush latency with the "
+                "volatile write cache enabled and disabled.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        # Create a single namespace
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+
+        vwc_present = bool(
+            int(n_utils.get_controller_data(self.drive).get('vwc', 0)) & 0x1)
+        if not vwc_present:
+            self.logger.info(f"Drive {self.drive} has no volatile write "
+                             "cache.  Measuring as is.")
+            if self._run_profiles("with no cache") is None:
+                return
+            self.logger.info("Write performance measured.")
+            self.success = True
+            return
+
+        original, data = n_utils.get_feature(
+            self.drive, self.FEATURE_VOLATILE_WRITE_CACHE)
+        results = {}
+        passed = True
+        try:
+            for label, enable in [('enabled', 1), ('disabled', 0)]:
+                if not self._set_cache(enable):
+                    passed = False
+                    continue
+                results[label] = self._run_profiles(f"with cache {label}")
+                if results[label] is None:
+                    return
+        finally:
+            # Leave the cache as it is if its setting couldn't be read
+            if original is None:
+                self.logger.warning("The original volatile write cache "
+                                    "setting is unknown, it is not "
+                                    "restored.")
+            else:
+                n_utils.set_feature(self.drive,
+                                    self.FEATURE_VOLATILE_WRITE_CACHE,
+                                    original, fail_on_err=False)
+            n_utils.namespace_rescan(self.drive, fail_on_err=False)
+
+        if 'enabled' in results and 'disabled' in results:
+            for name in results['enabled']:
+                on = results['enabled'][name]
+                off = results['disabled'][name]
+                change = (on['iops'] / off['iops'] - 1) * 100 \
+                    if off['iops'] else 0
+                self.logger.info(
+                    f"{name}: cache on {on['iops']:.0f} IOPS, cache off "
+                    f"{off['iops']:.0f} IOPS ({change:+.1f}%), p99 "
+                    f"{on['lat_p99']:.0f} us vs {off['lat_p99']:.0f} us")
+
+            # A flush with a dirty cache should cost something.  If it does
+            # not, the drive is likely not writing the cache out on a flush,
+            # or has power loss protection.
+            flush = results['enabled'].get('4krandwrite_fsync', {}).get(
+                'flush')
+            if flush is None:
+                self.logger.warning("fio reported no fsync latency, the "
+                                    "flush latency is unknown.")
+            elif flush['lat_p50'] < 1:
+                self.logger.warning(
+                    f"Flush completes in {flush['lat_p50']:.1f} us with the "
+                    "cache enabled.  Verify the drive has power loss "
+                    "protection.")
+
+        if passed:
+            self.logger.info("Write cache performance measured.")
+            self.success = True
+
+    def _set_cache(self, enable):
+        n_utils.set_feature(self.drive, self.FEATURE_VOLATILE_WRITE_CACHE,
+                            enable)
+        value, data = n_utils.get_feature(
+            self.drive, self.FEATURE_VOLATILE_WRITE_CACHE)
+        if value is None or value & 0x1 != enable:
+            self.logger.error(f"Volatile write cache did not change to "
+                              f"{enable}, it reports {value}.")
+            return False
+
+        # The kernel only sends flushes on fsync if it sees a write back
+        # cache.  It sets the mode from the VWC present bit of Identify
+        # Controller, not from this feature, so it stays 'write back' with
+        # the cache disabled and is only checked with the cache enabled.
+        n_utils.namespace_rescan(self.drive)
+        kernel_cache = n_utils.get_block_device_write_cache(f'{self.drive}n1')
+        if enable and kernel_cache != 'write back':
+            self.logger.error(f"Kernel reports '{kernel_cache}' with the "
+                              "volatile write cache enabled.  fsync is not "
+                              "honored.")
+            return False
+        return True
+
+    def _run_profiles(self, state):
+        return fio.run_profiles(self.PROFILES, f'/dev/{self.drive}n1',
+                                self.logger, state, runtime=self.duration,
+                                ramp=self.ramp, ioengine=self.ioengine,
+                                sync=False)
+
+
+class PartitionAlignment(run.Run):
+
+    # The profiles run on the raw namespace and each partition
+    PROFILES = [fio.RAND_READ, fio.RAND_WRITE, fio.SEQ_WRITE]
+
+    # Partition layouts: name, alignment and shift in bytes.  A shift of
+    # None is one logical block, only misaligned on 512 byte formats.
+    LAYOUTS = [('1MiB', 1024 * 1024, 0),
+               ('4KiB', 1024 * 1024, 4096),
+               ('misaligned', 1024 * 1024, None)]
+
+    def __init__(self, config):
+        super(PartitionAlignment, self).__init__()
+
+        test_config = config['test_config'].get('partition_alignment', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.partition_size = test_config.get('partition_size', 10)
+        self.duration = test_config.get('runtime', 60)
+        self.ramp = test_config.get('ramptime', 10)
+        # Maximum allowed loss of IOPS against the raw namespace, in percent,
+        # for the aligned partitions and the misaligned one.  None only
+        # reports.
+        self.max_degradation = test_config.get('max_degradation', 10)
+        self.max_misaligned_degradation = test_config.get(
+            'max_misaligned_degradation')
+
+    def name(self):
+        return "partition_alignment"
+
+    def footprint(self):
+        return run.FOOTPRINT_NAMESPACE
+
+    def description(self):
+        return ("Runs the same I/O on the raw namespace and on partitions "
+                "aligned to 1 MiB, to 4 KiB and misaligned, and compares the "
+                "performance.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        # Use the namespace assigned when sharing the drive with other tests
+        device = self.namespace
+        if device is None:
+            self.logger.info(f"  Resetting drive {self.drive}")
+            tree = n_utils.generate_resource_tree()
+            n_utils.reset_drive(tree[self.drive])
+
+            # Create a single namespace
+            n_utils.factory_reset(tree[self.drive]['sn'].strip())
+            device = f'{self.drive}n1'
+        nsid = int(device[len(self.drive) + 1:])
+        block_size = n_utils.get_namespace_block_size(self.drive, nsid)
+
+        # The raw run covers the same span as a partition.  The span is
+        # written first, so the reads aren't of unmapped blocks.
+        span = str(self.partition_size * 1000 ** 3)
+        rc, err = fio.precondition(f'/dev/{device}', size=span,
+                                   ioengine=self.ioengine)
+        if rc != 0:
+            self.logger.error(f"Failed to fill the raw namespace: {err}")
+            return
+        raw = self._run_profiles("raw namespace", f'/dev/{device}',
+                                 size=span)
+        if raw is None:
+            return
+
+        over_limit = False
+        for layout, alignment, shift in self.LAYOUTS:
+            if shift is None:
+                shift = block_size
+            if shift % 4096 == 0 and layout == 'misaligned':
+                self.logger.info(f"Skipping the misaligned layout, the "
+                                 f"{block_size} byte block format is always "
+                                 "4 KiB aligned.")
+                continue
+
+            partitions = n_utils.bulk_create_partition(
+                self.drive, nsid, self.partition_size, 1,
+                alignment=alignment, shift=shift)
+            partition = f'/dev/{device}p1'
+            if not self._wait_for(partition):
+                self.logger.error(f"{partition} did not appear after "
+                                  "writing the partition table.")
+                return
+            self.logger.info(f"Partition starts at byte "
+                             f"{partitions[0].first_lba * block_size}")
+
+            results = self._run_profiles(f"{layout} partition", partition)
+            if results is None:
+                return
+
+            limit = self.max_misaligned_degradation \
+                if layout == 'misaligned' else self.max_degradation
+            for name in raw:
+                base = raw[name]['iops']
+                degradation = (1 - results[name]['iops'] / base) * 100 \
+                    if base else 0
+                self.logger.info(
+                    f"{layout} {name}: {degradation:+.1f}% IOPS against raw, "
+                    f"p99 {raw[name]['lat_p99']:.1f} -> "
+                    f"{results[name]['lat_p99']:.1f} us")
+                if limit is not None and degradation > limit:
+                    self.logger.error(
+                        f"{layout} {name} degradation of {degradation:.1f}% "
+                        f"is above the limit of {limit}%.  DRIVE FAILED.")
+                    over_limit = True
+
+        if over_limit:
+            return
+
+        self.logger.info("Test passed!")
+        self.success = True
+
+    def _wait_for(self, path, timeout=30):
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            if os.path.exists(path):
+                return True
+            time.sleep(0.1)
+        return False
+
+    def _run_profiles(self, target, filename, size='100%'):
+        return fio.run_profiles(self.PROFILES, filename, self.logger,
+                                f"on the {target}", runtime=self.duration,
+                                ramp=self.ramp, size=size,
+                                ioengine=self.ioengine)
+
+
+class WriteCliff(run.Run):
+
+    def __init__(self, config):
+        super(WriteCliff, self).__init__()
+
+        test_config = config['test_config'].get('write_cliff', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        # Full capacity passes of random writes
+        self.passes = test_config.get('passes', 3)
+        self.iodepth = test_config.get('iodepth', 32)
+        self.numjobs = test_config.get('numjobs', 4)
+        # Shortest plateau, in seconds, the change point detection considers
+        self.min_segment = test_config.get('min_segment', 30)
+        # A steady state this far below the FOB plateau is a write cliff
+        self.cliff_drop = test_config.get('cliff_drop', 0.2)
+        # Seconds with latency this many times the median of their plateau
+        self.spike_factor = test_config.get('spike_factor', 10)
+        # Fail if the steady state is below this fraction of the FOB plateau.
+        # None only reports.
+        self.min_steady_fraction = test_config.get('min_steady_fraction')
+
+    def name(self):
+        return "write_cliff"
+
+    def description(self):
+        return ("Writes 4k random data over several full capacity passes, and "
+                "finds the fresh out of box plateau, the write cliff, the "
+                "steady state and the garbage collection latency spikes.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        # Create a single namespace, and erase it to fresh out of box
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+        n_utils.format_namespace(self.drive, 1, ses=1)
+        capacity = n_utils.get_block_device_size(f'{self.drive}n1')
+
+        io_size = capacity * self.passes // self.numjobs
+        with tempfile.TemporaryDirectory(prefix='writecliff') as log_dir:
+            prefix = os.path.join(log_dir, 'cliff')
+            command = fio.build_command(
+                'writecliff', f'/dev/{self.drive}n1', 'randwrite', '4k',
+                iodepth=self.iodepth, numjobs=self.numjobs,
+                ioengine=self.ioengine, sync=False, group_reporting=False,
+                extra_args=[f'--io_size={io_size}',
+                            f'--write_iops_log={prefix}',
+                            f'--write_lat_log={prefix}',
+                            '--log_avg_msec=1000'])
+            self.logger.info(f"Command: {' '.join(command)}")
+            rc, std_out, std_err = n_utils.run_cmd(command, fail_on_err=False)
+            if rc != 0:
+                self.logger.error(
+                    f"Failed to run test.  Error was:\n {std_err}")
+                return
+            iops = fio.read_log_series(prefix, 'iops')
+            latency = fio.read_log_series(prefix, 'clat', use_max=True)
+
+        if len(iops) < 2 * self.min_segment:
+            self.logger.error("The workload did not run long enough to "
+                              "measure.")
+            return
+
+        # Fraction of the capacity written by the end of each second
+        written = [0.0]
+        for value in iops:
+            written.append(written[-1] + value * 4096 / capacity)
+        written = written[1:]
+
+        changes = changepoint.detect(iops, min_size=self.min_segment)
+        plateaus = changepoint.segments(iops, changes)
+        for start, end, mean in plateaus:
+            self.logger.info(f"  {start:>6}-{end:<6} s ({written[start]:.2f}-"
+                             f"{written[end - 1]:.2f} capacity): "
+                             f"{mean:.0f} IOPS")
+
+        # The FOB plateau is the highest one before the largest drop, which
+        # is the write cliff.  A short dip or a ramp up early in the run
+        # doesn't count as either.
+        drop = changepoint.largest_drop(plateaus)
+        if drop is None:
+            fob = max(mean for start, end, mean in plateaus)
+        else:
+            fob = plateaus[drop[1]][2]
+        steady = plateaus[-1][2]
+        self.logger.info(f"FOB plateau: {fob:.0f} IOPS, steady state: "
+                         f"{steady:.0f} IOPS ({steady / fob:.0%} of FOB)")
+        if drop is not None and steady < fob * (1 - self.cliff_drop):
+            onset = plateaus[drop[0]][0]
+            self.logger.info(f"Write cliff starts at {onset} seconds, after "
+                             f"writing {written[onset]:.2f} times the "
+                             "capacity")
+        else:
+            self.logger.info("No write cliff found.")
+
+        # Latency is the mean completion latency of each second, in ns
+        if latency:
+            lat_changes = changepoint.detect(latency,
+                                             min_size=self.min_segment)
+            spikes = changepoint.spikes(latency, self.spike_factor,
+                                        lat_changes)
+            self.logger.info(f"{len(spikes)} seconds with latency over "
+                             f"{self.spike_factor}x their plateau median")
+            for second in sorted(spikes, key=lambda s: latency[s],
+                                 reverse=True)[:10]:
+                second_iops = iops[min(second, len(iops) - 1)]
+                self.logger.info(f"  {second} s: {latency[second] / 1000:.0f} "
+                                 f"us mean latency, {second_iops:.0f} IOPS")
+
+        if self.min_steady_fraction is not None and \
+                steady < fob * self.min_steady_fraction:
+            self.logger.error(
+                f"Steady state is {steady / fob:.0%} of the FOB plateau, "
+                f"below the limit of {self.min_steady_fraction:.0%}.  DRIVE "
+                "FAILED.")
+            return
+
+        self.logger.info("Test passed!")
+        self.success = True
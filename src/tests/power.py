@@ -0,0 +1,196 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import fio
+from nvme import probe
+from nvme import stats
+from nvme import utils as n_utils
+from tests import run
+
+import os
+import random
+import time
+
+FEATURE_POWER_MANAGEMENT = 0x02
+FEATURE_APST = 0x0c
+
+# The APST table is 32 entries of 8 bytes
+APST_DATA_LEN = 256
+
+
+class PowerStateLatency(run.Run):
+
+    def __init__(self, config):
+        super(PowerStateLatency, self).__init__()
+
+        test_config = config['test_config'].get('power_states', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.samples = test_config.get('samples', 20)
+        self.duration = test_config.get('runtime', 60)
+        # Bursty-idle profile: I/Os per burst and idle time between (us)
+        self.burst = test_config.get('burst', 32)
+        self.idle_us = test_config.get('idle_us', 100000)
+        # Fail if a measured latency is above this multiple of the advertised
+        # latency.  None only reports.
+        self.max_ratio = test_config.get('max_ratio')
+
+    def name(self):
+        return "power_states"
+
+    def description(self):
+        return ("Measures the exit latency of each non-operational power "
+                "state against the advertised value, the set-feature time to "
+                "request each state, and the tail latency cost of APST on a "
+                "bursty-idle workload.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        # Create a single namespace
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+
+        ctrl_data = n_utils.get_controller_data(self.drive)
+        apst_supported = bool(int(ctrl_data.get('apsta', 0)) & 0x1)
+        power_states = ctrl_data.get('psds', [])
+        for ps, psd in enumerate(power_states):
+            kind = 'non-operational' if int(psd.get('flags', 0)) & 0x2 \
+                else 'operational'
+            self.logger.info(
+                f"Power state {ps}: max power {psd.get('max_power')}, "
+                f"ENLAT {psd.get('entry_lat')} us, EXLAT "
+                f"{psd.get('exit_lat')} us, {kind}")
+
+        # Stop APST from moving the drive between states while measuring
+        if apst_supported:
+            apst_value, apst_table = n_utils.get_feature(
+                self.drive, FEATURE_APST, data_len=APST_DATA_LEN)
+            n_utils.set_feature(self.drive, FEATURE_APST, 0, apst_table)
+        original_ps, data = n_utils.get_feature(self.drive,
+                                                FEATURE_POWER_MANAGEMENT)
+
+        try:
+            passed = self._measure_states(power_states)
+            if apst_supported:
+                passed = self._compare_apst(apst_table) and passed
+        finally:
+            n_utils.set_feature(self.drive, FEATURE_POWER_MANAGEMENT,
+                                original_ps or 0, fail_on_err=False)
+            if apst_supported:
+                n_utils.set_feature(self.drive, FEATURE_APST, apst_value,
+                                    apst_table, fail_on_err=False)
+
+        if passed:
+            self.logger.info("Power state latencies measured.")
+            self.success = True
+
+    def _measure_states(self, power_states):
+        fd = probe.open_direct(f'/dev/{self.drive}n1')
+        buf = probe.aligned_buffer()
+        blocks = n_utils.get_block_device_size(f'{self.drive}n1') // \
+            probe.BLOCK_SIZE
+        passed = True
+        try:
+            # Read latency and set-feature time while operational, so the
+            # host overhead can be taken out of the measurements.
+            idle_reads = []
+            idle_sets = []
+            for i in range(0, self.samples):
+                idle_sets.append(self._set_power_state(0))
+                time.sleep(0.01)
+                idle_reads.append(probe.timed_read(
+                    fd, buf, random.randrange(blocks) * probe.BLOCK_SIZE))
+            idle_read = stats.percentile(idle_reads, 50)
+            idle_set = stats.percentile(idle_sets, 50)
+            self.logger.info(f"Operational read latency {idle_read * 1e6:.0f} "
+                             f"us, set-feature time {idle_set * 1e6:.0f} us")
+
+            for ps, psd in enumerate(power_states):
+                if not int(psd.get('flags', 0)) & 0x2:
+                    continue
+                enlat = int(psd.get('entry_lat', 0))
+                exlat = int(psd.get('exit_lat', 0))
+
+                # The set-feature completes when the state is requested, the
+                # host can't see when the drive has entered it.  Wait twice
+                # the advertised entry latency for it to get there.
+                dwell = max(2 * enlat / 1e6, 0.05)
+                requests = []
+                exits = []
+                for i in range(0, self.samples):
+                    requests.append(self._set_power_state(ps) - idle_set)
+                    time.sleep(dwell)
+                    exits.append(probe.timed_read(
+                        fd, buf,
+                        random.randrange(blocks) * probe.BLOCK_SIZE) -
+                        idle_read)
+
+                request = max(0, stats.percentile(requests, 50)) * 1e6
+                exit_time = max(0, stats.percentile(exits, 50)) * 1e6
+                worst_exit = max(0, max(exits)) * 1e6
+                self.logger.info(
+                    f"Power state {ps}: set-feature round trip {request:.0f} "
+                    f"us over operational (ENLAT {enlat} us, not measured), "
+                    f"exit {exit_time:.0f} us, worst {worst_exit:.0f} us "
+                    f"(EXLAT {exlat} us)")
+                if self.max_ratio is not None and \
+                        exit_time > exlat * self.max_ratio:
+                    self.logger.error(
+                        f"Power state {ps} exit latency of {exit_time:.0f} us "
+                        f"is above {self.max_ratio} times the advertised "
+                        f"{exlat} us.")
+                    passed = False
+        finally:
+            os.close(fd)
+            buf.close()
+        return passed
+
+    def _set_power_state(self, ps):
+        # Returns how long the set-feature took, in seconds
+        start = time.monotonic()
+        n_utils.set_feature(self.drive, FEATURE_POWER_MANAGEMENT, ps)
+        return time.monotonic() - start
+
+    def _compare_apst(self, apst_table):
+        results = {}
+        for label, apst_enable in [('APST off', 0), ('APST on', 1)]:
+            n_utils.set_feature(self.drive, FEATURE_APST, apst_enable,
+                                apst_table)
+            rc, output, err = fio.run_job(
+                'burstyidle', f'/dev/{self.drive}n1', 'randread', '4k',
+                runtime=self.duration, ioengine=self.ioengine,
+                extra_args=[f'--thinktime={self.idle_us}',
+                            f'--thinktime_blocks={self.burst}'])
+            if rc != 0:
+                self.logger.error(f"Bursty-idle workload failed with "
+                                  f"{label}: {err}")
+                return False
+            results[label] = fio.summarize(output['jobs'][0], 'read')
+            self.logger.info(
+                f"{label}: p50 {results[label]['lat_p50']:.0f} us, p99 "
+                f"{results[label]['lat_p99']:.0f} us, p99.9 "
+                f"{results[label]['lat_p999']:.0f} us, max "
+                f"{results[label]['lat_max']:.0f} us")
+
+        added = results['APST on']['lat_p999'] - \
+            results['APST off']['lat_p999']
+        self.logger.info(f"APST adds {added:.0f} us to the p99.9 read latency")
+        return True
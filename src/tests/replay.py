@@ -0,0 +1,147 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import fio
+from nvme import iolog
+from nvme import utils as n_utils
+from tests import run
+
+import os
+import tempfile
+
+MIB = 1024 * 1024
+
+
+class TraceReplay(run.Run):
+
+    def __init__(self, config):
+        super(TraceReplay, self).__init__()
+
+        test_config = config['test_config'].get('trace_replay', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.trace = test_config.get('trace')
+        # blkparse or iolog, detected when not set
+        self.trace_format = test_config.get('format')
+        # blkparse action replayed, Q (queued) or D (issued to the driver)
+        self.action = test_config.get('action', 'Q')
+        self.ops = test_config.get('ops')
+        # Window of the trace to replay, in seconds from its first event
+        self.start = test_config.get('start')
+        self.end = test_config.get('end')
+        # 2 replays twice as fast as the trace
+        self.time_scale = test_config.get('time_scale', 1.0)
+        self.as_fast_as_possible = test_config.get(
+            'as_fast_as_possible', False)
+        self.iodepth = test_config.get('iodepth', 32)
+        # Fail if the p99 latency of any op is above this, in us.  None only
+        # reports.
+        self.max_p99 = test_config.get('max_p99')
+        # Random writes after filling the trace's LBA range, so the replay
+        # doesn't run on a fresh namespace.  0 only fills.
+        self.precondition_runtime = test_config.get('precondition_runtime',
+                                                    600)
+
+    def name(self):
+        return "trace_replay"
+
+    def description(self):
+        return ("Replays an I/O trace against the namespace, and reports the "
+                "latency of each operation and the speed of the replay.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        if self.trace is None or not os.path.exists(self.trace):
+            self.logger.error(f"Trace file {self.trace} not found.")
+            return
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        # Create a single namespace
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+        device = f'{self.drive}n1'
+        capacity = n_utils.get_block_device_size(device)
+        block_size = n_utils.get_namespace_block_size(self.drive, 1)
+
+        with tempfile.TemporaryDirectory(prefix='replay') as work_dir:
+            iolog_path = os.path.join(work_dir, 'replay.iolog')
+            converted = iolog.convert(
+                self.trace, iolog_path, f'/dev/{device}',
+                trace_format=self.trace_format, action=self.action,
+                ops=self.ops, start=self.start, end=self.end,
+                scale=self.time_scale, capacity=capacity, align=block_size)
+            trace_seconds = converted['duration'] * self.time_scale / 1e9
+            self.logger.info(
+                f"Replaying {converted['events']} I/Os, "
+                f"{converted['bytes']} bytes, over {trace_seconds:.1f} "
+                "seconds of trace")
+            if converted['events'] == 0:
+                self.logger.error("No I/O left in the trace to replay.")
+                return
+
+            # The span rounded up to whole MiB, so it fits the fill's blocks
+            span = min(-(-converted['span'] // MIB) * MIB, capacity)
+            self.logger.info(f"Preconditioning the first {span} bytes of "
+                             f"{device}")
+            rc, err = fio.precondition(
+                f'/dev/{device}', size=str(span),
+                runtime=self.precondition_runtime, ioengine=self.ioengine)
+            if rc != 0:
+                self.logger.error(f"Failed to precondition {device}: {err}")
+                return
+
+            rc, results, err = fio.run_replay(
+                'replay', iolog_path, iodepth=self.iodepth,
+                ioengine=self.ioengine,
+                as_fast_as_possible=self.as_fast_as_possible)
+        if rc != 0:
+            self.logger.error(
+                f"Failed to replay the trace.  Error was:\n {err}")
+            return
+
+        job = results['jobs'][0]
+        runtime = job.get('job_runtime', 0) / 1000.0
+        if runtime:
+            self.logger.info(f"Replay took {runtime:.1f} seconds, "
+                             f"{trace_seconds / runtime:.2f}x the speed of "
+                             "the trace")
+
+        over_limit = False
+        for ddir in ['read', 'write', 'trim']:
+            if job.get(ddir, {}).get('total_ios', 0) == 0:
+                continue
+            summary = fio.summarize(job, ddir)
+            self.logger.info(
+                f"  {ddir}: {job[ddir]['total_ios']} I/Os, "
+                f"{summary['iops']:.0f} IOPS, {summary['bw']} KiB/s, latency "
+                f"mean {summary['lat_mean']:.0f} us, p50 "
+                f"{summary['lat_p50']:.0f} us, p99 {summary['lat_p99']:.0f} "
+                f"us, p99.9 {summary['lat_p999']:.0f} us, max "
+                f"{summary['lat_max']:.0f} us")
+            if self.max_p99 is not None and summary['lat_p99'] > self.max_p99:
+                self.logger.error(f"{ddir} p99 latency is above the limit of "
+                                  f"{self.max_p99} us.  DRIVE FAILED.")
+                over_limit = True
+
+        if over_limit:
+            return
+
+        self.logger.info("Test passed!")
+        self.success = True
@@ -13,9 +13,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from io import StringIO
+from tests import capture
+
 import logging
 
+# The resources a test needs, which decides what it can run alongside:
+#  - drive: the whole drive, it reformats or changes the drive state
+#  - namespace: a namespace of its own, it writes to the namespace
+#  - read_only: any namespace, it only reads
+#  - admin: no namespace, it only issues admin commands
+FOOTPRINT_DRIVE = 'drive'
+FOOTPRINT_NAMESPACE = 'namespace'
+FOOTPRINT_READ_ONLY = 'read_only'
+FOOTPRINT_ADMIN = 'admin'
+
 
 class Run:
 
@@ -26,15 +37,26 @@ class Run:
         #  - True: Successfully passed
         self.success = None
 
-        # setup common logging handler
-        self._stream = StringIO()
+        # Endurance projection of the writes done by the test, if any
+        self.endurance = None
+
+        # Namespace device (ex. nvme0n2) assigned when the test shares the
+        # drive with other tests.  None when the test has the whole drive.
+        self.namespace = None
+
+        # Set by the watchdog when the test stopped making progress.  A hung
+        # test has failed, whatever it reports.
+        self.hung = False
+
+        # setup common logging handler, the log is spilled to disk with only
+        # the newest lines kept in memory
         formatter = logging.Formatter(
             '%(asctime)s - %(levelname)s - %(message)s')
-        handler = logging.StreamHandler(self._stream)
-        handler.setFormatter(formatter)
+        self._capture = capture.LogCapture(self.name())
+        self._capture.setFormatter(formatter)
 
         self.logger = logging.getLogger(f"{__name__}.{self.name()}")
-        self.logger.addHandler(handler)
+        self.logger.addHandler(self._capture)
         self.logger.setLevel(logging.INFO)
 
     def name(self) -> str:
@@ -45,14 +67,43 @@ class Run:
         """Returns the description of the test"""
         pass
 
+    def footprint(self) -> str:
+        """Returns the resources the test needs, one of the FOOTPRINT values.
+        Tests take the whole drive unless they say otherwise."""
+        return FOOTPRINT_DRIVE
+
     def execute(self) -> None:
         """Executes the test"""
         pass
 
     def result(self) -> bool:
         """Returns if the test was a success or not."""
+        if self.hung:
+            return False
         return self.success
 
     def report(self) -> str:
-        """Returns a string containing the detailed data for the run."""
-        return self._stream.getvalue()
+        """Returns a string containing the newest lines of the run's log."""
+        return self._capture.tail()
+
+    def write_log(self, output) -> None:
+        """Writes the full log of the run, with its artifacts, to output."""
+        self._capture.write_to(output)
+
+    def log_artifact(self, name, payload) -> None:
+        """Saves a large payload (ex. fio results) as an artifact of the run,
+        referenced from the log."""
+        path = self._capture.add_artifact(name, payload)
+        self.logger.info(f"Artifact {name}: {path}")
+
+    def reset_log(self) -> None:
+        """Drops the captured log, so repeated runs don't grow it."""
+        self._capture.reset()
+
+    def reset(self) -> None:
+        """Clears the state of the last run, so the test can run again."""
+        self.success = None
+        self.endurance = None
+        self.namespace = None
+        self.hung = False
+        self.reset_log()
@@ -0,0 +1,94 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import utils as n_utils
+from tests import run
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Namespaces are sized in whole MiB
+NS_ALIGNMENT = 1024 * 1024
+
+
+def plan(tests, max_parallel):
+    """Groups the tests into batches that can run at the same time.
+
+    Tests needing the whole drive run alone.  Other tests are batched in
+    order, up to max_parallel at a time, each namespace test with its own
+    namespace.
+    """
+    batches = []
+    batch = []
+    for test in tests:
+        if test.footprint() == run.FOOTPRINT_DRIVE:
+            if batch:
+                batches.append(batch)
+                batch = []
+            batches.append([test])
+            continue
+
+        if len(batch) >= max_parallel:
+            batches.append(batch)
+            batch = []
+        batch.append(test)
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def provision(drive, batch):
+    # Lays out one namespace per namespace test, splitting the capacity
+    # evenly.  Read only tests share the first namespace.
+    writers = [t for t in batch if t.footprint() == run.FOOTPRINT_NAMESPACE]
+    readers = [t for t in batch if t.footprint() == run.FOOTPRINT_READ_ONLY]
+    if not writers and not readers:
+        return
+
+    tree = n_utils.generate_resource_tree()
+    n_utils.reset_drive(tree[drive])
+
+    count = max(len(writers), 1)
+    size = n_utils.get_unused_disk_size(drive) // count
+    size = size // NS_ALIGNMENT * NS_ALIGNMENT
+    namespaces = n_utils.bulk_create_namespace(drive, size, 4096, count)
+    logger.info(f"  Created {count} namespaces of {size} bytes on {drive}")
+
+    for test, namespace in zip(writers, namespaces):
+        test.namespace = f'{drive}n{namespace}'
+    for test in readers:
+        test.namespace = f'{drive}n{namespaces[0]}'
+
+
+def run_batch(batch, run_test):
+    # Runs each test of the batch in its own thread, and waits for all of
+    # them.  run_test is called with the test, and returns False if the test
+    # raised an error.
+    results = {}
+
+    def target(test):
+        results[test.name()] = run_test(test)
+
+    threads = [threading.Thread(target=target, args=(test,),
+                                name=test.name())
+               for test in batch]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return all(results.values())
@@ -0,0 +1,294 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import fio
+from nvme import hdr
+from nvme import utils as n_utils
+
+from collections import deque
+import json
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKLOADS = [
+    {'name': '4krandread', 'weight': 4, 'rw': 'randread', 'bs': '4k',
+     'iodepth': 32, 'numjobs': 4, 'runtime': 60},
+    {'name': '4krandwrite', 'weight': 2, 'rw': 'randwrite', 'bs': '4k',
+     'iodepth': 32, 'numjobs': 4, 'runtime': 60},
+    {'name': 'seqwrite', 'weight': 1, 'rw': 'write', 'bs': '128k',
+     'iodepth': 64, 'numjobs': 2, 'runtime': 60}]
+
+DEFAULT_ADMIN = [{'name': 'smart-log', 'weight': 2},
+                 {'name': 'id-ctrl', 'weight': 1},
+                 {'name': 'error-log', 'weight': 1}]
+
+
+class Window:
+    """Aggregates of everything run in one window of time.
+
+    Throughput is kept as sums and latency in fixed size histograms, so a
+    window takes the same memory however long it is.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        # Per workload or admin op: runs, failures, summed IOPS and the
+        # latency histogram (us)
+        self.ops = {}
+
+    def _op(self, name):
+        if name not in self.ops:
+            self.ops[name] = {'runs': 0, 'failures': 0, 'iops': 0.0,
+                              'latency': hdr.Histogram()}
+        return self.ops[name]
+
+    def record(self, name, success, iops=0.0, latencies=()):
+        # latencies are (us, count) pairs
+        op = self._op(name)
+        op['runs'] += 1
+        if not success:
+            op['failures'] += 1
+        op['iops'] += iops
+        for latency, count in latencies:
+            op['latency'].record(latency, count)
+
+    @staticmethod
+    def mean_iops(op):
+        # Over the successful runs, failed runs have no IOPS
+        runs = op['runs'] - op['failures']
+        return op['iops'] / runs if runs else 0.0
+
+    def merge(self, other):
+        for name, other_op in other.ops.items():
+            op = self._op(name)
+            op['runs'] += other_op['runs']
+            op['failures'] += other_op['failures']
+            op['iops'] += other_op['iops']
+            op['latency'].merge(other_op['latency'])
+
+    def lines(self):
+        lines = []
+        for name, op in sorted(self.ops.items()):
+            line = f"{name}: {op['runs']} runs, {op['failures']} failed"
+            if op['iops']:
+                line += f", {self.mean_iops(op):.0f} IOPS"
+            if op['latency'].count:
+                line += (f", latency p50 {op['latency'].percentile(50):.0f} "
+                         f"us, p99 {op['latency'].percentile(99):.0f} us, "
+                         f"max {op['latency'].max} us")
+            lines.append(line)
+        return lines
+
+
+def fio_latencies(job, ddir):
+    # The completion latency bins of a job run with --output-format=json+,
+    # as (us, count) pairs
+    bins = job.get(ddir, {}).get('clat_ns', {}).get('bins', {})
+    return [(int(ns) // 1000, count) for ns, count in bins.items()]
+
+
+class Soak:
+    """Runs the suite, or a weighted random mix of workloads and admin
+    commands, for hours or days.
+
+    Only the last windows of aggregates are kept, the fio output is rotated
+    through files on disk, and each window is compared with the first hours
+    to alert on drift.
+    """
+
+    def __init__(self, config, output_dir):
+        soak_config = config.get('soak', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.mode = soak_config.get('mode', 'mix')
+        self.duration = soak_config.get('hours', 72) * 3600
+        self.window_length = soak_config.get('window_minutes', 60) * 60
+        self.baseline_length = soak_config.get('baseline_hours', 2) * 3600
+        # Random writes after the fill, until the drive reaches a steady
+        # state, so the baseline isn't taken on a fresh drive
+        self.precondition_length = soak_config.get(
+            'precondition_minutes', 60) * 60
+        # Alert when IOPS drop or p99 latency grows by more than this fraction
+        # of the baseline
+        self.drift = soak_config.get('drift', 0.2)
+        self.workloads = soak_config.get('workloads', DEFAULT_WORKLOADS)
+        self.admin = soak_config.get('admin', DEFAULT_ADMIN)
+        self.random = random.Random(soak_config.get('seed'))
+
+        self.output_dir = os.path.join(output_dir, 'soak')
+        self.keep_files = soak_config.get('keep_files', 100)
+        self._files = deque()
+        self._file_count = 0
+
+        # The tests of the last suite pass, whose logs are kept for the
+        # report
+        self._tests = []
+
+        self.windows = deque(maxlen=soak_config.get('windows', 48))
+        self.baseline = None
+        self.alerts = deque(maxlen=100)
+        self.alert_count = 0
+        self.iterations = 0
+
+    def run(self, run_suite=None):
+        # run_suite runs the test suite once and returns the tests
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        if self.mode == 'mix':
+            tree = n_utils.generate_resource_tree()
+            n_utils.reset_drive(tree[self.drive])
+            n_utils.factory_reset(tree[self.drive]['sn'].strip())
+            logger.info(f"Preconditioning {self.drive}n1 for the soak")
+            rc, err = fio.precondition(f'/dev/{self.drive}n1',
+                                       runtime=self.precondition_length,
+                                       ioengine=self.ioengine)
+            if rc != 0:
+                logger.error(f"Soak preconditioning failed: {err}")
+                self._alert("preconditioning failed, the baseline may be "
+                            "taken before the drive is in steady state")
+
+        # The soak, and its baseline, start once the drive is preconditioned
+        start = time.monotonic()
+        window = Window(start)
+        baseline = Window(start)
+
+        while time.monotonic() - start < self.duration:
+            if self.mode == 'suite':
+                self._run_suite(window, run_suite)
+            else:
+                self._run_mix(window)
+            self.iterations += 1
+
+            now = time.monotonic()
+            if now - window.start < self.window_length:
+                continue
+            self._close(window, now - start)
+            if self.baseline is None:
+                baseline.merge(window)
+                if now - start >= self.baseline_length:
+                    self.baseline = baseline
+                    logger.info("Soak baseline set from the first "
+                                f"{(now - start) / 3600:.1f} hours")
+            window = Window(now)
+
+        if window.ops:
+            self._close(window, time.monotonic() - start)
+
+    def _run_suite(self, window, run_suite):
+        # Windows close between passes, so a window always holds whole passes
+        # of the suite.  The results and logs of the previous pass are
+        # dropped, the last pass keeps them for the report.
+        for test in self._tests:
+            test.reset()
+        self._tests = run_suite()
+        cycle = self.iterations
+        for test in self._tests:
+            window.record(test.name(), test.result() is not False)
+            # Keep the log on disk, not in memory
+            self._save(f'cycle-{cycle:05d}-{test.name()}.log', test.write_log)
+
+    def _run_mix(self, window):
+        choices = self.workloads + self.admin
+        choice = self.random.choices(
+            choices, weights=[c.get('weight', 1) for c in choices])[0]
+        if 'rw' not in choice:
+            command = [n_utils.CMD_NVME, choice['name'], f'/dev/{self.drive}']
+            begin = time.monotonic()
+            rc, out, err = n_utils.run_cmd(command, fail_on_err=False)
+            window.record(choice['name'], rc == 0, latencies=[
+                (int((time.monotonic() - begin) * 1e6), 1)])
+            return
+
+        rc, results, err = fio.run_job(
+            choice['name'], f'/dev/{self.drive}n1', choice['rw'],
+            choice['bs'], iodepth=choice.get('iodepth', 32),
+            numjobs=choice.get('numjobs', 1),
+            runtime=choice.get('runtime', 60),
+            ioengine=self.ioengine, sync=False,
+            extra_args=['--output-format=json+'])
+        if rc != 0:
+            logger.error(f"Soak workload {choice['name']} failed: {err}")
+            window.record(choice['name'], False)
+            return
+        self._save(f"fio-{self._file_count:06d}-{choice['name']}.json",
+                   lambda output: json.dump(results, output))
+
+        job = results['jobs'][0]
+        ddir = 'read' if 'read' in choice['rw'] else 'write'
+        window.record(choice['name'], True, iops=job[ddir]['iops'],
+                      latencies=fio_latencies(job, ddir))
+
+    def _save(self, name, write):
+        # Writes the file with write(output), rotating the files to keep the
+        # newest
+        path = os.path.join(self.output_dir, name)
+        with open(path, 'w') as output:
+            write(output)
+        self._file_count += 1
+        self._files.append(path)
+        while len(self._files) > self.keep_files:
+            os.remove(self._files.popleft())
+
+    def _close(self, window, elapsed):
+        self.windows.append(window)
+        logger.info(f"Soak window ending at {elapsed / 3600:.1f} hours:")
+        for line in window.lines():
+            logger.info(f"  {line}")
+        if self.baseline is not None:
+            self._check_drift(window, elapsed)
+
+    def _alert(self, message):
+        self.alert_count += 1
+        self.alerts.append(message)
+        logger.warning(f"SOAK ALERT: {message}")
+
+    def _check_drift(self, window, elapsed):
+        at = f"at {elapsed / 3600:.1f} hours"
+        for name, op in window.ops.items():
+            if op['failures']:
+                self._alert(f"{name} failed {op['failures']} times {at}")
+            base = self.baseline.ops.get(name)
+            if base is None:
+                continue
+
+            base_iops = Window.mean_iops(base)
+            iops = Window.mean_iops(op)
+            if base_iops and iops and iops < base_iops * (1 - self.drift):
+                self._alert(f"{name} IOPS {iops:.0f} {at}, baseline "
+                            f"{base_iops:.0f}")
+
+            base_p99 = base['latency'].percentile(99)
+            p99 = op['latency'].percentile(99)
+            if base_p99 and p99 > base_p99 * (1 + self.drift):
+                self._alert(f"{name} p99 latency {p99:.0f} us {at}, baseline "
+                            f"{base_p99:.0f} us")
+
+    def report_lines(self):
+        lines = [f"Mode: {self.mode}",
+                 f"Iterations: {self.iterations}",
+                 f"Alerts: {self.alert_count}"]
+        lines.extend(f"  {alert}" for alert in self.alerts)
+        if self.baseline is not None:
+            lines.append("Baseline:")
+            lines.extend(f"  {line}" for line in self.baseline.lines())
+        if self.windows:
+            lines.append("Last window:")
+            lines.extend(f"  {line}" for line in self.windows[-1].lines())
+        return lines
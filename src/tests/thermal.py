@@ -0,0 +1,211 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import fio
+from nvme import stats
+from nvme import utils as n_utils
+from tests import run
+
+import os
+import tempfile
+import time
+
+# SMART counters tracked through the test
+THERMAL_COUNTERS = ['warning_temp_time', 'critical_comp_time',
+                    'thm_temp1_trans_count', 'thm_temp2_trans_count',
+                    'thm_temp1_total_time', 'thm_temp2_total_time']
+
+
+def kelvin_to_celsius(kelvin):
+    return int(kelvin) - 273
+
+
+class ThermalThrottle(run.Run):
+
+    def __init__(self, config):
+        super(ThermalThrottle, self).__init__()
+
+        test_config = config['test_config'].get('thermal_throttle', {})
+        self.drive = config['drive']['name']
+        self.ioengine = config['test_config']['general'].get(
+            'ioengine', 'libaio')
+        self.max_runtime = test_config.get('max_runtime', 3600)
+        self.sample_interval = test_config.get('sample_interval', 5)
+        # The bandwidth of the cool drive is the mean over these seconds
+        self.baseline_seconds = test_config.get('baseline_seconds', 60)
+        # The temperature has plateaued when it moved less than the delta
+        # (degrees C) over the window (seconds)
+        self.plateau_window = test_config.get('plateau_window', 300)
+        self.plateau_delta = test_config.get('plateau_delta', 1)
+        # Fail if bandwidth drops below this fraction of the baseline
+        self.min_fraction = test_config.get('min_fraction', 0.5)
+        # Composite temperature thresholds from Identify Controller, in
+        # degrees C.  None when the drive doesn't report them.
+        self.warning_temp = None
+        self.critical_temp = None
+
+    def name(self):
+        return "thermal_throttle"
+
+    def description(self):
+        return ("Runs sustained mixed writes until the temperature plateaus, "
+                "and checks that thermal throttling keeps the drive under its "
+                "temperature thresholds without collapsing the bandwidth.")
+
+    def execute(self):
+        # Start in a failed state, work to success
+        self.success = False
+
+        self.logger.info(f"  Resetting drive {self.drive}")
+        tree = n_utils.generate_resource_tree()
+        n_utils.reset_drive(tree[self.drive])
+
+        # Create a single namespace
+        n_utils.factory_reset(tree[self.drive]['sn'].strip())
+
+        ctrl_data = n_utils.get_controller_data(self.drive)
+        wctemp = int(ctrl_data.get('wctemp', 0))
+        cctemp = int(ctrl_data.get('cctemp', 0))
+        self.warning_temp = kelvin_to_celsius(wctemp) if wctemp else None
+        self.critical_temp = kelvin_to_celsius(cctemp) if cctemp else None
+        self.logger.info(
+            f"Warning composite temperature threshold: "
+            f"{self.warning_temp} C, critical composite temperature "
+            f"threshold: {self.critical_temp} C")
+
+        with tempfile.TemporaryDirectory(prefix='thermal') as log_dir:
+            prefix = os.path.join(log_dir, 'thermal')
+            samples = self._run_until_plateau(prefix)
+            bandwidth = fio.read_log_series(prefix, 'bw')
+
+        if not samples or len(bandwidth) <= self.baseline_seconds:
+            self.logger.error("The workload did not run long enough to "
+                              "measure.")
+            return
+
+        first = samples[0]
+        last = samples[-1]
+        self.logger.info(f"Temperature went from {first['temperature']} C to "
+                         f"{last['temperature']} C in {last['time']:.0f} "
+                         "seconds")
+        for counter in THERMAL_COUNTERS:
+            self.logger.info(f"  {counter}: {first[counter]} -> "
+                             f"{last[counter]}")
+
+        # The first seconds include the fio start, skip them
+        baseline = stats.mean(bandwidth[5:self.baseline_seconds])
+        smoothed = stats.moving_mean(bandwidth, 10)
+        worst = min(smoothed[self.baseline_seconds:])
+        self.logger.info(f"Cool drive bandwidth: {baseline:.0f} KiB/s, "
+                         f"lowest 10 second bandwidth: {worst:.0f} KiB/s")
+
+        # Bandwidth around each temperature sample
+        temperatures = []
+        sample_bandwidth = []
+        for sample in samples:
+            second = int(sample['time'])
+            if second < len(smoothed):
+                temperatures.append(sample['temperature'])
+                sample_bandwidth.append(smoothed[second])
+            if second % 60 < self.sample_interval:
+                self.logger.info(
+                    f"  {second} s: {sample['temperature']} C, "
+                    f"{smoothed[min(second, len(smoothed) - 1)]:.0f} KiB/s, "
+                    f"throttle transitions "
+                    f"{sample['thm_temp1_trans_count']}/"
+                    f"{sample['thm_temp2_trans_count']}")
+        self.logger.info(
+            f"Correlation of temperature and bandwidth: "
+            f"{stats.pearson(temperatures, sample_bandwidth):.2f}")
+
+        passed = True
+        if worst < baseline * self.min_fraction:
+            self.logger.error(
+                f"Bandwidth dropped to {worst / baseline:.0%} of the cool "
+                f"drive bandwidth, below the limit of {self.min_fraction:.0%}."
+                "  DRIVE FAILED.")
+            passed = False
+
+        # Throttling should hold the drive below the critical threshold, and
+        # bring it back under the warning threshold by the plateau
+        peak = max(s['temperature'] for s in samples)
+        if self.critical_temp is not None and peak >= self.critical_temp:
+            self.logger.error(
+                f"Temperature reached {peak} C, at or above the critical "
+                f"threshold of {self.critical_temp} C.  DRIVE FAILED.")
+            passed = False
+        critical_minutes = int(last['critical_comp_time']) - \
+            int(first['critical_comp_time'])
+        if critical_minutes > 0:
+            self.logger.error(
+                f"The drive spent {critical_minutes} minutes above the "
+                "critical threshold.  DRIVE FAILED.")
+            passed = False
+        if self.warning_temp is not None and \
+                last['temperature'] > self.warning_temp:
+            self.logger.error(
+                f"Temperature plateaued at {last['temperature']} C, above the "
+                f"warning threshold of {self.warning_temp} C.  DRIVE FAILED.")
+            passed = False
+
+        if not passed:
+            return
+
+        self.logger.info("Drive kept its bandwidth and temperature through "
+                         "thermal load.")
+        self.success = True
+
+    def _run_until_plateau(self, prefix):
+        command = fio.build_command(
+            'thermal', f'/dev/{self.drive}n1', 'randrw', '128k', iodepth=32,
+            numjobs=4, runtime=self.max_runtime, ioengine=self.ioengine,
+            sync=False, group_reporting=False,
+            extra_args=['--rwmixwrite=70', f'--write_bw_log={prefix}',
+                        '--log_avg_msec=1000'])
+        self.logger.info(f"Command: {' '.join(command)}")
+        process = n_utils.run_background_cmd(command)
+
+        samples = []
+        start = time.monotonic()
+        while process.poll() is None:
+            smart = n_utils.get_smart_data(self.drive)
+            sample = {'time': time.monotonic() - start,
+                      'temperature': kelvin_to_celsius(
+                          smart.get('temperature', 273))}
+            for counter in THERMAL_COUNTERS:
+                sample[counter] = smart.get(counter, 0)
+            samples.append(sample)
+
+            # Don't keep heating a drive that failed to throttle
+            if self.critical_temp is not None and \
+                    sample['temperature'] >= self.critical_temp:
+                self.logger.warning(f"Temperature reached the critical "
+                                    f"threshold at {sample['temperature']} "
+                                    "C.  Stopping the workload.")
+                process.terminate()
+                break
+
+            window = [s['temperature'] for s in samples
+                      if s['time'] >= sample['time'] - self.plateau_window]
+            if samples[0]['time'] < sample['time'] - self.plateau_window and \
+                    max(window) - min(window) <= self.plateau_delta:
+                self.logger.info(f"Temperature plateaued at "
+                                 f"{sample['temperature']} C")
+                process.terminate()
+                break
+            time.sleep(self.sample_interval)
+
+        stdout, stderr = process.communicate()
+        return samples
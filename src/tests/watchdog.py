@@ -0,0 +1,122 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import diagnostics
+from nvme import events
+from nvme import executor
+from nvme import utils as n_utils
+
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Watchdog(threading.Thread):
+    """Fails the running tests when the drive stops making progress.
+
+    Progress is any heartbeat: command output, a command starting or
+    finishing, or I/O completing on the drive's namespaces.  A long
+    operation, such as a format, counts as progress while it runs, up to
+    its limit.  When
+    there has been none for the timeout, the controller diagnostics are
+    captured, the running tests are marked as hung, their commands are
+    killed and the controller is reset.
+    """
+
+    def __init__(self, drive, timeout, output_dir, interval=5):
+        super(Watchdog, self).__init__(daemon=True)
+        self.drive = drive
+        self.timeout = timeout
+        self.output_dir = output_dir
+        self.interval = interval
+
+        self.last_progress = time.monotonic()
+        self._tests = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def _on_heartbeat(self, source, now):
+        self.last_progress = now
+
+    def watch(self, test):
+        with self._lock:
+            self._tests.append(test)
+        self.last_progress = time.monotonic()
+
+    def release(self, test):
+        with self._lock:
+            if test in self._tests:
+                self._tests.remove(test)
+
+    def run(self):
+        events.subscribe(self._on_heartbeat)
+        completions = None
+        while not self._stop_event.wait(self.interval):
+            try:
+                current = diagnostics.get_io_completions(self.drive)
+            except OSError:
+                current = None
+            if current != completions:
+                completions = current
+                events.heartbeat('io')
+
+            # Formats and erases show no progress until they finish, or
+            # until they run past their limit
+            if events.in_long_operation():
+                self.last_progress = time.monotonic()
+
+            with self._lock:
+                tests = [t for t in self._tests if not t.hung]
+            if tests and time.monotonic() - self.last_progress >= self.timeout:
+                self._hang(tests)
+        events.unsubscribe(self._on_heartbeat)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def _hang(self, tests):
+        names = ', '.join(test.name() for test in tests)
+        logger.error(f"No progress on drive {self.drive} for {self.timeout} "
+                     f"seconds.  Tests hung: {names}")
+        for test in tests:
+            test.hung = True
+            test.logger.error(f"No progress for {self.timeout} seconds.  "
+                              "TEST HUNG.")
+
+        date = datetime.now().strftime("%Y_%m_%d-%H_%M_%S")
+        output_dir = os.path.join(self.output_dir,
+                                  f'hang-{tests[0].name()}-{date}')
+        try:
+            diagnostics.capture(self.drive, output_dir)
+            for test in tests:
+                test.logger.error(f"Diagnostics saved to {output_dir}")
+        except Exception as err:
+            logger.error(f"  Unable to capture diagnostics: {err}")
+
+        # Unblock the tests, then try to bring the controller back
+        executor.kill_running()
+        rc, out, err = n_utils.reset_controller(
+            self.drive, timeout=diagnostics.CAPTURE_TIMEOUT)
+        if rc != 0:
+            logger.error(f"  Controller reset of {self.drive} failed: {err}")
+        elif n_utils.wait_for_controller(self.drive) is None:
+            logger.error(f"  Controller {self.drive} did not come back after "
+                         "the reset")
+        self.last_progress = time.monotonic()
@@ -0,0 +1,56 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import changepoint
+
+import numpy as np
+
+
+def _series(*levels):
+    # Noisy plateaus of (mean, seconds)
+    rng = np.random.default_rng(0)
+    return np.concatenate([mean + rng.normal(0, mean * 0.01, seconds)
+                           for mean, seconds in levels])
+
+
+def test_detect_and_segments():
+    values = _series((1000, 100), (400, 100))
+    changes = changepoint.detect(values)
+    assert len(changes) == 1 and abs(changes[0] - 100) <= 2
+    plateaus = changepoint.segments(values, changes)
+    assert [round(mean, -2) for start, end, mean in plateaus] == [1000, 400]
+
+
+def test_largest_drop_after_ramp_up():
+    # A ramp up and a short dip come before the cliff
+    values = _series((600, 60), (1000, 120), (900, 60), (1000, 60),
+                     (300, 200))
+    plateaus = changepoint.segments(values, changepoint.detect(values))
+    after, before = changepoint.largest_drop(plateaus)
+    assert round(plateaus[before][2], -2) == 1000
+    assert abs(plateaus[after][0] - 300) <= 2
+    assert round(plateaus[after][2], -2) == 300
+
+
+def test_largest_drop_none():
+    plateaus = [(0, 10, 100.0), (10, 20, 200.0)]
+    assert changepoint.largest_drop(plateaus) is None
+    assert changepoint.largest_drop(plateaus[:1]) is None
+
+
+def test_spikes():
+    values = [10.0] * 50
+    values[20] = 500
+    assert changepoint.spikes(values, 10) == [20]
@@ -0,0 +1,74 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import dsm
+from nvme import fw_download
+
+import ctypes
+import errno
+import pytest
+
+
+def test_layout():
+    # The ioctl number encodes the size of struct nvme_passthru_cmd
+    assert ctypes.sizeof(fw_download.AdminCommand) == \
+        (dsm.NVME_IOCTL_IO_CMD >> 16) & 0x3fff
+    assert ctypes.sizeof(dsm.Range) == 16
+
+
+def test_build_command():
+    ranges = [(0, 256), (1 << 40, 8)]
+    cmd, buffer = dsm.build_command('3', ranges)
+    assert cmd.opcode == dsm.OPCODE_DSM
+    assert cmd.nsid == 3
+    # Number of ranges is 0's based, and only deallocate is set
+    assert cmd.cdw10 == 1
+    assert cmd.cdw11 == dsm.ATTRIBUTE_DEALLOCATE
+    assert cmd.data_len == 32
+
+    # The command points at the ranges, with the lengths as is
+    sent = (dsm.Range * 2).from_address(cmd.addr)
+    assert [(r.slba, r.nlb, r.cattr) for r in sent] == \
+        [(0, 256, 0), (1 << 40, 8, 0)]
+
+
+def test_build_command_range_count():
+    with pytest.raises(ValueError):
+        dsm.build_command(1, [])
+    with pytest.raises(ValueError):
+        dsm.build_command(1, [(0, 1)] * (dsm.MAX_RANGES + 1))
+    cmd, buffer = dsm.build_command(1, [(0, 1)] * dsm.MAX_RANGES)
+    assert cmd.cdw10 == dsm.MAX_RANGES - 1
+
+
+def test_deallocate(monkeypatch):
+    issued = []
+
+    def ioctl(fd, request, cmd):
+        issued.append((fd, request, cmd.opcode,
+                       dsm.Range.from_address(cmd.addr).slba))
+        return 0
+
+    monkeypatch.setattr(dsm.fcntl, 'ioctl', ioctl)
+    assert dsm.deallocate(7, 1, [(4096, 8)]) == 0
+    assert issued == [(7, dsm.NVME_IOCTL_IO_CMD, dsm.OPCODE_DSM, 4096)]
+
+
+def test_deallocate_failure(monkeypatch):
+    def ioctl(fd, request, cmd):
+        raise OSError(errno.ENOTTY, 'Inappropriate ioctl for device')
+
+    monkeypatch.setattr(dsm.fcntl, 'ioctl', ioctl)
+    assert dsm.deallocate(7, 1, [(0, 8)]) == -errno.ENOTTY
@@ -0,0 +1,119 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import executor
+from nvme import utils
+
+import asyncio
+import os
+import pytest
+import stat
+import time
+
+
+def _script(tmp_path, name, body):
+    # Writes a stand-in shell script, returning its path
+    path = tmp_path / name
+    path.write_text(f'#!/bin/sh\n{body}\n')
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # A zombie is as good as gone
+    with open(f'/proc/{pid}/stat') as proc_stat:
+        return proc_stat.read().split(')')[-1].split()[0] != 'Z'
+
+
+def _wait_gone(pid, seconds=5):
+    end = time.monotonic() + seconds
+    while _alive(pid) and time.monotonic() < end:
+        time.sleep(0.05)
+    return not _alive(pid)
+
+
+def test_streams_lines(tmp_path):
+    script = _script(tmp_path, 'lines', 'echo one; echo two >&2; '
+                     'printf "three\\nfour"; exit 3')
+    out_lines = []
+    err_lines = []
+    rc, out, err = executor.call(executor.run(
+        [script], on_stdout=out_lines.append, on_stderr=err_lines.append))
+    assert rc == 3
+    assert out == 'one\nthree\nfour'
+    assert err == 'two\n'
+    assert out_lines == ['one', 'three', 'four']
+    assert err_lines == ['two']
+
+
+def test_shell_command_as_list():
+    rc, out, err = executor.call(executor.run(['echo a; echo b'], shell=True))
+    assert (rc, out) == (0, 'a\nb\n')
+    assert utils.run_cmd(['echo a; echo b'], shell=True) == (0, 'a\nb', '')
+    assert utils.run_cmd('echo c', shell=True) == (0, 'c', '')
+
+
+def test_timeout_kills_group(tmp_path):
+    # Ignores SIGTERM and leaves a child behind, so both SIGKILL and the
+    # process group are needed
+    script = _script(tmp_path, 'stuck',
+                     "trap '' TERM; sleep 60 & echo $!; wait")
+    with pytest.raises(executor.CommandTimeout) as err:
+        executor.call(executor.run([script], timeout=1))
+    assert err.value.returncode == -9
+    child = int(err.value.stdout.split()[0])
+    assert _wait_gone(child)
+    assert not executor._running
+
+
+def test_timeout_in_run_cmd(tmp_path):
+    script = _script(tmp_path, 'slow', 'echo started; sleep 60')
+    rc, out, err = utils.run_cmd([script], fail_on_err=False, timeout=1)
+    assert rc < 0
+    assert out == 'started'
+    with pytest.raises(executor.CommandTimeout):
+        utils.run_cmd([script], timeout=1)
+
+
+def test_cancel_kills_group(tmp_path):
+    script = _script(tmp_path, 'child', 'sleep 60 & echo $!; wait')
+    lines = []
+
+    async def cancel():
+        task = asyncio.ensure_future(
+            executor.run([script], on_stdout=lines.append))
+        while not lines:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    executor.call(cancel())
+    assert _wait_gone(int(lines[0]))
+    assert not executor._running
+
+
+def test_run_all_limit(tmp_path):
+    script = _script(tmp_path, 'pause', 'sleep 0.5; echo done')
+    start = time.monotonic()
+    results = executor.call(executor.run_all(
+        [[script]] * 4 + [['/nonexistent']], limit=2))
+    assert time.monotonic() - start >= 1.0
+    assert [r[0] for r in results[:4]] == [0] * 4
+    assert isinstance(results[4], OSError)
@@ -0,0 +1,120 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import events
+from nvme import utils
+from tests import exporter
+
+import pytest
+import urllib.error
+import urllib.request
+
+SUMMARY = {'iops': 1000.0, 'bw': 4000, 'lat_mean': 50.0, 'lat_max': 90.0,
+           'lat_p50': 40.0, 'lat_p99': 80.0, 'lat_p999': 85.0}
+
+
+@pytest.fixture
+def metrics():
+    server = exporter.Exporter('nvme0', 0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def _scrape(server, accept=None, path='/metrics'):
+    url = f'http://127.0.0.1:{server.server.server_address[1]}{path}'
+    headers = {'Accept': accept} if accept else {}
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers),
+                                timeout=5) as response:
+        return response.headers['Content-Type'], response.read().decode()
+
+
+def _publish_run():
+    events.publish('suite', tests=3)
+    events.publish('test_start', test='perf_seq_read')
+    events.publish('fio', name='seqread', summary={'read': SUMMARY},
+                   final=False)
+    events.publish('smart', device='nvme0', smart={'temperature': 318})
+    events.publish('command', command=[utils.CMD_NVME, 'id-ctrl',
+                                       '/dev/nvme0'],
+                   seconds=0.002, returncode=0)
+    events.publish('command', command=f'{utils.CMD_NVME} smart-log '
+                   '/dev/nvme0 -o json', seconds=0.2, returncode=1)
+    events.publish('command', command=['fio', '--name=x'], seconds=1,
+                   returncode=0)
+
+
+def test_prometheus_text(metrics):
+    # Published straight after start, nothing may be missed
+    _publish_run()
+    content_type, body = _scrape(metrics)
+    assert content_type.startswith('text/plain; version=0.0.4')
+    lines = body.splitlines()
+    assert 'nvme_qual_tests_selected{drive="nvme0"} 3' in lines
+    assert 'nvme_qual_tests_completed{drive="nvme0"} 0' in lines
+    assert 'nvme_qual_test_running{drive="nvme0",test="perf_seq_read"} 1' \
+        in lines
+    assert 'nvme_qual_fio_iops{drive="nvme0",job="seqread",rw="read"} ' \
+        '1000.0' in lines
+    assert 'nvme_qual_fio_bandwidth_bytes{drive="nvme0",job="seqread",' \
+        'rw="read"} 4096000' in lines
+    assert 'nvme_qual_fio_latency_seconds{drive="nvme0",job="seqread",' \
+        'rw="read",percentile="99"} 8e-05' in lines
+    assert 'nvme_qual_temperature_celsius{drive="nvme0"} 45' in lines
+    assert 'nvme_qual_admin_command_seconds_bucket{drive="nvme0",' \
+        'command="id-ctrl",le="0.005"} 1' in lines
+    assert 'nvme_qual_admin_command_seconds_bucket{drive="nvme0",' \
+        'command="smart-log",le="0.1"} 0' in lines
+    assert 'nvme_qual_admin_command_seconds_count{drive="nvme0",' \
+        'command="smart-log"} 1' in lines
+    assert 'nvme_qual_admin_command_failures_total{drive="nvme0",' \
+        'command="smart-log"} 1' in lines
+    assert '# TYPE nvme_qual_test_results_total counter' in lines
+    # Only nvme-cli commands are admin commands
+    assert 'command="--name=x"' not in body
+    assert '# EOF' not in lines
+
+
+def test_openmetrics(metrics):
+    _publish_run()
+    events.publish('test_end', test='perf_seq_read', result=True)
+    events.publish('test_start', test='perf_seq_write')
+    events.publish('test_end', test='perf_seq_write', result=False)
+    events.publish('test_end', test='opal_capable', result=None)
+    content_type, body = _scrape(
+        metrics, 'application/openmetrics-text; version=1.0.0')
+    assert content_type.startswith('application/openmetrics-text')
+    lines = body.splitlines()
+    assert lines[-1] == '# EOF'
+    assert '# TYPE nvme_qual_test_results counter' in lines
+    for result in ['passed', 'failed', 'skipped']:
+        assert f'nvme_qual_test_results_total{{drive="nvme0",' \
+            f'result="{result}"}} 1' in lines
+    assert 'nvme_qual_tests_completed{drive="nvme0"} 3' in lines
+    assert 'test="perf_seq_read"' not in body
+
+
+def test_not_found(metrics):
+    with pytest.raises(urllib.error.HTTPError) as err:
+        _scrape(metrics, path='/')
+    assert err.value.code == 404
+
+
+def test_stop_unlistens():
+    server = exporter.Exporter('nvme0', 0)
+    server.start()
+    server.stop()
+    events.publish('suite', tests=7)
+    assert server.selected == 0
@@ -0,0 +1,147 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import events
+from nvme import fio
+
+import json
+import logging
+import pytest
+import stat
+
+
+def _document(iops):
+    return json.dumps({'jobs': [{
+        'jobname': 'job',
+        'read': {'iops': iops, 'bw': 4000, 'total_ios': 10,
+                 'clat_ns': {'mean': 50000, 'max': 90000}},
+        'write': {'iops': 0, 'total_ios': 0},
+        'trim': {'iops': 0, 'total_ios': 0}}]}, indent=2)
+
+
+@pytest.fixture
+def stand_in_fio(tmp_path, monkeypatch):
+    # Prints a warning, two status documents and the final results, and
+    # saves its arguments
+    output = tmp_path / 'output'
+    output.write_text('fio: a warning\n' + '\n'.join(
+        _document(iops) for iops in [100, 200, 300]) + '\n')
+    script = tmp_path / 'fio'
+    script.write_text(f'#!/bin/sh\necho "$@" > {tmp_path}/args\n'
+                      f'cat {output}\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(fio, 'CMD_FIO', str(script))
+    return tmp_path
+
+
+@pytest.fixture
+def published():
+    received = []
+
+    def listener(kind, now, fields):
+        if kind == 'fio':
+            received.append(fields)
+
+    events.listen(listener)
+    yield received
+    events.unlisten(listener)
+
+
+def test_status_published(stand_in_fio, published):
+    rc, results, err = fio.run_job('seqread', '/dev/null', 'read', '128k',
+                                   runtime=1)
+    assert rc == 0
+    assert results['jobs'][0]['read']['iops'] == 300
+    assert f'--status-interval={fio.STATUS_INTERVAL}' in \
+        (stand_in_fio / 'args').read_text()
+    assert [p['summary']['read']['iops'] for p in published] == \
+        [100, 200, 300, 300]
+    assert [p['final'] for p in published] == [False] * 3 + [True]
+    assert all(p['name'] == 'seqread' for p in published)
+    assert all(list(p['summary']) == ['read'] for p in published)
+
+
+def test_failed_run(tmp_path, monkeypatch, published):
+    script = tmp_path / 'fio'
+    script.write_text('#!/bin/sh\necho "fio: bad option" >&2\nexit 1\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(fio, 'CMD_FIO', str(script))
+    rc, results, err = fio.run_jobs([{'name': 'a', 'filename': '/dev/null'}],
+                                    'read', '4k')
+    assert (rc, results, err) == (1, None, 'fio: bad option')
+    assert not published
+
+
+def test_parse_output():
+    assert fio.parse_output('') is None
+    assert fio.parse_output('warning\n' + _document(1) + '\n' +
+                            _document(2))['jobs'][0]['read']['iops'] == 2
+
+
+def test_run_profiles(stand_in_fio, caplog):
+    logger = logging.getLogger(__name__)
+    profiles = [fio.SEQ_READ, ('4krandread_fua', 'randread', '4k', 1, 1,
+                               ['--fua=1'])]
+    with caplog.at_level(logging.INFO):
+        results = fio.run_profiles(profiles, '/dev/null', logger,
+                                   'on the stand-in', min_bs=8192,
+                                   extra_args=['--offset=1m'], runtime=1)
+    assert list(results) == ['seqread', '4krandread_fua']
+    assert results['seqread']['iops'] == 300
+    assert 'flush' not in results['seqread']
+    # The last run: raised to min_bs, the common then the profile arguments
+    args = (stand_in_fio / 'args').read_text().split()
+    assert '--bs=8192' in args
+    assert args.index('--offset=1m') < args.index('--fua=1')
+    assert 'Measuring performance on the stand-in' in caplog.text
+
+
+def test_run_profiles_failure(tmp_path, monkeypatch, caplog):
+    script = tmp_path / 'fio'
+    script.write_text('#!/bin/sh\necho "fio: bad option" >&2\nexit 1\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(fio, 'CMD_FIO', str(script))
+    logger = logging.getLogger(__name__)
+    assert fio.run_profiles(fio.PROFILES, '/dev/null', logger,
+                            'before setup') is None
+    assert 'seqread failed before setup: fio: bad option' in caplog.text
+
+
+def test_precondition(monkeypatch):
+    runs = []
+    monkeypatch.setattr(fio, 'run_job', lambda name, filename, rw, bs,
+                        **kwargs: runs.append((name, rw, kwargs)) or
+                        (0, {}, ''))
+    assert fio.precondition('/dev/null', size='1G', runtime=600) == (0, '')
+    assert [(name, rw) for name, rw, kwargs in runs] == \
+        [('fill', 'write'), ('steadystate', 'randwrite')]
+    assert all(kwargs['size'] == '1G' for name, rw, kwargs in runs)
+    assert runs[1][2]['runtime'] == 600
+    assert '--steadystate=iops_slope:0.3%' in runs[1][2]['extra_args']
+
+    # Without a runtime only the fill runs
+    runs.clear()
+    fio.precondition('/dev/null')
+    assert [name for name, rw, kwargs in runs] == ['fill']
+
+
+def test_precondition_fill_failure(tmp_path, monkeypatch):
+    script = tmp_path / 'fio'
+    script.write_text('#!/bin/sh\necho "fio: no space" >&2\nexit 1\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(fio, 'CMD_FIO', str(script))
+    rc, err = fio.precondition('/dev/null', runtime=600)
+    assert rc == 1
+    assert 'no space' in err
@@ -0,0 +1,153 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import fw_download
+from tests import firmware
+
+import ctypes
+import errno
+import logging
+import os
+import pytest
+
+IMAGE_SIZE = 10 * 4096 + 512
+TRANSFER = 4 * 4096
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'fw.bin'
+    path.write_bytes(os.urandom(IMAGE_SIZE))
+    return str(path)
+
+
+class StandIn:
+    # Stands in for the drive, keeping what was downloaded at each offset and
+    # failing the chunks at the offsets given, a number of times each
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.received = {}
+        self.calls = []
+
+    def __call__(self, controller, chunk, offset):
+        self.calls.append(offset)
+        if self.failures.get(offset):
+            self.failures[offset] -= 1
+            return 1, '', 'stand-in failure'
+        self.received[offset] = bytes(chunk)
+        return 0, '', ''
+
+    def image(self):
+        return b''.join(chunk for _, chunk in sorted(self.received.items()))
+
+
+def test_plan_transfer_size():
+    # MDTS of 5 is 128 KiB, rounded down to a multiple of a 12 KiB FWUG
+    assert fw_download.plan_transfer_size(5, 3) == 120 * 1024
+    assert fw_download.plan_transfer_size(5, 0) == 128 * 1024
+    assert fw_download.plan_transfer_size(0, 0xff) == \
+        fw_download.DEFAULT_MAX_TRANSFER
+    with pytest.raises(ValueError):
+        fw_download.plan_transfer_size(1, 4)
+
+
+def test_plan_chunks():
+    assert fw_download.plan_chunks(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert fw_download.plan_chunks(10, 4, start_offset=4) == [(4, 4), (8, 2)]
+
+
+def test_download(image):
+    stand_in = StandIn()
+    result = fw_download.download('nvme0', image, TRANSFER,
+                                  submit=stand_in)
+    with open(image, 'rb') as fw_file:
+        assert stand_in.image() == fw_file.read()
+    assert result['bytes'] == IMAGE_SIZE
+    assert result['chunks'] == 3
+    assert result['retries'] == 0
+
+
+def test_download_retries(image):
+    stand_in = StandIn({TRANSFER: 2})
+    result = fw_download.download('nvme0', image, TRANSFER, retries=2,
+                                  submit=stand_in)
+    assert stand_in.calls == [0, TRANSFER, TRANSFER, TRANSFER, 2 * TRANSFER]
+    assert result['retries'] == 2
+    with open(image, 'rb') as fw_file:
+        assert stand_in.image() == fw_file.read()
+
+
+def test_download_error_resumes(image):
+    stand_in = StandIn({TRANSFER: 3})
+    with pytest.raises(fw_download.DownloadError) as err:
+        fw_download.download('nvme0', image, TRANSFER, retries=2,
+                             submit=stand_in)
+    assert err.value.offset == TRANSFER
+
+    stand_in.calls = []
+    result = fw_download.download('nvme0', image, TRANSFER,
+                                  start_offset=err.value.offset,
+                                  submit=stand_in)
+    assert stand_in.calls == [TRANSFER, 2 * TRANSFER]
+    assert result['bytes'] == IMAGE_SIZE - TRANSFER
+    with open(image, 'rb') as fw_file:
+        assert stand_in.image() == fw_file.read()
+
+
+def test_download_firmware_resumes(image, monkeypatch):
+    stand_in = StandIn({TRANSFER: 4})
+    real_download = fw_download.download
+
+    def download(controller, fw_path, start_offset=0):
+        return real_download(controller, fw_path, TRANSFER, start_offset,
+                             retries=1, submit=stand_in)
+
+    monkeypatch.setattr(fw_download, 'download', download)
+    monkeypatch.setattr(firmware, 'RESUME_DELAY', 0)
+    logger = logging.getLogger(__name__)
+    assert firmware.download_firmware(logger, 'nvme0', image)
+    assert stand_in.calls == [0] + [TRANSFER] * 5 + [2 * TRANSFER]
+
+    stand_in = StandIn({0: 100})
+    assert not firmware.download_firmware(logger, 'nvme0', image)
+
+
+def test_submit_chunk(monkeypatch):
+    # The command passed through, with the data read from the buffer given
+    commands = []
+
+    def ioctl(fd, request, cmd):
+        assert request == fw_download.NVME_IOCTL_ADMIN_CMD
+        commands.append((cmd.opcode, cmd.cdw10, cmd.cdw11,
+                         ctypes.string_at(cmd.addr, cmd.data_len)))
+        return 0
+
+    monkeypatch.setattr(fw_download.os, 'open', lambda path, flags: -1)
+    monkeypatch.setattr(fw_download.os, 'close', lambda fd: None)
+    monkeypatch.setattr(fw_download.fcntl, 'ioctl', ioctl)
+    data = bytearray(os.urandom(8192))
+    with memoryview(data) as view:
+        assert fw_download.submit_chunk('nvme0', view[4096:], 4096)[0] == 0
+    assert commands == [(fw_download.OPCODE_FW_DOWNLOAD, 1023, 1024,
+                         bytes(data[4096:]))]
+
+    def failing_ioctl(fd, request, cmd):
+        raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+    monkeypatch.setattr(fw_download.fcntl, 'ioctl', failing_ioctl)
+    with memoryview(data) as view:
+        rc, out, err = fw_download.submit_chunk('nvme0', view, 0)
+    assert rc == -errno.EIO
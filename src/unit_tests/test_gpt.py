@@ -0,0 +1,133 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import gpt
+
+import pytest
+import re
+import shutil
+import struct
+import subprocess
+import zlib
+
+MIB = 1024 * 1024
+IMAGE_SIZE = 64 * MIB
+
+
+@pytest.fixture
+def image(tmp_path):
+    # A sparse image file standing in for a namespace
+    path = tmp_path / 'disk.img'
+    with open(path, 'wb') as disk:
+        disk.truncate(IMAGE_SIZE)
+    return str(path)
+
+
+def _backup_header(path, block_size):
+    with open(path, 'rb') as disk:
+        disk.seek(IMAGE_SIZE - block_size)
+        fields = list(struct.unpack(gpt.HEADER_FORMAT,
+                                    disk.read(gpt.HEADER_SIZE)))
+    crc = fields[3]
+    fields[3] = 0
+    assert zlib.crc32(struct.pack(gpt.HEADER_FORMAT, *fields)) == crc
+    return fields
+
+
+@pytest.mark.parametrize('block_size', [512, 4096])
+def test_write_and_parse(image, block_size):
+    total_blocks = IMAGE_SIZE // block_size
+    partitions = gpt.layout(total_blocks, [16 * MIB, 8 * MIB, 8 * MIB],
+                            block_size)
+    gpt.write(image, partitions, block_size)
+
+    parsed = gpt.parse(image, block_size)
+    assert [(p.first_lba, p.last_lba, p.guid) for p in parsed] == \
+        [(p.first_lba, p.last_lba, p.guid) for p in partitions]
+    assert all(p.type_guid == gpt.LINUX_DATA for p in parsed)
+    assert all(p.name == 'primary' for p in parsed)
+
+    with open(image, 'rb') as disk:
+        mbr = disk.read(512)
+    assert mbr[510:] == b'\x55\xaa'
+    assert mbr[450] == 0xee
+
+    # The backup header points back at the primary and its own entries
+    fields = _backup_header(image, block_size)
+    assert fields[0] == gpt.SIGNATURE
+    assert fields[5:7] == [total_blocks - 1, 1]
+    assert fields[10] == total_blocks - 1 - gpt.entry_blocks(block_size)
+
+
+@pytest.mark.skipif(shutil.which('sfdisk') is None,
+                    reason='sfdisk is not installed')
+def test_sfdisk_reads_table(image):
+    partitions = gpt.layout(IMAGE_SIZE // 512, [16 * MIB, 8 * MIB])
+    gpt.write(image, partitions)
+    output = subprocess.run(['sfdisk', '--dump', image], check=True,
+                            capture_output=True, text=True).stdout
+    assert 'label: gpt' in output
+    assert [int(start) for start in re.findall(r'start=\s*(\d+)', output)] \
+        == [p.first_lba for p in partitions]
+
+
+@pytest.mark.skipif(shutil.which('blkid') is None,
+                    reason='blkid is not installed')
+def test_blkid_reads_table(image):
+    gpt.write(image, gpt.layout(IMAGE_SIZE // 512, [MIB]))
+    output = subprocess.run(['blkid', '-p', '-o', 'value', '-s', 'PTTYPE',
+                             image], capture_output=True, text=True).stdout
+    assert output.strip() == 'gpt'
+
+
+def test_layout_alignment():
+    partitions = gpt.layout(IMAGE_SIZE // 512, [MIB, MIB])
+    assert [p.first_lba * 512 % MIB for p in partitions] == [0, 0]
+    assert partitions[0].first_lba == 2048
+    assert partitions[0].last_lba == 2048 + 2047
+    assert partitions[1].first_lba == 4096
+
+    shifted = gpt.layout(IMAGE_SIZE // 512, [MIB, MIB], shift=512)
+    assert [p.first_lba for p in shifted] == [2049, 4097]
+
+
+def test_layout_errors():
+    with pytest.raises(ValueError):
+        gpt.layout(IMAGE_SIZE // 4096, [MIB], 4096, shift=512)
+    with pytest.raises(ValueError):
+        gpt.layout(IMAGE_SIZE // 512, [IMAGE_SIZE])
+    with pytest.raises(ValueError):
+        gpt.layout(IMAGE_SIZE // 512, [512] * (gpt.MAX_ENTRIES + 1),
+                   alignment=512)
+
+
+def test_clear(image):
+    gpt.write(image, gpt.layout(IMAGE_SIZE // 512, [MIB]))
+    gpt.clear(image)
+    with pytest.raises(ValueError):
+        gpt.parse(image)
+    with open(image, 'rb') as disk:
+        assert disk.read(512) == bytes(512)
+        disk.seek(IMAGE_SIZE - 512)
+        assert disk.read(512) == bytes(512)
+
+
+def test_parse_detects_corruption(image):
+    gpt.write(image, gpt.layout(IMAGE_SIZE // 512, [MIB]))
+    with open(image, 'r+b') as disk:
+        disk.seek(2 * 512)
+        disk.write(b'\x01')
+    with pytest.raises(ValueError, match='entries CRC'):
+        gpt.parse(image)
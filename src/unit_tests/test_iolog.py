@@ -0,0 +1,143 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import iolog
+
+import io
+
+BLKPARSE = """\
+259,0    3        1     0.000000000  1234  Q  WS 2048 + 8 [fio]
+259,0    3        2     0.000001000  1234  G  WS 2048 + 8 [fio]
+259,0    3        3     0.000002000  1234  D  WS 2048 + 8 [fio]
+259,0    3        4     0.500000000  1234  Q   R 4096 + 16 [fio]
+259,0    3        5     0.750000000  1234  Q  FN 0 + 0 [fio]
+259,0    3        6     1.000000000  1234  Q   D 8192 + 2048 [fstrim]
+259,0    3        7     1.250000000  1234  Q   N 0 + 8 [fio]
+259,0    3        8     1.500000000  1234  Q   R bad + 8 [fio]
+CPU3 (259,0):
+ Reads Queued:           1,        8KiB
+"""
+
+IOLOG_V2 = """\
+fio version 2 iolog
+/dev/nvme0n1 add
+/dev/nvme0n1 open
+/dev/nvme0n1 write 0 4096
+/dev/nvme0n1 sync 0 0
+/dev/nvme0n1 read 8192 4096
+/dev/nvme0n1 close
+"""
+
+IOLOG_V3 = """\
+fio version 3 iolog
+0 /dev/nvme0n1 add
+0 /dev/nvme0n1 open
+1000 /dev/nvme0n1 write 0 4096
+2000 /dev/nvme0n1 trim 8192 65536
+3000 /dev/nvme0n1 read 4096 512
+3000 /dev/nvme0n1 close
+"""
+
+
+def test_detect_format(tmp_path):
+    for name, text, expected in [('v2', IOLOG_V2, 'iolog'),
+                                 ('v3', IOLOG_V3, 'iolog'),
+                                 ('blk', BLKPARSE, 'blkparse')]:
+        path = tmp_path / name
+        path.write_text(text)
+        assert iolog.detect_format(str(path)) == expected
+
+
+def test_parse_blkparse():
+    events = list(iolog.parse_blkparse(BLKPARSE.splitlines()))
+    # Flushes, no data events and unparsable lines are dropped
+    assert events == [(0, 'write', 2048 * 512, 8 * 512),
+                      (500000000, 'read', 4096 * 512, 16 * 512),
+                      (1000000000, 'trim', 8192 * 512, 2048 * 512)]
+
+
+def test_parse_blkparse_action():
+    events = list(iolog.parse_blkparse(BLKPARSE.splitlines(), action='D'))
+    assert events == [(2000, 'write', 2048 * 512, 8 * 512)]
+
+
+def test_parse_iolog_v2():
+    # No timestamps, and the file actions and syncs are dropped
+    assert list(iolog.parse_iolog(IOLOG_V2.splitlines())) == \
+        [(0, 'write', 0, 4096), (0, 'read', 8192, 4096)]
+
+
+def test_parse_iolog_v3():
+    assert list(iolog.parse_iolog(IOLOG_V3.splitlines())) == \
+        [(1000, 'write', 0, 4096), (2000, 'trim', 8192, 65536),
+         (3000, 'read', 4096, 512)]
+
+
+def test_transform_window():
+    events = [(int(s * 1e9), 'read', 0, 4096) for s in [10, 11, 12, 13, 14]]
+    # Times are from the first event, and restart at the window start
+    assert [e[0] for e in iolog.transform(events, start=1, end=3)] == \
+        [0, int(1e9), int(2e9)]
+
+
+def test_transform_scale_and_ops():
+    events = [(0, 'read', 0, 4096), (1000, 'write', 0, 4096),
+              (2000, 'trim', 0, 4096), (4000, 'write', 4096, 4096)]
+    assert list(iolog.transform(events, ops=['write'], scale=2)) == \
+        [(500, 'write', 0, 4096), (2000, 'write', 4096, 4096)]
+
+
+def test_transform_align():
+    events = [(0, 'read', 4097, 100), (0, 'write', 8192, 4097)]
+    assert list(iolog.transform(events, align=4096)) == \
+        [(0, 'read', 4096, 4096), (0, 'write', 8192, 8192)]
+
+
+def test_transform_wrap():
+    capacity = 1024 * 1024
+    events = [(0, 'read', capacity + 8192, 4096),
+              (0, 'write', capacity - 4096, 8192),
+              (0, 'read', 0, 2 * capacity)]
+    # Offsets past the capacity wrap, I/O running off the end is moved back
+    # to fit, and I/O larger than the capacity is dropped
+    assert list(iolog.transform(events, capacity=capacity, align=4096)) == \
+        [(0, 'read', 8192, 4096), (0, 'write', capacity - 8192, 8192)]
+
+
+def test_write_iolog():
+    events = [(0, 'write', 0, 4096), (1500, 'read', 8192, 512)]
+    output = io.StringIO()
+    result = iolog.write_iolog(events, output, '/dev/nvme0n1')
+    assert result == {'events': 2, 'bytes': 4608, 'duration': 1500,
+                      'span': 8704}
+    assert output.getvalue() == ('fio version 3 iolog\n'
+                                 '0 /dev/nvme0n1 add\n'
+                                 '0 /dev/nvme0n1 open\n'
+                                 '0 /dev/nvme0n1 write 0 4096\n'
+                                 '1500 /dev/nvme0n1 read 8192 512\n'
+                                 '1500 /dev/nvme0n1 close\n')
+    # The output reads back as the same events
+    assert list(iolog.parse_iolog(output.getvalue().splitlines())) == events
+
+
+def test_convert(tmp_path):
+    trace = tmp_path / 'trace'
+    trace.write_text(BLKPARSE)
+    output = tmp_path / 'replay.iolog'
+    result = iolog.convert(str(trace), str(output), '/dev/nvme0n1',
+                           ops=['read', 'write'])
+    assert result['events'] == 2
+    assert output.read_text().splitlines()[3] == \
+        f'0 /dev/nvme0n1 write {2048 * 512} 4096'
@@ -0,0 +1,153 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import utils
+from tests import opal
+from tests import perf
+from tests import run
+from tests import scheduler
+
+import pytest
+import threading
+
+GIB = 1024 ** 3
+
+CONFIG = {'drive': {'name': 'nvme0'},
+          'test_config': {
+              'general': {'fio_runtime': 60, 'fio_ramptime': 10},
+              'perf_rand_read': {'iops': 1000},
+              'perf_rand_write': {'iops': 1000},
+              'perf_seq_read': {'bandwidth': 1000},
+              'partition_alignment': {}}}
+
+
+class StandInTest(run.Run):
+
+    def __init__(self, name, footprint):
+        self._name = name
+        self._footprint = footprint
+        super(StandInTest, self).__init__()
+
+    def name(self):
+        return self._name
+
+    def footprint(self):
+        return self._footprint
+
+
+def _names(batches):
+    return [[test.name() for test in batch] for batch in batches]
+
+
+@pytest.fixture
+def drive(monkeypatch):
+    # A drive with 10 GiB and a bit unallocated, recording the namespaces
+    # created on it
+    created = []
+
+    def bulk_create_namespace(device, size, block_size, quantity):
+        created.append((device, size, block_size, quantity))
+        return list(range(1, quantity + 1))
+
+    monkeypatch.setattr(utils, 'generate_resource_tree',
+                        lambda: {'nvme0': {'name': 'nvme0'}})
+    monkeypatch.setattr(utils, 'reset_drive', lambda controller: None)
+    monkeypatch.setattr(utils, 'get_unused_disk_size',
+                        lambda device: 10 * GIB + 12345)
+    monkeypatch.setattr(utils, 'bulk_create_namespace',
+                        bulk_create_namespace)
+    return created
+
+
+def test_footprints():
+    assert opal.OpalCapable(CONFIG).footprint() == run.FOOTPRINT_ADMIN
+    assert perf.RandRead(CONFIG).footprint() == run.FOOTPRINT_READ_ONLY
+    assert perf.SeqRead(CONFIG).footprint() == run.FOOTPRINT_READ_ONLY
+    assert perf.PartitionAlignment(CONFIG).footprint() == \
+        run.FOOTPRINT_NAMESPACE
+    # Tests with drive-wide thresholds keep the whole drive
+    assert perf.RandWrite(CONFIG).footprint() == run.FOOTPRINT_DRIVE
+
+
+def test_plan_drive_tests_run_alone():
+    tests = [StandInTest('a', run.FOOTPRINT_NAMESPACE),
+             StandInTest('b', run.FOOTPRINT_DRIVE),
+             StandInTest('c', run.FOOTPRINT_READ_ONLY),
+             StandInTest('d', run.FOOTPRINT_ADMIN),
+             StandInTest('e', run.FOOTPRINT_DRIVE)]
+    assert _names(scheduler.plan(tests, 4)) == [['a'], ['b'], ['c', 'd'],
+                                                ['e']]
+
+
+def test_plan_max_parallel():
+    tests = [StandInTest(name, run.FOOTPRINT_NAMESPACE) for name in 'abcde']
+    assert _names(scheduler.plan(tests, 2)) == [['a', 'b'], ['c', 'd'],
+                                                ['e']]
+    assert _names(scheduler.plan(tests, 1)) == [[name] for name in 'abcde']
+
+
+def test_plan_all_drive():
+    tests = [StandInTest(name, run.FOOTPRINT_DRIVE) for name in 'abc']
+    assert _names(scheduler.plan(tests, 4)) == [['a'], ['b'], ['c']]
+
+
+def test_provision_namespace_per_writer(drive):
+    batch = [StandInTest('a', run.FOOTPRINT_NAMESPACE),
+             StandInTest('b', run.FOOTPRINT_READ_ONLY),
+             StandInTest('c', run.FOOTPRINT_NAMESPACE),
+             StandInTest('d', run.FOOTPRINT_ADMIN)]
+    scheduler.provision('nvme0', batch)
+
+    # The capacity is split evenly and rounded down to whole MiB
+    assert drive == [('nvme0', 5 * GIB, 4096, 2)]
+    assert [test.namespace for test in batch] == ['nvme0n1', 'nvme0n1',
+                                                  'nvme0n2', None]
+
+
+def test_provision_readers_only(drive):
+    batch = [StandInTest('a', run.FOOTPRINT_READ_ONLY),
+             StandInTest('b', run.FOOTPRINT_READ_ONLY)]
+    scheduler.provision('nvme0', batch)
+    assert drive == [('nvme0', 10 * GIB, 4096, 1)]
+    assert [test.namespace for test in batch] == ['nvme0n1', 'nvme0n1']
+
+
+def test_provision_admin_only(drive):
+    batch = [StandInTest('a', run.FOOTPRINT_ADMIN)]
+    scheduler.provision('nvme0', batch)
+    assert drive == []
+    assert batch[0].namespace is None
+
+
+def test_run_batch_runs_together():
+    # Each test waits for all the others, so the batch only completes if
+    # they run at the same time
+    batch = [StandInTest(name, run.FOOTPRINT_NAMESPACE) for name in 'abc']
+    barrier = threading.Barrier(len(batch), timeout=10)
+    threads = []
+
+    def run_test(test):
+        threads.append(threading.current_thread().name)
+        barrier.wait()
+        return True
+
+    assert scheduler.run_batch(batch, run_test)
+    assert sorted(threads) == ['a', 'b', 'c']
+
+
+def test_run_batch_failure():
+    batch = [StandInTest(name, run.FOOTPRINT_NAMESPACE) for name in 'abc']
+    assert not scheduler.run_batch(batch,
+                                   lambda test: test.name() != 'b')
@@ -0,0 +1,134 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import events
+from nvme import sedutil
+
+import pytest
+
+# sedutil-cli --query of an Opal 2.0 drive, after initialSetup
+OPAL2_QUERY = """\
+/dev/nvme0 NVMe SAMPLE NVMe SSD 3.84TB                   1.2.3    S0MPLE0123456
+TPer function (0x0001)
+    ACKNAK = N, ASYNC = N. BufferManagement = N, comIDManagement  = N, \
+Streaming = Y, SYNC = Y
+Locking function (0x0002)
+    Locked = N, LockingEnabled = Y, LockingSupported = Y, MBRDone = N, \
+MBREnabled = N, MediaEncrypt = Y
+Geometry function (0x0003)
+    Align = Y, Alignment Granularity = 8 (4096), Logical Block size = 512, \
+Lowest Aligned LBA = 0
+SingleUser function (0x0201)
+    ALL = N, ANY = N, Policy = Y, Locking Objects = 9
+DataStore function (0x0202)
+    Max Tables = 9, Max Size Tables = 10485760, Table size alignment = 1
+OPAL 2.0 function (0x0203)
+    Base comID = 0x1000, Initial PIN = 0x0, Reverted PIN = 0x0, comIDs = 1
+    Locking Admins = 4, Locking Users = 9, Range Crossing = N
+Block SID Authentication function (0x0402)
+    SID Value State = Y, SID Blocked State = N, Hardware Reset = Y
+TPer Properties:
+  MaxComPacketSize = 131072  MaxResponseComPacketSize = 131072
+  MaxPacketSize = 131052  MaxIndTokenSize = 131016  MaxPackets = 1
+Host Properties:
+  MaxComPacketSize = 2048  MaxPacketSize = 2028
+"""
+
+# An enterprise (TCG Enterprise SSC) drive, locked
+ENTERPRISE_QUERY = """\
+/dev/nvme1 NVMe SAMPLE Enterprise SSD                    4.5.6    S0MPLE7654321
+TPer function (0x0001)
+    ACKNAK = N, ASYNC = N. BufferManagement = N, comIDManagement  = N, \
+Streaming = Y, SYNC = Y
+Locking function (0x0002)
+    Locked = Y, LockingEnabled = Y, LockingSupported = Y, MBRDone = N, \
+MBREnabled = N, MediaEncrypt = Y
+Enterprise function (0x0100)
+    Range crossing = Y, Base comID = 0x07FE, comIDs = 0x0001
+"""
+
+# A drive without TCG support
+NON_OPAL_QUERY = """\
+/dev/nvme2 NVMe SAMPLE Client SSD                        7.8.9    S0MPLE0000000
+"""
+
+
+def test_opal2():
+    state = sedutil.parse_query(OPAL2_QUERY)
+    assert state.tper and state.sync and state.streaming
+    assert state.locking_supported and state.locking_enabled
+    assert not state.locked
+    assert state.media_encrypt
+    assert not state.mbr_enabled and not state.mbr_done
+    assert state.align
+    assert state.alignment_granularity == 8
+    assert state.logical_block_size == 512
+    assert state.lowest_aligned_lba == 0
+    assert state.opal2 and not state.opal1 and not state.enterprise
+    assert state.base_comid == 0x1000
+    assert state.locking_admins == 4
+    assert state.locking_users == 9
+    assert not state.range_crossing
+    assert state.single_user_locking_objects == 9
+    assert state.block_sid_supported
+    assert state.sid_value_state and not state.is_default_msid
+    assert not state.sid_blocked
+    assert state.hardware_reset
+    assert state.features['DataStore']['Max Tables'] == '9'
+
+
+def test_enterprise():
+    state = sedutil.parse_query(ENTERPRISE_QUERY)
+    assert state.enterprise and not state.opal2
+    assert state.locked
+    assert state.base_comid == 0x07FE
+    assert not state.block_sid_supported
+    assert state.is_default_msid
+    assert state.single_user_locking_objects == 0
+
+
+def test_non_opal():
+    state = sedutil.parse_query(NON_OPAL_QUERY)
+    assert state == sedutil.OpalState()
+    assert not state.locking_supported
+
+
+def test_cache(monkeypatch):
+    queries = []
+
+    def query_drive(drive):
+        queries.append(drive)
+        return OPAL2_QUERY
+
+    monkeypatch.setattr(sedutil, 'query_drive', query_drive)
+    monkeypatch.setattr(sedutil, '_STATE_CACHE', {})
+    assert sedutil.check_opal_capability('nvme0')
+    assert not sedutil.is_locked('nvme0')
+    assert queries == ['nvme0']
+
+    # A controller reset may lock ranges, so the state is queried again
+    events.publish('controller_reset', controller='nvme1')
+    sedutil.get_state('nvme0')
+    assert queries == ['nvme0']
+    events.publish('controller_reset', controller='nvme0')
+    sedutil.get_state('nvme0')
+    assert queries == ['nvme0', 'nvme0']
+    sedutil.get_state('nvme0', refresh=True)
+    assert queries == ['nvme0'] * 3
+
+
+def test_reset_via_psid_requires_psid():
+    with pytest.raises(ValueError, match='PSID is required'):
+        sedutil.reset_via_psid('nvme0', None)
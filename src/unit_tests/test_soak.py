@@ -0,0 +1,59 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from tests import run
+from tests import soak
+
+import os
+
+CONFIG = {'drive': {'name': 'nvme0'},
+          'test_config': {'general': {}},
+          'soak': {'mode': 'suite'}}
+
+
+class StandInTest(run.Run):
+
+    def name(self):
+        return "stand_in"
+
+    def execute(self):
+        self.success = True
+
+
+def test_suite_pass_resets_tests(tmp_path):
+    # The suite hands back the same tests each pass, a hang in one pass
+    # must not fail the next
+    test = StandInTest()
+    passes = []
+
+    def run_suite():
+        passes.append(test.hung)
+        test.execute()
+        return [test]
+
+    soak_run = soak.Soak(CONFIG, str(tmp_path))
+    os.makedirs(soak_run.output_dir)
+    window = soak.Window(0)
+    soak_run._run_suite(window, run_suite)
+    test.hung = True
+    test.endurance = {'years': 1}
+    test.namespace = 'nvme0n2'
+    soak_run._run_suite(window, run_suite)
+
+    assert passes == [False, False]
+    assert test.endurance is None
+    assert test.namespace is None
+    assert test.result()
+    assert window.ops['stand_in']['failures'] == 0
@@ -0,0 +1,66 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import utils
+
+import json
+import pytest
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    # Stands in for nvme-cli, answering id-ns with the namespace data
+    issued = []
+    ns_data = {'nlbaf': 1, 'dpc': 0x17, 'dps': 0x2,
+               'lbafs': [{'ms': 0, 'ds': 9, 'rp': 0},
+                         {'ms': 8, 'ds': 12, 'rp': 1}]}
+
+    def run_cmd(command, fail_on_err=True, **kwargs):
+        issued.append(command)
+        if command[1] == 'id-ns':
+            return 0, json.dumps(ns_data), ''
+        return 0, 'create-ns: Success, created nsid:3', ''
+
+    monkeypatch.setattr(utils, 'run_cmd', run_cmd)
+    return issued
+
+
+def test_pi_types(commands):
+    assert utils.get_pi_types('nvme0', 1) == [1, 2, 3]
+    assert utils.get_pi_type('nvme0', 1) == 2
+    assert [lbaf['metadata_size'] for lbaf in
+            utils.get_lba_formats('nvme0', 1)] == [0, 8]
+
+
+def test_create_namespace_dps(commands):
+    create = getattr(utils, '__issue_create_namespace')
+    assert create('nvme0', 4096 * 10, 4096, 1, 2) == '3'
+    assert create('nvme0', 4096 * 10, 4096, None) == '3'
+    assert commands[0][-4:] == ['-f', '1', '-d', '2']
+    assert commands[1][-2:] == ['-b', '4096']
+
+
+def test_create_namespace_rejected(monkeypatch):
+    issued = []
+
+    def run_cmd(command, fail_on_err=True, **kwargs):
+        issued.append(command[1])
+        return 1, '', 'NVMe status: INVALID_FORMAT'
+
+    monkeypatch.setattr(utils, 'run_cmd', run_cmd)
+    assert utils.create_namespace('nvme0', 4096 * 10, flbas=1, dps=2,
+                                  fail_on_err=False) is None
+    # Nothing is attached when the drive rejects the namespace
+    assert issued == ['create-ns']
@@ -0,0 +1,116 @@
+# Copyright 2022 IBM Corp.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nvme import diagnostics
+from nvme import events
+from nvme import executor
+from nvme import utils
+from tests import run
+from tests import watchdog
+
+import pytest
+import stat
+import threading
+import time
+
+
+class StandInTest(run.Run):
+
+    def name(self):
+        return "stand_in"
+
+
+@pytest.fixture
+def never_exits(tmp_path, monkeypatch):
+    # Stands in for nvme-cli with a command that never exits
+    script = tmp_path / 'nvme'
+    script.write_text('#!/bin/sh\nexec sleep 600\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(utils, 'CMD_NVME', str(script))
+    return str(script)
+
+
+@pytest.fixture
+def hang_watchdog(tmp_path, monkeypatch):
+    # A watchdog with a short timeout, and no drive to capture or reset
+    resets = []
+    monkeypatch.setattr(diagnostics, 'get_io_completions',
+                        lambda drive: None)
+    monkeypatch.setattr(diagnostics, 'capture',
+                        lambda drive, output_dir: None)
+    monkeypatch.setattr(utils, 'reset_controller',
+                        lambda drive, timeout=None: resets.append(drive) or
+                        (0, '', ''))
+    monkeypatch.setattr(utils, 'wait_for_controller', lambda drive: drive)
+    dog = watchdog.Watchdog('nvme0', 1, str(tmp_path), interval=0.1)
+    dog.resets = resets
+    dog.start()
+    yield dog
+    dog.stop()
+
+
+def _in_thread(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_long_operation_limit():
+    with events.long_operation(0.2):
+        assert events.in_long_operation()
+        time.sleep(0.3)
+        assert not events.in_long_operation()
+        with events.long_operation(10):
+            assert events.in_long_operation()
+    assert not events.in_long_operation()
+
+
+def test_long_operation_counts_as_progress(never_exits, hang_watchdog):
+    test = StandInTest()
+    hang_watchdog.watch(test)
+    with events.long_operation(10):
+        time.sleep(2)
+    assert not test.hung
+    hang_watchdog.release(test)
+
+
+def test_long_operation_past_limit_hangs(never_exits, hang_watchdog):
+    # A format that never finishes is killed once past its limit
+    test = StandInTest()
+    hang_watchdog.watch(test)
+    results = []
+
+    def format_forever():
+        with events.long_operation(0.5):
+            results.append(utils.run_cmd([never_exits], fail_on_err=False))
+
+    thread = _in_thread(format_forever)
+    thread.join(10)
+    assert not thread.is_alive()
+    assert test.hung
+    assert not test.result()
+    assert results[0][0] != 0
+    assert hang_watchdog.resets == ['nvme0']
+
+
+def test_format_timeout(never_exits, monkeypatch):
+    # Without a watchdog, the format is killed at its limit
+    monkeypatch.setattr(events, 'LONG_OPERATION_LIMIT', 1)
+    start = time.monotonic()
+    rc, out, err = utils.format_namespace('nvme0', 1, test=True)
+    assert rc != 0
+    assert time.monotonic() - start < 10
+    with pytest.raises(executor.CommandTimeout):
+        utils.format_namespace('nvme0', 1)